@@ -0,0 +1,194 @@
+"""Append-only audit log of admin actions, hash-chained for tamper evidence.
+
+Every worker writes its own chain (``chain`` = the worker id): entry ``n``
+stores the hash of entry ``n - 1`` and its own hash covers that link and all
+of its fields, so editing, removing or reordering an entry breaks every hash
+after it. The hash is an HMAC when a key is configured, which means entries
+can't be re-forged consistently without it. ``audit_chains`` keeps each
+chain's last sequence number and hash, so cutting entries off the end of a
+chain shows up as well.
+
+``record`` is synchronous: the entry is hashed and queued in memory, and a
+group commit writes the queue with one ``insert_many`` at most ``max_delay``
+seconds later (sooner once ``max_batch`` entries are waiting). Admin requests
+don't wait for the write. Queued entries are lost only if the process dies
+within that window; a failed write is retried in order.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+from datetime import datetime, timezone
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError
+
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+AUDIT_ENTRIES = Counter("audit_entries_total", "Audit log entries by action", ("action",))
+AUDIT_FLUSH_SIZE = Histogram("audit_flush_entries", "Entries written per group commit", (),
+                             buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500))
+
+HASHED_FIELDS = ("chain", "seq", "at", "actor_id", "actor_email", "action", "target_type", "target_id", "details", "prev_hash")
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return _iso(value)
+    return str(value)
+
+
+def _iso(value: datetime) -> str:
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    # BSON dates keep milliseconds, so that's all the hash may depend on
+    return value.astimezone(timezone.utc).isoformat(timespec="milliseconds")
+
+
+def canonical(entry: dict) -> bytes:
+    fields = {f: entry.get(f) for f in HASHED_FIELDS}
+    fields["at"] = _iso(fields["at"])
+    return json.dumps(fields, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=_json_default).encode()
+
+
+def entry_hash(entry: dict, key: bytes = b"") -> str:
+    body = canonical(entry)
+    if key:
+        return hmac.new(key, body, hashlib.sha256).hexdigest()
+    return hashlib.sha256(body).hexdigest()
+
+
+class AuditLog:
+    def __init__(self, collection, heads, chain: str, key: bytes = b"", max_delay: float = 0.05, max_batch: int = 500):
+        self.collection = collection
+        self.heads = heads
+        self.chain = chain
+        self.key = key
+        self.max_delay = max_delay
+        self.max_batch = max_batch
+        self._seq = 0
+        self._last_hash = ""
+        self._buffer = []
+        self._flusher = None
+        self._full = asyncio.Event()
+        self._lock = asyncio.Lock()
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("chain", ASCENDING), ("seq", ASCENDING)], unique=True)
+        await self.collection.create_index([("at", DESCENDING)])
+        await self.collection.create_index([("target_id", ASCENDING), ("at", DESCENDING)])
+        await self.collection.create_index([("actor_id", ASCENDING), ("at", DESCENDING)])
+
+    def record(self, actor: dict, action: str, target_type: str, target_id: str, details: dict = None) -> dict:
+        """Append an entry to this worker's chain; it is written by the next group commit."""
+        now = datetime.now(timezone.utc)
+        self._seq += 1
+        entry = {
+            "chain": self.chain, "seq": self._seq,
+            "at": now.replace(microsecond=now.microsecond // 1000 * 1000),
+            "actor_id": actor.get("user_id", ""), "actor_email": actor.get("email", ""),
+            "action": action, "target_type": target_type, "target_id": target_id,
+            "details": details or {}, "prev_hash": self._last_hash,
+        }
+        entry["hash"] = self._last_hash = entry_hash(entry, self.key)
+        self._buffer.append(entry)
+        AUDIT_ENTRIES.inc(action)
+        self._schedule(0 if len(self._buffer) >= self.max_batch else self.max_delay)
+        return entry
+
+    def _schedule(self, delay: float):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._run_flusher(delay))
+        elif delay == 0:
+            # A full batch doesn't wait out the timer
+            self._full.set()
+
+    async def _run_flusher(self, delay: float):
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            while not await self.flush():
+                await asyncio.sleep(1)
+            # Entries recorded while the write was in flight go in the next group
+            if not self._buffer:
+                return
+            delay = 0 if len(self._buffer) >= self.max_batch else self.max_delay
+
+    async def flush(self) -> bool:
+        """Write everything queued so far; False if the write failed (the entries stay queued)."""
+        async with self._lock:
+            batch, self._buffer = self._buffer, []
+            if not batch:
+                return True
+            try:
+                try:
+                    await self.collection.insert_many(batch, ordered=False)
+                except BulkWriteError as e:
+                    # Entries that reached the database before an earlier failed attempt
+                    if any(err["code"] != 11000 for err in e.details.get("writeErrors", [])):
+                        raise
+                last = batch[-1]
+                await self.heads.update_one({"_id": self.chain}, {
+                    "$set": {"last_seq": last["seq"], "last_hash": last["hash"], "updated_at": last["at"]},
+                    "$setOnInsert": {"started_at": batch[0]["at"]}
+                }, upsert=True)
+            except Exception as e:
+                self._buffer = batch + self._buffer
+                logger.warning(f"Denetim kayitlari yazilamadi, tekrar denenecek ({len(self._buffer)} kayit): {e}")
+                return False
+            for entry in batch:
+                entry.pop("_id", None)
+            AUDIT_FLUSH_SIZE.observe(len(batch))
+            return True
+
+    async def close(self, timeout: float = 5):
+        """Write what is still queued; used at shutdown."""
+        self._schedule(0)
+        try:
+            await asyncio.wait_for(self._flusher, timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Kapanista denetim kayitlari yazilamadi: {len(self._buffer)} kayit")
+
+
+async def verify_chain(collection, chain: str, key: bytes = b"", head: dict = None, batch_size: int = 1000) -> dict:
+    """Stream one chain in order and check sequence, links and hashes.
+
+    Returns ``{"chain", "entries", "ok", "last_hash"}`` plus ``error`` and
+    ``seq`` for the first problem found.
+    """
+    expected_seq, prev_hash, count = 1, "", 0
+
+    def result(error: str = None, seq: int = None):
+        outcome = {"chain": chain, "entries": count, "ok": error is None, "last_hash": prev_hash}
+        if error:
+            outcome.update(error=error, seq=seq)
+        return outcome
+
+    cursor = collection.find({"chain": chain}, {"_id": 0}).sort("seq", ASCENDING).batch_size(batch_size)
+    async for doc in cursor:
+        if doc["seq"] != expected_seq:
+            return result("missing_entry" if doc["seq"] > expected_seq else "duplicate_entry", expected_seq)
+        if doc.get("prev_hash") != prev_hash:
+            return result("broken_link", doc["seq"])
+        if not hmac.compare_digest(entry_hash(doc, key), doc.get("hash", "")):
+            return result("hash_mismatch", doc["seq"])
+        prev_hash = doc["hash"]
+        expected_seq += 1
+        count += 1
+    if head and head.get("last_seq", 0) > count:
+        return result("truncated", count + 1)
+    if head and head.get("last_seq") == count and head.get("last_hash") != prev_hash:
+        return result("head_mismatch", count)
+    return result()
+
+
+async def verify_all(collection, heads, key: bytes = b"") -> list:
+    """Verify every chain listed in ``heads``."""
+    return [await verify_chain(collection, head["_id"], key, head)
+            async for head in heads.find({}).sort("started_at", ASCENDING)]
@@ -0,0 +1,69 @@
+"""Bytes on the wire and latency of API responses by negotiation mode.
+
+Requests every endpoint ``--repeat`` times per mode against a running server:
+
+* ``identity``   - no compression, full body (the behaviour before the middleware)
+* ``gzip``/``br`` - compressed body
+* ``revalidate`` - conditional GET with the ETag from the first response (304)
+
+    python bench_http.py --base-url http://localhost:8001 --email admin@alarkoenerji.com --password admin123
+"""
+import argparse
+import os
+import statistics
+import time
+
+import requests
+
+PUBLIC_ENDPOINTS = ("/api/projects", "/api/projects?type=GES", "/api/banks", "/api/usd-rate")
+ADMIN_ENDPOINTS = ("/api/admin/users", "/api/admin/transactions", "/api/admin/portfolios", "/api/admin/kyc")
+MODES = ("identity", "gzip", "br", "revalidate")
+
+
+def measure(session, url: str, headers: dict, repeat: int):
+    sizes, latencies, status = [], [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = session.get(url, headers=headers, stream=True)
+        # Undecoded body, i.e. what actually crossed the network
+        raw = response.raw.read(decode_content=False)
+        latencies.append((time.perf_counter() - start) * 1000)
+        sizes.append(len(raw))
+        status = response.status_code
+    latencies.sort()
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    return status, statistics.median(sizes), statistics.median(latencies), p95
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sikistirma ve ETag oncesi/sonrasi yanit boyutu ve gecikme olcumu")
+    parser.add_argument("--base-url", default=os.environ.get("REACT_APP_BACKEND_URL", "http://localhost:8001"))
+    parser.add_argument("--email", help="Admin endpoint'leri icin admin e-postasi")
+    parser.add_argument("--password")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    session = requests.Session()
+    auth = {}
+    endpoints = list(PUBLIC_ENDPOINTS)
+    if args.email:
+        token = session.post(f"{args.base_url}/api/auth/login", json={"email": args.email, "password": args.password}).json()["token"]
+        auth = {"Authorization": f"Bearer {token}"}
+        endpoints += ADMIN_ENDPOINTS
+
+    print(f"{'endpoint':32} {'mode':10} {'status':>6} {'bytes':>9} {'p50 ms':>8} {'p95 ms':>8}")
+    for path in endpoints:
+        url = args.base_url + path
+        etag = session.get(url, headers=auth).headers.get("ETag", "")
+        for mode in MODES:
+            headers = dict(auth)
+            if mode == "revalidate":
+                headers.update({"Accept-Encoding": "gzip, br", "If-None-Match": etag})
+            else:
+                headers["Accept-Encoding"] = mode
+            status, size, p50, p95 = measure(session, url, headers, args.repeat)
+            print(f"{path:32} {mode:10} {status:>6} {size:>9.0f} {p50:>8.1f} {p95:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
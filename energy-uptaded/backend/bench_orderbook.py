@@ -0,0 +1,87 @@
+"""Throughput and latency of the in-memory matching engine on one core.
+
+Generates a random order flow (limit orders around ``SHARE_PRICE`` on a few
+projects, with a share of them cancelled later) and feeds it through
+``MatchingEngine`` on a single thread, without any database:
+
+    python bench_orderbook.py --orders 200000 --projects 4 --cancel-ratio 0.2
+
+Reports sustained orders/sec and per-operation latency percentiles. The
+latency is the matching alone; in the server, persisting a batch adds one
+bulk write per collection.
+"""
+import argparse
+import random
+import statistics
+import time
+
+from orderbook import BUY, SELL, MatchingEngine, Order
+
+SHARE_PRICE = 25000
+
+
+def order_flow(count: int, projects: int, users: int, spread_ticks: int, tick: float, cancel_ratio: float, seed: int):
+    rng = random.Random(seed)
+    flow = []
+    for i in range(count):
+        side = BUY if rng.random() < 0.5 else SELL
+        # Buyers bid below the reference price and sellers ask above it, overlapping near the middle
+        offset = rng.randint(-spread_ticks, spread_ticks // 2) if side == BUY else rng.randint(-spread_ticks // 2, spread_ticks)
+        order = Order(f"o{i}", f"u{rng.randrange(users)}", f"p{rng.randrange(projects)}", side,
+                      SHARE_PRICE + offset * tick, rng.randint(1, 10))
+        flow.append(("submit", order))
+        if rng.random() < cancel_ratio:
+            # Cancel a recent order later in the flow (it may have filled by then)
+            flow.append(("cancel", flow[rng.randrange(max(0, len(flow) - 200), len(flow))][1]))
+    return flow
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Emir eslestirme motoru tek cekirdek verim ve gecikme olcumu")
+    parser.add_argument("--orders", type=int, default=200000)
+    parser.add_argument("--projects", type=int, default=4)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--spread-ticks", type=int, default=50, help="Fiyatlarin referans fiyattan en fazla kac adim uzaklasacagi")
+    parser.add_argument("--tick", type=float, default=10.0, help="Fiyat adimi (TL)")
+    parser.add_argument("--cancel-ratio", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    flow = order_flow(args.orders, args.projects, args.users, args.spread_ticks, args.tick, args.cancel_ratio, args.seed)
+    engine = MatchingEngine()
+    latencies = {"submit": [], "cancel": []}
+    fills = traded = 0
+    clock = time.perf_counter_ns
+
+    started = clock()
+    for action, order in flow:
+        t0 = clock()
+        if action == "submit":
+            matched = engine.submit(order)
+        else:
+            engine.cancel(order.project_id, order.order_id)
+            matched = ()
+        latencies[action].append(clock() - t0)
+        fills += len(matched)
+        traded += sum(f.quantity for f in matched)
+    elapsed = (clock() - started) / 1e9
+
+    print(f"operations     {len(flow):>12,}   ({args.orders:,} orders, {len(latencies['cancel']):,} cancels)")
+    print(f"elapsed        {elapsed:>12.3f} s")
+    print(f"throughput     {len(flow) / elapsed:>12,.0f} ops/s   ({args.orders / elapsed:,.0f} orders/s)")
+    print(f"fills          {fills:>12,}   ({traded:,} shares)")
+    print(f"resting        {engine.resting():>12,}")
+    for action, values in latencies.items():
+        if not values:
+            continue
+        values.sort()
+        print(f"{action:8} latency  p50 {percentile(values, 0.5) / 1000:>7.1f} us  p99 {percentile(values, 0.99) / 1000:>7.1f} us  "
+              f"p99.9 {percentile(values, 0.999) / 1000:>7.1f} us  mean {statistics.fmean(values) / 1000:>7.1f} us")
+
+
+if __name__ == "__main__":
+    main()
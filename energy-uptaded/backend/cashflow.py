@@ -0,0 +1,137 @@
+"""Platform cash-flow rollups by local day, type and status.
+
+Every deposit or withdrawal request, its approval or rejection, every
+investment, sale to the platform and settled market trade ``$inc``s the
+amount and count of its ``(type, status)`` pair in the ``cash_flow_daily``
+document of the local day it happened. A report over any range reads one
+document per day and downsamples with ``rollups.downsample``.
+
+Transactions, portfolio lots and trades carry ``in_cash_flow: True`` once counted.
+Older ones are counted from what their documents still show (request time,
+review time when recorded, current status), once, by the server's startup
+backfill or by hand:
+
+    python cashflow.py --batch-size 1000
+
+Lots sold before the backfill ran are gone and their flows can't be recovered.
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from pymongo.errors import DuplicateKeyError
+
+from migrations import as_utc
+from rollups import day_key
+
+logger = logging.getLogger("cashflow")
+
+CASH_FLOWS = {
+    "deposit": ("requested", "approved", "rejected"),
+    "withdrawal": ("requested", "approved", "rejected"),
+    "investment": ("completed",),
+    "sale": ("completed",),
+    "trade": ("completed",),
+}
+FIELDS = tuple(f"{t}_{s}_{m}" for t, statuses in CASH_FLOWS.items() for s in statuses for m in ("amount", "count"))
+TRANSACTION_FIELDS = {"_id": 0, "type": 1, "amount": 1, "status": 1, "created_at": 1, "reviewed_at": 1, "approved_by": 1}
+LOT_FIELDS = {"_id": 0, "amount": 1, "purchase_date": 1, "trade_id": 1}
+TRADE_FIELDS = {"_id": 0, "price": 1, "quantity": 1, "executed_at": 1}
+# (collection, key, filter, fields); unsettled trades are counted when they settle
+BACKFILL_SOURCES = (
+    ("transactions", "transaction_id", {}, TRANSACTION_FIELDS),
+    ("portfolios", "portfolio_id", {}, LOT_FIELDS),
+    ("trades", "trade_id", {"settled": True}, TRADE_FIELDS),
+)
+
+
+def flow_delta(type: str, status: str, amount: float, count: int = 1) -> dict:
+    """``$inc`` fields for one flow; empty for a pair that isn't tracked."""
+    if status not in CASH_FLOWS.get(type, ()):
+        return {}
+    return {f"{type}_{status}_amount": amount, f"{type}_{status}_count": count}
+
+
+def transaction_events(txn: dict) -> list:
+    """``(status, at)`` events of a transaction written before rollups existed."""
+    created = as_utc(txn.get('created_at'))
+    if txn.get('status') == 'approved' and txn.get('approved_by') and not txn.get('reviewed_at'):
+        # Admin balance adjustments are written approved, without a request
+        return [("approved", created)]
+    events = [("requested", created)]
+    if txn.get('status') in ("approved", "rejected"):
+        # Single reviews didn't record their time before reviewed_at was added
+        events.append((txn['status'], as_utc(txn.get('reviewed_at')) or created))
+    return events
+
+
+def shape(point: dict) -> dict:
+    """Nest a flat day or period as ``{type: {status: {amount, count}}}`` and add the net cash moved in."""
+    shaped = {"period": point["period"]} if "period" in point else {"day": point["day"]}
+    for t, statuses in CASH_FLOWS.items():
+        shaped[t] = {s: {"amount": round(point.get(f"{t}_{s}_amount", 0), 2), "count": point.get(f"{t}_{s}_count", 0)}
+                     for s in statuses}
+    shaped["net_deposits"] = round(point.get("deposit_approved_amount", 0) - point.get("withdrawal_approved_amount", 0), 2)
+    return shaped
+
+
+async def record(db, tz, type: str, status: str, amount: float, at: datetime = None, count: int = 1):
+    """Add one flow to the bucket of its local day."""
+    delta = flow_delta(type, status, amount, count)
+    if not delta:
+        return
+    day = day_key(at or datetime.now(timezone.utc), tz)
+    for attempt in range(2):
+        try:
+            await db.cash_flow_daily.update_one({"_id": day}, {"$inc": delta, "$setOnInsert": {"day": day}}, upsert=True)
+            return
+        except DuplicateKeyError:
+            # Two upserts raced to create the bucket; the retry updates the winner's document
+            if attempt:
+                raise
+
+
+def backfill_events(source: str, doc: dict) -> list:
+    """``(type, status, amount, at)`` flows of a document from before the rollups."""
+    if source == "transactions":
+        return [(doc.get('type'), status, doc.get('amount', 0), at) for status, at in transaction_events(doc)]
+    if source == "trades":
+        return [("trade", "completed", round(doc['price'] * doc['quantity'], 2), as_utc(doc.get('executed_at')))]
+    # Market lots come from trades, which are counted on their own
+    return [] if doc.get('trade_id') else [("investment", "completed", doc.get('amount', 0), as_utc(doc.get('purchase_date')))]
+
+
+async def backfill(db, tz, batch_size: int = 1000) -> dict:
+    """Count documents written before the rollups; returns how many of each collection."""
+    counted = {}
+    for source, key, query, fields in BACKFILL_SOURCES:
+        collection, total = db[source], 0
+        while True:
+            batch = await collection.find({**query, "in_cash_flow": {"$ne": True}}, {"_id": 0, key: 1}).limit(batch_size).to_list(batch_size)
+            if not batch:
+                break
+            for row in batch:
+                # Flag and read in one step: a review after this point sees the flag and records itself
+                doc = await collection.find_one_and_update({key: row[key], "in_cash_flow": {"$ne": True}}, {"$set": {"in_cash_flow": True}},
+                                                           projection=fields)
+                for type, status, amount, at in backfill_events(source, doc) if doc else ():
+                    await record(db, tz, type, status, amount, at)
+            total += len(batch)
+        counted[source] = total
+    if any(counted.values()):
+        logger.info(f"Nakit akisi verisi dolduruldu: {counted}")
+    return counted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Nakit akisi gunluk toplamlarini mevcut islem ve yatirimlardan doldurur")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    from server import db, ROLLUP_TZ
+    asyncio.run(backfill(db, ROLLUP_TZ, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Cross-worker coordination on MongoDB: leases and a shared key/value cache.
+
+Every uvicorn worker is a separate process, so anything that must happen once
+(seeding, FX refresh) takes a ``Lease``, and values that all workers must
+agree on live in ``SharedCache`` with a short in-process read-through copy.
+"""
+import os
+import socket
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class Lease:
+    def __init__(self, collection, name: str, ttl_seconds: float, owner: str = WORKER_ID):
+        self.collection = collection
+        self.name = name
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.owner = owner
+
+    async def acquire(self) -> bool:
+        """Take or renew the lease. Returns False if another worker holds it."""
+        now = datetime.now(timezone.utc)
+        try:
+            await self.collection.find_one_and_update(
+                {"_id": self.name, "$or": [{"owner": self.owner}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": self.owner, "expires_at": now + self.ttl, "renewed_at": now}},
+                upsert=True, return_document=ReturnDocument.AFTER
+            )
+            return True
+        except DuplicateKeyError:
+            # The lease document exists and belongs to someone else
+            return False
+
+    async def release(self):
+        await self.collection.delete_one({"_id": self.name, "owner": self.owner})
+
+    async def __aenter__(self):
+        return await self.acquire()
+
+    async def __aexit__(self, *exc):
+        await self.release()
+
+
+class SharedCache:
+    def __init__(self, collection, local_ttl_seconds: float = 30):
+        self.collection = collection
+        self.local_ttl = local_ttl_seconds
+        self._local = {}
+
+    async def get(self, key: str, default=None):
+        return (await self.get_entry(key) or {}).get("value", default)
+
+    async def get_entry(self, key: str):
+        """Full entry (value and updated_at), served from process memory while fresh."""
+        cached = self._local.get(key)
+        if cached and time.monotonic() - cached[0] < self.local_ttl:
+            return cached[1]
+        entry = await self.collection.find_one({"_id": key}, {"_id": 0})
+        self._local[key] = (time.monotonic(), entry)
+        return entry
+
+    async def set(self, key: str, value):
+        entry = {"value": value, "updated_at": datetime.now(timezone.utc).isoformat(), "updated_by": WORKER_ID}
+        await self.collection.update_one({"_id": key}, {"$set": entry}, upsert=True)
+        self._local[key] = (time.monotonic(), entry)
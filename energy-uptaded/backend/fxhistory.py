@@ -0,0 +1,128 @@
+"""Exchange rate history: every fetched rate is kept, not just the latest.
+
+Each sample is appended to ``fx_rates`` (a MongoDB time-series collection
+where the server supports one). Every worker also holds the samples in two
+parallel sorted arrays in process memory, so "which rate was in force at T"
+is a ``bisect`` over the timestamps instead of a query, and a restarted
+worker knows the last persisted rate before the first fetch succeeds.
+
+Only the worker that fetched a rate writes it; the others pick new samples
+up with ``sync``, which reads only what is newer than their last sample.
+"""
+import time
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime, timezone
+
+from pymongo import ASCENDING
+from pymongo.errors import CollectionInvalid, OperationFailure
+
+
+class RateHistory:
+    def __init__(self, collection, pair: str = "USD/TRY", sync_interval_seconds: float = 30):
+        self.collection = collection
+        self.pair = pair
+        self.sync_interval = sync_interval_seconds
+        # Epoch seconds (sorted) and the rate observed at each
+        self._times = []
+        self._rates = []
+        self._synced_at = None
+
+    def __len__(self):
+        return len(self._times)
+
+    async def ensure_collection(self):
+        db = self.collection.database
+        try:
+            await db.create_collection(self.collection.name, timeseries={"timeField": "at", "metaField": "pair", "granularity": "hours"})
+        except CollectionInvalid:
+            pass  # Already exists
+        except OperationFailure:
+            pass  # Server without time-series collections (< 5.0): a plain collection works the same
+        await self.collection.create_index([("pair", ASCENDING), ("at", ASCENDING)])
+
+    def add(self, at: datetime, rate: float):
+        ts = at.timestamp()
+        if self._times and ts >= self._times[-1]:
+            # The usual case: samples arrive in time order
+            if ts == self._times[-1]:
+                self._rates[-1] = rate
+                return
+            self._times.append(ts)
+            self._rates.append(rate)
+            return
+        i = bisect_left(self._times, ts)
+        if i < len(self._times) and self._times[i] == ts:
+            self._rates[i] = rate
+        else:
+            insort(self._times, ts)
+            self._rates.insert(i, rate)
+
+    async def record(self, rate: float, source: str = "", at: datetime = None):
+        at = at or datetime.now(timezone.utc)
+        await self.collection.insert_one({"pair": self.pair, "at": at, "rate": rate, "source": source})
+        self.add(at, rate)
+
+    async def load(self):
+        """Read samples newer than the last one held (everything on the first call)."""
+        query = {"pair": self.pair}
+        if self._times:
+            query["at"] = {"$gt": datetime.fromtimestamp(self._times[-1], timezone.utc)}
+        async for doc in self.collection.find(query, {"_id": 0, "at": 1, "rate": 1}).sort("at", ASCENDING):
+            self.add(_utc(doc["at"]), doc["rate"])
+        self._synced_at = time.monotonic()
+
+    async def sync(self):
+        """``load`` at most once per ``sync_interval`` seconds."""
+        if self._synced_at is None or time.monotonic() - self._synced_at >= self.sync_interval:
+            await self.load()
+
+    def latest(self):
+        """``(at, rate)`` of the newest sample, or None."""
+        if not self._times:
+            return None
+        return datetime.fromtimestamp(self._times[-1], timezone.utc), self._rates[-1]
+
+    def rate_at(self, at: datetime):
+        """``(effective_at, rate)`` of the last sample at or before ``at``, or None before the first."""
+        i = bisect_right(self._times, at.timestamp()) - 1
+        if i < 0:
+            return None
+        return datetime.fromtimestamp(self._times[i], timezone.utc), self._rates[i]
+
+    def series(self, start: datetime, end: datetime, max_points: int) -> list:
+        """Rates between ``start`` and ``end`` in at most ``max_points`` equal-width buckets.
+
+        Each bucket reports the rate in force at its end (``rate``) and the
+        lowest/highest rate seen in it; buckets without samples carry the
+        previous rate forward, so the series is a step function like the rate.
+        """
+        lo, hi = start.timestamp(), end.timestamp()
+        if hi <= lo or max_points < 1:
+            return []
+        width = (hi - lo) / max_points
+        # Last sample strictly before the window: the rate in force when it opens
+        first = bisect_left(self._times, lo) - 1
+        current = self._rates[first] if first >= 0 else None
+        i = first + 1
+        points = []
+        for n in range(max_points):
+            last = n == max_points - 1
+            bucket_end = hi if last else lo + width * (n + 1)
+            low = high = current
+            samples = 0
+            # Buckets are [start, end); the last one also takes a sample exactly at ``end``
+            while i < len(self._times) and (self._times[i] < bucket_end or (last and self._times[i] == hi)):
+                current = self._rates[i]
+                low = current if low is None else min(low, current)
+                high = current if high is None else max(high, current)
+                samples += 1
+                i += 1
+            if current is None:
+                continue  # Before the first sample
+            points.append({"at": datetime.fromtimestamp(lo + width * n, timezone.utc), "rate": current,
+                           "low": low, "high": high, "samples": samples})
+        return points
+
+
+def _utc(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
@@ -0,0 +1,159 @@
+"""Response compression and HTTP validators for the JSON API.
+
+``HTTPCacheMiddleware`` buffers JSON/text responses and then:
+
+* gives successful GETs a weak ETag (hash of the uncompressed body) and answers
+  a matching ``If-None-Match`` with an empty 304;
+* adds the ``Cache-Control`` policy the endpoint declared with ``@cache_control``;
+* compresses bodies above ``min_size`` with brotli (if the ``brotli`` package is
+  installed) or gzip, following the client's ``Accept-Encoding``.
+
+Other responses (uploaded files, already encoded or streamed bodies) pass
+through untouched.
+"""
+import asyncio
+import gzip
+import hashlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from metrics import Counter, route_label
+
+HTTP_BODY_BYTES = Counter("http_response_body_bytes_total", "Response body bytes before and after compression by route", ("route", "stage"))
+HTTP_NOT_MODIFIED = Counter("http_not_modified_total", "GET requests answered with 304 Not Modified by route", ("route",))
+
+COMPRESSIBLE_TYPES = (b"application/json", b"text/")
+# Larger bodies are compressed on a thread so the event loop keeps serving
+THREAD_COMPRESS_BYTES = 64 * 1024
+
+
+def cache_control(policy: str):
+    """Declare the ``Cache-Control`` header for an endpoint, e.g. ``"public, max-age=60"``."""
+    def decorator(fn):
+        fn.__cache_control__ = policy
+        return fn
+    return decorator
+
+
+def weak_etag(body: bytes) -> str:
+    return 'W/"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison (RFC 9110 13.1.2) against a comma-separated If-None-Match."""
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in if_none_match.split(","))
+
+
+def accepted_encodings(accept_encoding: str) -> set:
+    accepted = set()
+    for part in accept_encoding.lower().split(","):
+        coding, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) == 0:
+                    continue
+            except ValueError:
+                continue
+        if coding:
+            accepted.add(coding.strip())
+    return accepted
+
+
+def choose_encoding(accept_encoding: str):
+    accepted = accepted_encodings(accept_encoding)
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str, gzip_level: int = 6, brotli_quality: int = 4) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=brotli_quality)
+    # mtime=0 keeps the output identical for identical bodies
+    return gzip.compress(body, compresslevel=gzip_level, mtime=0)
+
+
+class HTTPCacheMiddleware:
+    def __init__(self, app, min_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 4):
+        self.app = app
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_headers = dict(scope["headers"])
+        start = None
+        chunks = []
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, passthrough
+            if passthrough:
+                await send(message)
+                return
+            if message["type"] == "http.response.start":
+                headers = dict(message.get("headers", []))
+                content_type = headers.get(b"content-type", b"")
+                if b"content-encoding" in headers or not content_type.startswith(COMPRESSIBLE_TYPES):
+                    passthrough = True
+                    await send(message)
+                    return
+                start = message
+                return
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                await self._finish(scope, request_headers, start, b"".join(chunks), send)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def _finish(self, scope, request_headers: dict, start: dict, body: bytes, send):
+        route = route_label(scope)
+        status = start["status"]
+        headers, vary = [], [b"Accept-Encoding"]
+        for k, v in start.get("headers", []):
+            if k.lower() == b"vary":
+                vary.insert(0, v)
+            elif k.lower() not in (b"content-length", b"etag"):
+                headers.append((k, v))
+        vary = (b"vary", b", ".join(vary))
+        names = {k.lower() for k, _ in headers}
+
+        policy = getattr(scope.get("endpoint"), "__cache_control__", None)
+        if policy and status == 200 and b"cache-control" not in names:
+            headers.append((b"cache-control", policy.encode()))
+        if scope["method"] in ("GET", "HEAD") and status == 200:
+            etag = weak_etag(body)
+            headers.append((b"etag", etag.encode()))
+            if_none_match = request_headers.get(b"if-none-match")
+            if if_none_match is not None and etag_matches(if_none_match.decode("latin-1"), etag):
+                HTTP_NOT_MODIFIED.inc(route)
+                # Keep CORS and caching headers, drop the ones that describe the body
+                not_modified = [(k, v) for k, v in headers if k.lower() != b"content-type"]
+                await send({"type": "http.response.start", "status": 304, "headers": not_modified + [vary]})
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+        HTTP_BODY_BYTES.inc(route, "uncompressed", amount=len(body))
+        encoding = choose_encoding(request_headers.get(b"accept-encoding", b"").decode("latin-1")) if len(body) >= self.min_size else None
+        if encoding:
+            if len(body) >= THREAD_COMPRESS_BYTES:
+                body = await asyncio.to_thread(compress, body, encoding, self.gzip_level, self.brotli_quality)
+            else:
+                body = compress(body, encoding, self.gzip_level, self.brotli_quality)
+            headers.append((b"content-encoding", encoding.encode()))
+        HTTP_BODY_BYTES.inc(route, "sent", amount=len(body))
+        headers += [vary, (b"content-length", str(len(body)).encode())]
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": body if scope["method"] != "HEAD" else b""})
@@ -0,0 +1,209 @@
+"""Idempotency-Key support for money-moving POST endpoints.
+
+A client sends the same ``Idempotency-Key`` header on every retry of one
+logical request. The first request claims the key with an in-flight record
+and runs normally; its response is stored and replayed byte for byte to any
+retry, so the handler runs at most once per key. Duplicates that arrive while
+the first is still running wait for its result instead of racing it. Keys are
+scoped per user and expire through a TTL index.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+from datetime import datetime, timezone, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_REQUESTS = Counter("idempotency_requests_total", "Requests carrying an Idempotency-Key by route and outcome", ("route", "outcome"))
+
+MAX_KEY_LENGTH = 255
+# Not a result of the business logic (auth, throttling) or a server failure: the retry must run again
+UNCACHEABLE_STATUSES = {401, 403, 408, 429}
+REPLAYED_HEADERS = (b"content-type",)
+
+
+def fingerprint(method: str, path: str, body: bytes) -> str:
+    return hashlib.sha256(method.encode() + b" " + path.encode() + b"\n" + body).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self, collection, ttl_seconds: float = 86400, lock_seconds: float = 30):
+        self.collection = collection
+        self.ttl = ttl_seconds
+        self.lock = lock_seconds
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def begin(self, key: str, request_hash: str):
+        """Claim ``key``. Returns ``("acquired", None)`` or ``(state, record)`` with
+        state ``completed``, ``in_flight`` or ``mismatch`` (key reused for another body)."""
+        now = datetime.now(timezone.utc)
+        for _ in range(2):
+            try:
+                await self.collection.insert_one({
+                    "_id": key, "fingerprint": request_hash, "status": "in_flight",
+                    "locked_until": now + timedelta(seconds=self.lock),
+                    "created_at": now, "expires_at": now + timedelta(seconds=self.ttl)
+                })
+                return "acquired", None
+            except DuplicateKeyError:
+                record = await self.collection.find_one({"_id": key})
+            if record:
+                break
+            # Expired between the insert and the read; claim it again
+        else:
+            return "in_flight", None
+        if record["fingerprint"] != request_hash:
+            return "mismatch", record
+        if record["status"] == "completed":
+            return "completed", record
+        if record["locked_until"].replace(tzinfo=timezone.utc) < now:
+            # The worker that held the lock died mid-request; take over
+            taken = await self.collection.update_one(
+                {"_id": key, "status": "in_flight", "locked_until": record["locked_until"]},
+                {"$set": {"locked_until": now + timedelta(seconds=self.lock)}}
+            )
+            if taken.modified_count:
+                logger.warning(f"Idempotency kilidi suresi dolmus, istek yeniden calistiriliyor: {key}")
+                return "acquired", None
+        return "in_flight", record
+
+    async def complete(self, key: str, status: int, headers: list, body: bytes):
+        await self.collection.update_one({"_id": key, "status": "in_flight"}, {"$set": {
+            "status": "completed", "response": {"status": status, "headers": headers, "body": body},
+            "completed_at": datetime.now(timezone.utc)
+        }, "$unset": {"locked_until": ""}})
+
+    async def release(self, key: str):
+        """Forget an attempt whose result must not be replayed, so a retry runs again."""
+        await self.collection.delete_one({"_id": key, "status": "in_flight"})
+
+    async def wait(self, key: str, timeout: float):
+        """Poll until the in-flight request finishes or ``timeout`` passes."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        delay = 0.05
+        while True:
+            record = await self.collection.find_one({"_id": key})
+            if not record or record["status"] == "completed":
+                return record
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.5)
+
+
+class IdempotencyMiddleware:
+    """Applies to POSTs on ``paths`` that carry the header. ``scope_of(headers)``
+    names the caller (e.g. the user id from the token); unauthenticated requests
+    pass straight through and fail in the handler as usual."""
+
+    def __init__(self, app, store: IdempotencyStore, paths, scope_of, header: str = "idempotency-key", wait_seconds: float = 10):
+        self.app = app
+        self.store = store
+        self.paths = set(paths)
+        self.scope_of = scope_of
+        self.header = header.lower().encode()
+        self.wait_seconds = wait_seconds
+        # Same-worker duplicates wait on this instead of polling the store
+        self._running = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        raw_key = headers.get(self.header)
+        owner = self.scope_of(headers) if raw_key is not None else None
+        if owner is None:
+            await self.app(scope, receive, send)
+            return
+        route = scope["path"]
+        if not raw_key or len(raw_key) > MAX_KEY_LENGTH:
+            await _send_json(send, 400, {"detail": "Gecersiz Idempotency-Key"})
+            return
+
+        body = await _read_body(receive)
+        key = f"{owner}:{route}:{raw_key.decode('latin-1')}"
+        request_hash = fingerprint(scope["method"], route, body)
+        state, record = await self.store.begin(key, request_hash)
+        if state == "in_flight":
+            # Whatever the first attempt ended with (stored, released or still running) decides this one
+            await self._wait(key)
+            state, record = await self.store.begin(key, request_hash)
+        IDEMPOTENCY_REQUESTS.inc(route, {"acquired": "executed", "completed": "replayed"}.get(state, state))
+        if state == "completed":
+            response = record["response"]
+            await _send(send, response["status"], [(k.encode(), v.encode()) for k, v in response["headers"]]
+                        + [(b"idempotent-replayed", b"true")], bytes(response["body"]))
+        elif state == "mismatch":
+            await _send_json(send, 422, {"detail": "Bu Idempotency-Key farkli bir istek icin kullanilmis"})
+        elif state == "in_flight":
+            await _send_json(send, 409, {"detail": "Ayni Idempotency-Key ile gonderilen istek hala isleniyor"}, [(b"retry-after", b"1")])
+        else:
+            await self._execute(key, scope, body, send)
+
+    async def _wait(self, key: str):
+        done = self._running.get(key)
+        if done is None:
+            await self.store.wait(key, self.wait_seconds)
+            return
+        try:
+            await asyncio.wait_for(asyncio.shield(done.wait()), timeout=self.wait_seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _execute(self, key: str, scope, body: bytes, send):
+        done = self._running[key] = asyncio.Event()
+        status, headers, chunks = 500, [], []
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send_wrapper(message):
+            nonlocal status, headers
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = [(k.decode("latin-1"), v.decode("latin-1")) for k, v in message.get("headers", []) if k.lower() in REPLAYED_HEADERS]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+            if status >= 500 or status in UNCACHEABLE_STATUSES:
+                await self.store.release(key)
+            else:
+                await self.store.complete(key, status, headers, b"".join(chunks))
+        except BaseException:
+            await self.store.release(key)
+            raise
+        finally:
+            done.set()
+            self._running.pop(key, None)
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _send(send, status: int, headers: list, body: bytes):
+    await send({"type": "http.response.start", "status": status,
+                "headers": headers + [(b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_json(send, status: int, payload: dict, headers: list = ()):
+    await _send(send, status, [(b"content-type", b"application/json")] + list(headers), json.dumps(payload).encode())
@@ -0,0 +1,91 @@
+"""Balance ledger entry writes and gap repair.
+
+A balance change reserves its ledger seqs in the same ``$inc`` that moves
+``users.balance`` and writes the entries right after, keyed on
+``(user_id, seq)`` so a retried write never stores one twice. If the write
+never lands (a crash, or errors past the retries) the seq stays missing. Once
+such a gap is older than the timeout, ``roll_forward`` fills it with a
+``ledger_repair`` entry carrying the amount the surrounding balances imply,
+so snapshots keep advancing and the ledger sums to ``users.balance`` again.
+"""
+import asyncio
+import logging
+import uuid
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from migrations import as_utc
+
+logger = logging.getLogger("ledger")
+
+REPAIR_KIND = "ledger_repair"
+
+
+async def write_entries(db, entries: list, opening: dict = None, attempts: int = 3, backoff: float = 0.05) -> bool:
+    """Store ``entries`` (and the user's opening snapshot, if given); False if every attempt failed.
+
+    Both writes are upserts on their reserved seq, so a retry after a partial
+    write, or a repair racing with a late write, keeps whichever landed first.
+    """
+    ops = [UpdateOne({"user_id": e['user_id'], "seq": e['seq']}, {"$setOnInsert": e}, upsert=True) for e in entries]
+    for attempt in range(attempts):
+        try:
+            if opening:
+                await db.balance_snapshots.update_one(
+                    {"user_id": opening['user_id'], "seq": 0},
+                    {"$setOnInsert": {"balance": opening['balance'], "as_of": opening['as_of']}}, upsert=True
+                )
+            await db.ledger.bulk_write(ops, ordered=False)
+            return True
+        except BulkWriteError as e:
+            # Two upserts of one seq raced; the entry is stored either way
+            if not e.details.get('writeConcernErrors') and all(err.get('code') == 11000 for err in e.details.get('writeErrors', [])):
+                return True
+            logger.warning(f"Defter kaydi yazilamadi (deneme {attempt + 1}/{attempts}): {e}")
+        except PyMongoError as e:
+            logger.warning(f"Defter kaydi yazilamadi (deneme {attempt + 1}/{attempts}): {e}")
+        if attempt + 1 < attempts:
+            await asyncio.sleep(backoff * 2 ** attempt)
+    return False
+
+
+def gap_entries(user_id: str, after_seq: int, balance: float, last_seq: int, target: float, at, now) -> list:
+    """Repair entries for seqs ``after_seq + 1`` to ``last_seq`` taking ``balance`` to ``target``.
+
+    The whole missing amount goes on the first entry; the rest move nothing.
+    """
+    delta = round(target - balance, 2)
+    return [{
+        "entry_id": str(uuid.uuid4()), "user_id": user_id, "seq": seq,
+        "delta": delta if seq == after_seq + 1 else 0, "balance_after": round(target, 2),
+        "kind": REPAIR_KIND, "ref_id": "", "created_at": at, "repaired_at": now
+    } for seq in range(after_seq + 1, last_seq + 1)]
+
+
+def roll_forward(user_id: str, snapshot: dict, tail: list, user: dict, cutoff, now) -> tuple:
+    """Follow the ledger from ``snapshot`` through ``tail`` (sorted by seq).
+
+    Gaps older than ``cutoff`` are filled; a younger one ends the walk, as its
+    write may still be in flight. A gap before an entry is sized from that
+    entry's balance, one at the end from ``user`` (read before ``tail``).
+    Returns ``(balance, seq, at, repairs)`` for the last seq reached.
+    """
+    balance, seq, at, repairs = snapshot['balance'], snapshot['seq'], None, []
+    for entry in [*tail, None]:
+        if entry:
+            last_seq, target, gap_at = entry['seq'] - 1, entry['balance_after'] - entry['delta'], entry['created_at']
+        else:
+            last_seq, target, gap_at = user.get('ledger_seq', 0), user.get('balance', 0), user.get('ledger_at')
+        if last_seq > seq:
+            # Users from before ledger_at was recorded have nothing in flight
+            if gap_at and as_utc(gap_at) > cutoff:
+                break
+            filled = gap_entries(user_id, seq, balance, last_seq, target, gap_at or now, now)
+            repairs.extend(filled)
+            balance, seq, at = target, last_seq, filled[-1]['created_at']
+        if not entry:
+            break
+        balance += entry['delta']
+        seq, at = entry['seq'], entry['created_at']
+    return balance, seq, at, repairs
@@ -0,0 +1,264 @@
+"""Prometheus-style metrics for the API process.
+
+Counters and histograms are sharded per thread: every thread (the event loop
+and Motor's executor threads, where pymongo listeners run) writes only to its
+own dict, so the hot path never takes a lock. Shards are summed when
+``/metrics`` is scraped.
+"""
+import bisect
+import threading
+import time
+
+from pymongo import monitoring
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        self._shards_lock = threading.Lock()
+        _registry.append(self)
+
+    def _shard(self) -> dict:
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = {}
+            # Taken once per thread, never on the increment path
+            with self._shards_lock:
+                self._shards.append(shard)
+            self._local.shard = shard
+            return shard
+
+    def _label_str(self, labelvalues, extra: str = "") -> str:
+        parts = [f'{k}="{_escape(v)}"' for k, v in zip(self.labelnames, labelvalues)]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labelvalues, amount: float = 1):
+        shard = self._shard()
+        shard[labelvalues] = shard.get(labelvalues, 0) + amount
+
+    def values(self) -> dict:
+        totals = {}
+        for shard in list(self._shards):
+            for labels, value in list(shard.items()):
+                totals[labels] = totals.get(labels, 0) + value
+        return totals
+
+    def render(self):
+        lines = self._header()
+        for labels, value in sorted(self.values().items()):
+            lines.append(f"{self.name}{self._label_str(labels)} {_fmt(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labelvalues, amount: float = 1):
+        self.inc(*labelvalues, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labelvalues):
+        shard = self._shard()
+        state = shard.get(labelvalues)
+        if state is None:
+            state = shard[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def values(self) -> dict:
+        totals = {}
+        for shard in list(self._shards):
+            for labels, (counts, total) in list(shard.items()):
+                agg = totals.setdefault(labels, [[0] * (len(self.buckets) + 1), 0.0])
+                for i, c in enumerate(counts):
+                    agg[0][i] += c
+                agg[1] += total
+        return totals
+
+    def render(self):
+        lines = self._header()
+        for labels, (counts, total) in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = self._label_str(labels, 'le="%s"' % _fmt(bound))
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            cumulative += counts[-1]
+            le = self._label_str(labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_str(labels)} {_fmt(total)}")
+            lines.append(f"{self.name}_count{self._label_str(labels)} {cumulative}")
+        return lines
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt(value) -> str:
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ===== HTTP =====
+HTTP_REQUESTS = Counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency by route", ("method", "route"))
+
+
+def route_label(scope) -> str:
+    # Use the route template, never the raw path, to keep label cardinality bounded
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = route_label(scope)
+            HTTP_REQUESTS.inc(scope["method"], route, str(status))
+            HTTP_LATENCY.observe(time.perf_counter() - start, scope["method"], route)
+
+
+# ===== MONGODB =====
+MONGO_COMMANDS = Counter("mongo_commands_total", "MongoDB round trips by collection, command and outcome", ("collection", "command", "outcome"))
+MONGO_LATENCY = Histogram("mongo_command_duration_seconds", "MongoDB command latency by collection and command", ("collection", "command"))
+
+
+def command_collection(command_name: str, command) -> str:
+    if command_name == "getMore":
+        return command.get("collection", "")
+    target = command.get(command_name)
+    return target if isinstance(target, str) else ""
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Records every driver round trip. Runs on Motor's executor threads."""
+
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event):
+        self._collections[event.request_id] = command_collection(event.command_name, event.command)
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
+
+    def _finish(self, event, outcome: str):
+        collection = self._collections.pop(event.request_id, "")
+        MONGO_COMMANDS.inc(collection, event.command_name, outcome)
+        MONGO_LATENCY.observe(event.duration_micros / 1e6, collection, event.command_name)
+
+
+# ===== CONNECTION POOL =====
+MONGO_POOL_MAX_SIZE = Gauge("mongo_pool_max_size", "Configured maxPoolSize per server", ("address",))
+MONGO_POOL_OPEN = Gauge("mongo_pool_connections", "Open pooled connections per server", ("address",))
+MONGO_POOL_CHECKED_OUT = Gauge("mongo_pool_checked_out", "Connections currently in use per server", ("address",))
+MONGO_POOL_WAIT = Histogram("mongo_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection", ("address",))
+MONGO_POOL_CHECKOUT_FAILED = Counter("mongo_pool_checkout_failed_total", "Failed checkouts (timeout = pool saturated)", ("address", "reason"))
+
+
+def _address(event) -> str:
+    host, port = event.address
+    return f"{host}:{port}"
+
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """Pool saturation: in-use vs max connections and checkout wait time."""
+
+    def __init__(self, max_pool_size: int):
+        self.max_pool_size = max_pool_size
+        self._local = threading.local()
+
+    def pool_created(self, event):
+        MONGO_POOL_MAX_SIZE.inc(_address(event), amount=self.max_pool_size)
+
+    def pool_closed(self, event):
+        MONGO_POOL_MAX_SIZE.dec(_address(event), amount=self.max_pool_size)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def connection_created(self, event):
+        MONGO_POOL_OPEN.inc(_address(event))
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        MONGO_POOL_OPEN.dec(_address(event))
+
+    def connection_check_out_started(self, event):
+        # Checkout starts and finishes on the same thread
+        self._local.started = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        MONGO_POOL_CHECKOUT_FAILED.inc(_address(event), str(event.reason))
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, "started", None)
+        if started is not None:
+            MONGO_POOL_WAIT.observe(time.perf_counter() - started, _address(event))
+        MONGO_POOL_CHECKED_OUT.inc(_address(event))
+
+    def connection_checked_in(self, event):
+        MONGO_POOL_CHECKED_OUT.dec(_address(event))
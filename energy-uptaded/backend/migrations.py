@@ -0,0 +1,142 @@
+"""Resumable background data migrations.
+
+Timestamps used to be written as ``isoformat()`` strings. ``migrate_iso_dates``
+rewrites them as BSON dates one ``_id``-ordered batch at a time, saving its
+position in the ``migrations`` collection so a restart picks up where it
+stopped. Each update is conditional on the string it read, so a document
+rewritten by the application in the meantime is left alone.
+
+    python migrations.py --batch-size 500 --pause 0.05
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from pymongo import UpdateOne
+
+logger = logging.getLogger("migrations")
+
+ISO_DATE_FIELDS = {
+    "users": ("created_at",),
+    "projects": ("created_at",),
+    "banks": ("created_at",),
+    "portfolios": ("purchase_date",),
+    "transactions": ("created_at", "reviewed_at"),
+    "kyc_documents": ("submitted_at", "reviewed_at"),
+    "notifications": ("created_at",),
+    "ledger": ("created_at",),
+    "balance_snapshots": ("as_of",),
+}
+
+
+def as_utc(value):
+    """Timezone-aware UTC datetime from a stored timestamp (ISO string or datetime)."""
+    if value is None or value == "":
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+async def migrate_iso_dates(db, name: str, fields: tuple, batch_size: int = 500, pause_seconds: float = 0.05) -> int:
+    """Convert ``fields`` of one collection; returns the number of documents rewritten."""
+    state_id = f"iso_dates:{name}"
+    state = await db.migrations.find_one({"_id": state_id}) or {}
+    if state.get("done"):
+        return 0
+    last_id = state.get("last_id")
+    converted = state.get("converted", 0)
+    pending = {"$or": [{f: {"$type": "string"}} for f in fields]}
+    while True:
+        query = {"$and": [pending, {"_id": {"$gt": last_id}}]} if last_id is not None else pending
+        docs = await db[name].find(query, {f: 1 for f in fields}).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not docs:
+            break
+        ops, invalid = [], 0
+        for d in docs:
+            updates = {}
+            for f in fields:
+                if isinstance(d.get(f), str):
+                    try:
+                        updates[f] = as_utc(d[f])
+                    except ValueError:
+                        invalid += 1
+            if updates:
+                ops.append(UpdateOne({"_id": d["_id"], **{f: d[f] for f in updates}}, {"$set": updates}))
+        if ops:
+            result = await db[name].bulk_write(ops, ordered=False)
+            converted += result.modified_count
+        if invalid:
+            logger.warning(f"{name}: {invalid} alan tarih olarak okunamadi, oldugu gibi birakildi")
+        last_id = docs[-1]["_id"]
+        await db.migrations.update_one({"_id": state_id}, {"$set": {"last_id": last_id, "converted": converted, "updated_at": datetime.now(timezone.utc)}}, upsert=True)
+        if pause_seconds:
+            # Leave room for application traffic between batches
+            await asyncio.sleep(pause_seconds)
+    await db.migrations.update_one({"_id": state_id}, {"$set": {"done": True, "converted": converted, "finished_at": datetime.now(timezone.utc)}}, upsert=True)
+    if converted:
+        logger.info(f"{name}: {converted} dokumanin tarihleri BSON date'e cevrildi")
+    return converted
+
+
+async def backfill_notification_read_at(db):
+    """Read notifications from before ``read_at`` existed age out from their creation time."""
+    state = await db.migrations.find_one({"_id": "notifications_read_at"}) or {}
+    if state.get("done"):
+        return
+    await db.notifications.update_many({"is_read": True, "read_at": {"$exists": False}}, [{"$set": {"read_at": "$created_at"}}])
+    await db.migrations.update_one({"_id": "notifications_read_at"}, {"$set": {"done": True, "finished_at": datetime.now(timezone.utc)}}, upsert=True)
+
+
+async def backfill_opening_funded_amount(db):
+    """Record the funding without lots behind it (seeded figures, sales from before they were
+    subtracted) as ``opening_funded_amount``, so ``funded_amount`` reconciles against the lots."""
+    state = await db.migrations.find_one({"_id": "opening_funded_amount"}) or {}
+    if state.get("done"):
+        return
+    skipped = 0
+    async for p in db.projects.find({"opening_funded_amount": {"$exists": False}}, {"_id": 0, "project_id": 1, "funded_amount": 1}):
+        funded = p.get('funded_amount', 0)
+        held = await db.portfolios.aggregate([
+            {"$match": {"project_id": p['project_id']}}, {"$group": {"_id": None, "amount": {"$sum": "$amount"}}}
+        ]).to_list(1)
+        opening = round(funded - (held[0]['amount'] if held else 0), 2)
+        # An investment or sale in between moved funded_amount; the project is counted again next start
+        result = await db.projects.update_one(
+            {"project_id": p['project_id'], "funded_amount": p.get('funded_amount'), "opening_funded_amount": {"$exists": False}},
+            {"$set": {"opening_funded_amount": opening}})
+        skipped += not result.modified_count
+    if not skipped:
+        await db.migrations.update_one({"_id": "opening_funded_amount"}, {"$set": {"done": True, "finished_at": datetime.now(timezone.utc)}}, upsert=True)
+
+
+async def run_all(db, batch_size: int = 500, pause_seconds: float = 0.05, before_step=None):
+    """Run every migration in order. ``before_step`` (async) runs before each one, e.g. to renew a lease."""
+    for name, fields in ISO_DATE_FIELDS.items():
+        if before_step:
+            await before_step()
+        await migrate_iso_dates(db, name, fields, batch_size, pause_seconds)
+    if before_step:
+        await before_step()
+    # Needs created_at as a date, so it runs after the notifications conversion
+    await backfill_notification_read_at(db)
+    if before_step:
+        await before_step()
+    await backfill_opening_funded_amount(db)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Veri migrasyonlari (ISO tarih metinleri -> BSON date, proje acilis fonlamasi)")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--pause", type=float, default=0.05, help="Batch'ler arasi bekleme (saniye)")
+    args = parser.parse_args()
+
+    from server import db
+    asyncio.run(run_all(db, args.batch_size, args.pause))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""Price-time priority matching for the secondary share market.
+
+One ``OrderBook`` per project holds the resting limit orders in two heaps:
+bids keyed by (-price, seq) and asks by (price, seq), so the best price is
+always on top and, at equal prices, the order that arrived first. An
+incoming order trades against the top of the opposite heap for as long as
+the prices cross, at the resting order's price; whatever is left rests.
+
+Cancelled orders are only flagged and dropped when they reach the top of the
+heap (or when enough of them pile up to rebuild the heaps), so a cancel is
+O(1). ``seq`` is the arrival order assigned by the engine; it is persisted,
+so a book restored after a restart keeps its time priority.
+
+This module keeps no I/O; the server persists the fills and order states.
+"""
+import heapq
+from typing import NamedTuple
+
+from metrics import Counter, Histogram
+
+BUY, SELL = "buy", "sell"
+
+ORDER_BOOK_ORDERS = Counter("order_book_orders_total", "Orders taken into the book by side", ("side",))
+ORDER_BOOK_TRADES = Counter("order_book_trades_total", "Trades matched by the order book", ())
+ORDER_BOOK_BATCH_SECONDS = Histogram("order_book_batch_seconds", "Time to match and persist one batch of orders", (),
+                                     buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5))
+
+# Rebuild the heaps once this many cancelled orders are waiting to be dropped
+COMPACT_AFTER = 1024
+
+
+class Order:
+    __slots__ = ("order_id", "user_id", "project_id", "side", "price", "quantity", "remaining", "seq", "status", "portfolio_id")
+
+    def __init__(self, order_id: str, user_id: str, project_id: str, side: str, price: float, quantity: int,
+                 remaining: int = None, seq: int = None, status: str = "open", portfolio_id: str = None):
+        self.order_id = order_id
+        self.user_id = user_id
+        self.project_id = project_id
+        self.side = side
+        self.price = price
+        self.quantity = quantity
+        self.remaining = quantity if remaining is None else remaining
+        self.seq = seq
+        self.status = status
+        # Sell orders: the portfolio lot the shares come from
+        self.portfolio_id = portfolio_id
+
+    @classmethod
+    def from_doc(cls, doc: dict):
+        return cls(doc["order_id"], doc["user_id"], doc["project_id"], doc["side"], doc["price"], doc["quantity"],
+                   doc.get("remaining"), doc.get("seq"), doc.get("status", "open"), doc.get("portfolio_id"))
+
+
+class Fill(NamedTuple):
+    buy: Order
+    sell: Order
+    price: float
+    quantity: int
+
+
+class OrderBook:
+    def __init__(self, project_id: str):
+        self.project_id = project_id
+        self._bids = []
+        self._asks = []
+        # Resting (open) orders by id
+        self.orders = {}
+        self._cancelled = 0
+
+    def __len__(self):
+        return len(self.orders)
+
+    def _top(self, heap):
+        while heap and heap[0][2].status != "open":
+            heapq.heappop(heap)
+            self._cancelled -= 1
+        return heap[0][2] if heap else None
+
+    def best_bid(self):
+        order = self._top(self._bids)
+        return order.price if order else None
+
+    def best_ask(self):
+        order = self._top(self._asks)
+        return order.price if order else None
+
+    def add(self, order: Order):
+        """Rest an order without matching it (restoring a book that was already matched)."""
+        order.status = "open"
+        self.orders[order.order_id] = order
+        if order.side == BUY:
+            heapq.heappush(self._bids, (-order.price, order.seq, order))
+        else:
+            heapq.heappush(self._asks, (order.price, order.seq, order))
+
+    def submit(self, order: Order) -> list:
+        """Match ``order`` against the book and rest the remainder; returns the fills in order."""
+        fills = []
+        buying = order.side == BUY
+        opposite = self._asks if buying else self._bids
+        while order.remaining:
+            resting = self._top(opposite)
+            if resting is None or (resting.price > order.price if buying else resting.price < order.price):
+                break
+            if resting.user_id == order.user_id:
+                # Self-trade prevention: the incoming order's remainder is cancelled
+                order.status = "cancelled"
+                return fills
+            quantity = min(order.remaining, resting.remaining)
+            order.remaining -= quantity
+            resting.remaining -= quantity
+            fills.append(Fill(order, resting, resting.price, quantity) if buying else Fill(resting, order, resting.price, quantity))
+            if not resting.remaining:
+                resting.status = "filled"
+                heapq.heappop(opposite)
+                del self.orders[resting.order_id]
+        if order.remaining:
+            self.add(order)
+        else:
+            order.status = "filled"
+        return fills
+
+    def cancel(self, order_id: str):
+        """Take a resting order off the book; returns it, or None if it isn't resting."""
+        order = self.orders.pop(order_id, None)
+        if order is None:
+            return None
+        order.status = "cancelled"
+        self._cancelled += 1
+        if self._cancelled >= COMPACT_AFTER and self._cancelled > len(self.orders):
+            self._compact()
+        return order
+
+    def _compact(self):
+        self._bids = [entry for entry in self._bids if entry[2].status == "open"]
+        self._asks = [entry for entry in self._asks if entry[2].status == "open"]
+        heapq.heapify(self._bids)
+        heapq.heapify(self._asks)
+        self._cancelled = 0
+
+
+class MatchingEngine:
+    def __init__(self):
+        self.books = {}
+        self.last_seq = 0
+        self.loaded = False
+
+    def book(self, project_id: str) -> OrderBook:
+        book = self.books.get(project_id)
+        if book is None:
+            book = self.books[project_id] = OrderBook(project_id)
+        return book
+
+    def submit(self, order: Order) -> list:
+        self.last_seq += 1
+        order.seq = self.last_seq
+        return self.book(order.project_id).submit(order)
+
+    def cancel(self, project_id: str, order_id: str):
+        book = self.books.get(project_id)
+        return book.cancel(order_id) if book else None
+
+    def restore(self, orders, last_seq: int = 0):
+        """Rebuild the books from persisted open orders; new orders are numbered after ``last_seq``."""
+        self.reset()
+        self.last_seq = last_seq
+        for order in orders:
+            self.book(order.project_id).add(order)
+            self.last_seq = max(self.last_seq, order.seq or 0)
+        self.loaded = True
+
+    def reset(self):
+        self.books.clear()
+        self.last_seq = 0
+        self.loaded = False
+
+    def resting(self) -> int:
+        return sum(len(book) for book in self.books.values())
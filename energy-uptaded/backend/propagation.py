@@ -0,0 +1,116 @@
+"""Propagate renames into denormalized copies.
+
+Transactions, KYC documents, portfolios and market orders carry copies of user and project
+fields so list endpoints need no joins. A rename enqueues one job per source
+document (``user:<id>`` / ``project:<id>``); the worker rewrites the copies in
+small ``update_many`` batches, checkpointing after each batch. A second
+rename while a job is running replaces its values and bumps its version, so
+the worker restarts with the newest values instead of finishing the old ones.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timezone
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+# source -> key field and, per target collection, {copy field: source field}
+PROPAGATIONS = {
+    "user": {"key": "user_id", "targets": {
+        "transactions": {"user_name": "name"},
+        "kyc_documents": {"user_name": "name", "user_email": "email"},
+        "portfolios": {"user_name": "name", "user_email": "email"},
+    }},
+    "project": {"key": "project_id", "targets": {
+        "portfolios": {"project_name": "name", "project_type": "type"},
+        # Trades carry no project name; market views take it from the orders
+        "orders": {"project_name": "name"},
+    }},
+}
+
+
+async def enqueue(jobs, source: str, key: str, values: dict):
+    """Schedule (or restart) propagation of ``values`` for one user or project."""
+    now = datetime.now(timezone.utc)
+    await jobs.update_one(
+        {"_id": f"{source}:{key}"},
+        {"$set": {"source": source, "key": key, "values": values, "version": uuid.uuid4().hex,
+                  "status": "pending", "progress": {}, "updated": {}, "enqueued_at": now},
+         "$setOnInsert": {"created_at": now}},
+        upsert=True
+    )
+
+
+class PropagationWorker:
+    """``before_batch`` (async, optional) runs before every batch, e.g. to renew a
+    lease; when it returns False the worker stops and the job resumes later."""
+
+    def __init__(self, db, batch_size: int = 500, pause_seconds: float = 0.1, before_batch=None):
+        self.db = db
+        self.batch_size = batch_size
+        self.pause = pause_seconds
+        self.before_batch = before_batch
+        self.stopped = False
+
+    async def run_pending(self) -> int:
+        """Process jobs until none are pending; returns how many finished."""
+        finished = 0
+        self.stopped = False
+        while not self.stopped:
+            job = await self.db.propagation_jobs.find_one_and_update(
+                {"status": "pending"}, {"$set": {"status": "running", "started_at": datetime.now(timezone.utc)}},
+                sort=[("enqueued_at", 1)], return_document=ReturnDocument.AFTER
+            )
+            if not job:
+                return finished
+            if await self.run_job(job):
+                finished += 1
+        return finished
+
+    async def run_job(self, job: dict) -> bool:
+        spec = PROPAGATIONS[job["source"]]
+        for collection, fields in spec["targets"].items():
+            copies = {copy: job["values"][src] for copy, src in fields.items() if src in job["values"]}
+            if not copies:
+                continue
+            if not await self._propagate(job, collection, spec["key"], copies):
+                return False
+        result = await self.db.propagation_jobs.update_one(
+            {"_id": job["_id"], "version": job["version"]},
+            {"$set": {"status": "done", "finished_at": datetime.now(timezone.utc)}}
+        )
+        return result.modified_count == 1
+
+    async def _propagate(self, job: dict, collection: str, key_field: str, copies: dict) -> bool:
+        """Rewrite one collection; False if the job was superseded meanwhile."""
+        last_id = job.get("progress", {}).get(collection)
+        updated = job.get("updated", {}).get(collection, 0)
+        # Only documents whose copy differs; a resumed job skips what it already fixed
+        stale = {key_field: job["key"], "$or": [{f: {"$ne": v}} for f, v in copies.items()]}
+        while True:
+            if self.before_batch and not await self.before_batch():
+                # Left "running"; whoever holds the lease next requeues it from the checkpoint
+                self.stopped = True
+                return False
+            query = {**stale, "_id": {"$gt": last_id}} if last_id is not None else stale
+            ids = [d["_id"] for d in await self.db[collection].find(query, {"_id": 1}).sort("_id", 1).limit(self.batch_size).to_list(self.batch_size)]
+            if not ids:
+                return True
+            result = await self.db[collection].update_many({"_id": {"$in": ids}}, {"$set": copies})
+            updated += result.modified_count
+            last_id = ids[-1]
+            checkpoint = await self.db.propagation_jobs.update_one(
+                {"_id": job["_id"], "version": job["version"]},
+                {"$set": {f"progress.{collection}": last_id, f"updated.{collection}": updated, "heartbeat_at": datetime.now(timezone.utc)}}
+            )
+            if not checkpoint.matched_count:
+                logger.info(f"Yayilim isi yenilendi, yeni degerlerle tekrar baslayacak: {job['_id']}")
+                return False
+            if self.pause:
+                await asyncio.sleep(self.pause)
+
+    async def requeue_stalled(self):
+        """Jobs left ``running`` by a worker that died resume from their checkpoint."""
+        await self.db.propagation_jobs.update_many({"status": "running"}, {"$set": {"status": "pending"}})
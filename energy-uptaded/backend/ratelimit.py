@@ -0,0 +1,124 @@
+"""Token-bucket rate limiting for the CPU-heavy auth endpoints.
+
+Buckets live in a pluggable store: ``MemoryBucketStore`` (the default) keeps
+them per worker and costs no I/O; ``MongoBucketStore`` makes limits hold
+across every worker at one round trip per bucket checked, and one per token
+refunded. Keys that are already over their limit are remembered in-process
+until they refill, so a flood is rejected without touching the store at all.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBucketStore:
+    """Buckets in an LRU map capped at ``max_keys``.
+
+    The cap is enforced on every insert, so a spray of distinct emails or IPs
+    that are each allowed once can't grow it without bound; the least recently
+    used key, the one most likely to have refilled, is evicted first.
+    """
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    async def take(self, key: str, rate: float, capacity: float, now: float) -> float:
+        """Take one token; return 0 if allowed, else seconds until one is available."""
+        bucket = self._buckets.pop(key, None)
+        tokens = capacity if bucket is None else min(capacity, bucket[0] + (now - bucket[1]) * rate)
+        allowed = tokens >= 1
+        self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return 0.0 if allowed else (1 - tokens) / rate
+
+    async def give(self, key: str, capacity: float):
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            self._buckets[key] = (min(capacity, bucket[0] + 1), bucket[1])
+
+
+class MongoBucketStore:
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def take(self, key: str, rate: float, capacity: float, now: float) -> float:
+        # Refill and take in a single atomic round trip (pipeline update, MongoDB 4.2+)
+        refilled = {"$min": [capacity, {"$add": [
+            {"$ifNull": ["$tokens", capacity]},
+            {"$multiply": [{"$max": [0, {"$subtract": [now, {"$ifNull": ["$ts", now]}]}]}, rate]}
+        ]}]}
+        expires_at = datetime.fromtimestamp(now, timezone.utc) + timedelta(seconds=capacity / rate)
+        doc = await self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "ts": now, "expires_at": {"$literal": expires_at}}},
+                {"$set": {"allowed": {"$gte": ["$tokens", 1]},
+                          "tokens": {"$cond": [{"$gte": ["$tokens", 1]}, {"$subtract": ["$tokens", 1]}, "$tokens"]}}}
+            ],
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+        if doc["allowed"]:
+            return 0.0
+        return (1 - doc["tokens"]) / rate
+
+    async def give(self, key: str, capacity: float):
+        await self.collection.update_one({"_id": key}, [{"$set": {"tokens": {"$min": [capacity, {"$add": ["$tokens", 1]}]}}}])
+
+
+class RateLimiter:
+    def __init__(self, store, per_minute: float, burst: float):
+        self.store = store
+        self.rate = per_minute / 60
+        self.capacity = burst
+        self._blocked = {}
+
+    async def check(self, *keys: str) -> float:
+        """Take a token from every key's bucket; return 0 if allowed, else Retry-After seconds."""
+        now = time.time()
+        for key in keys:
+            until = self._blocked.get(key)
+            if until is not None:
+                if until > now:
+                    return until - now
+                del self._blocked[key]
+        try:
+            waits = await asyncio.gather(*(self.store.take(key, self.rate, self.capacity, now) for key in keys))
+        except Exception as e:
+            # Fail open: an unavailable store must not lock every user out
+            logger.warning(f"Rate limit kontrolu yapilamadi: {e}")
+            return 0.0
+        retry_after = max(waits, default=0.0)
+        if retry_after > 0:
+            if len(self._blocked) > 10000:
+                self._blocked = {k: until for k, until in self._blocked.items() if until > now}
+            for key, wait in zip(keys, waits):
+                if wait > 0:
+                    self._blocked[key] = now + wait
+        return retry_after
+
+    async def refund(self, *keys: str):
+        """Return a token taken by ``check``, e.g. after a successful login."""
+        try:
+            await asyncio.gather(*(self.store.give(key, self.capacity) for key in keys))
+        except Exception as e:
+            logger.warning(f"Rate limit iadesi yapilamadi: {e}")
+
+
+def client_ip(request, trusted_proxy_hops: int = 0) -> str:
+    """Client address, taking the entry our own proxies appended to X-Forwarded-For."""
+    if trusted_proxy_hops:
+        forwarded = [ip.strip() for ip in request.headers.get("x-forwarded-for", "").split(",") if ip.strip()]
+        if len(forwarded) >= trusted_proxy_hops:
+            return forwarded[-trusted_proxy_hops]
+    return request.client.host if request.client else "unknown"
@@ -0,0 +1,228 @@
+"""Reconcile balances, portfolios, project funding and transactions.
+
+Users are split into user_id ranges and each range is checked concurrently
+with bounded parallelism; per-project figures are rolled up from the same
+ranges, so memory stays proportional to one chunk plus the project count.
+
+    python reconcile.py --chunk-size 500 --parallelism 4 --max-chunks-per-second 5 --output report.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime, timezone
+
+from hll import HyperLogLog
+from migrations import as_utc
+
+logger = logging.getLogger("reconcile")
+
+# Differences below this are float noise, not discrepancies
+TOLERANCE = 0.01
+# Ledger kinds that move cash in or out and point at their transaction through ref_id
+CASH_KINDS = ("deposit", "withdrawal", "admin_deposit", "admin_withdrawal")
+
+
+class Pacer:
+    """Spaces chunk starts so the job never exceeds ``rate`` chunks per second."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate else 0
+        self._next = 0.0
+
+    async def wait(self):
+        now = time.monotonic()
+        if self._next > now:
+            await asyncio.sleep(self._next - now)
+        self._next = max(now, self._next) + self.interval
+
+
+async def user_chunks(source, chunk_size: int):
+    last = None
+    while True:
+        query = {"user_id": {"$gt": last}} if last else {}
+        users = await source.users.find(query, {"_id": 0, "user_id": 1, "balance": 1, "ledger_seq": 1}).sort("user_id", 1).limit(chunk_size).to_list(chunk_size)
+        if not users:
+            return
+        yield users
+        last = users[-1]['user_id']
+
+
+def approved_cash(txns: list, opening: dict, ledger_refs: set) -> dict:
+    """Approved deposit/withdrawal totals per ``(user_id, type)`` the ledger should account for.
+
+    A transaction counts if a ledger cash move points at it, or if it was
+    approved after the user's ledger opened and so should have one. Earlier
+    approvals moved the balance before the ledger existed and are already in
+    the opening snapshot.
+    """
+    approved = {}
+    for t in txns:
+        o = opening.get(t['user_id'])
+        if not o:
+            continue
+        # Admin adjustments are approved when written; either side may still be an ISO string
+        approved_at = t.get('reviewed_at') or t.get('created_at')
+        if t.get('transaction_id') in ledger_refs or (approved_at and as_utc(approved_at) >= as_utc(o['as_of'])):
+            key = (t['user_id'], t['type'])
+            approved[key] = approved.get(key, 0.0) + t['amount']
+    return approved
+
+
+def project_discrepancy(project: dict, amount: float, investors: int):
+    """Report entry if the project's figures don't match its current lots, else None.
+
+    ``funded_amount`` rises with investments and falls with sales to the
+    platform, on top of ``opening_funded_amount`` (seeded funding with no lots
+    behind it), so it must equal the opening figure plus the lots held today.
+    ``investors_count`` includes past investors who have sold, so it may
+    exceed the current holders; a sketched count may also fall short by its
+    estimation error.
+    """
+    funded = project.get('funded_amount', 0) - project.get('opening_funded_amount', 0)
+    floor = investors * (1 - 3 * HyperLogLog.from_bytes(project['investor_sketch']).error) if project.get('investor_sketch') else investors
+    if abs(funded - amount) <= TOLERANCE and project.get('investors_count', 0) >= floor:
+        return None
+    return {
+        "project_id": project['project_id'], "name": project.get('name', ''),
+        "funded_amount": project.get('funded_amount', 0), "opening_funded_amount": project.get('opening_funded_amount', 0),
+        "portfolio_amount": round(amount, 2), "investors_count": project.get('investors_count', 0), "distinct_investors": investors
+    }
+
+
+async def check_users(source, users: list) -> dict:
+    ids = [u['user_id'] for u in users]
+    ledger_rows, cash_refs, openings, txns, projects = await asyncio.gather(
+        source.ledger.aggregate([
+            {"$match": {"user_id": {"$in": ids}}},
+            {"$group": {"_id": {"user_id": "$user_id", "kind": "$kind"}, "sum": {"$sum": "$delta"},
+                        "count": {"$sum": 1}, "max_seq": {"$max": "$seq"}}}
+        ]).to_list(None),
+        source.ledger.find({"user_id": {"$in": ids}, "kind": {"$in": list(CASH_KINDS)}}, {"_id": 0, "ref_id": 1}).to_list(None),
+        source.balance_snapshots.find({"user_id": {"$in": ids}, "seq": 0}, {"_id": 0}).to_list(None),
+        source.transactions.find({"user_id": {"$in": ids}, "status": "approved"},
+                                 {"_id": 0, "transaction_id": 1, "user_id": 1, "type": 1, "amount": 1,
+                                  "created_at": 1, "reviewed_at": 1}).to_list(None),
+        source.portfolios.aggregate([
+            {"$match": {"user_id": {"$in": ids}}},
+            {"$group": {"_id": {"project_id": "$project_id", "user_id": "$user_id"}, "amount": {"$sum": "$amount"}}},
+            {"$group": {"_id": "$_id.project_id", "amount": {"$sum": "$amount"}, "investors": {"$sum": 1}}}
+        ]).to_list(None),
+    )
+    ledger = {}
+    for row in ledger_rows:
+        agg = ledger.setdefault(row['_id']['user_id'], {"sum": 0.0, "count": 0, "max_seq": 0, "kinds": {}})
+        agg["sum"] += row['sum']
+        agg["count"] += row['count']
+        agg["max_seq"] = max(agg["max_seq"], row['max_seq'])
+        agg["kinds"][row['_id']['kind']] = row['sum']
+    opening = {o['user_id']: o for o in openings}
+
+    approved = approved_cash(txns, opening, {e.get('ref_id') for e in cash_refs})
+
+    discrepancies = []
+    for u in users:
+        uid, agg, o = u['user_id'], ledger.get(u['user_id']), opening.get(u['user_id'])
+        if not agg:
+            continue
+        issues = {}
+        if o is None:
+            issues["missing_opening_snapshot"] = True
+        else:
+            expected = o['balance'] + agg["sum"]
+            if abs(expected - u.get('balance', 0)) > TOLERANCE:
+                issues["balance"] = {"stored": u.get('balance', 0), "ledger": round(expected, 2)}
+        if agg["count"] != agg["max_seq"] or agg["max_seq"] != u.get('ledger_seq', 0):
+            issues["sequence_gap"] = {"entries": agg["count"], "max_seq": agg["max_seq"], "user_seq": u.get('ledger_seq', 0)}
+        if o is not None:
+            kinds = agg["kinds"]
+            deposits = kinds.get("deposit", 0) + kinds.get("admin_deposit", 0)
+            withdrawals = -(kinds.get("withdrawal", 0) + kinds.get("admin_withdrawal", 0))
+            if abs(deposits - approved.get((uid, "deposit"), 0)) > TOLERANCE:
+                issues["deposits"] = {"ledger": deposits, "transactions": approved.get((uid, "deposit"), 0)}
+            if abs(withdrawals - approved.get((uid, "withdrawal"), 0)) > TOLERANCE:
+                issues["withdrawals"] = {"ledger": withdrawals, "transactions": approved.get((uid, "withdrawal"), 0)}
+        if issues:
+            discrepancies.append({"user_id": uid, **issues})
+    return {"discrepancies": discrepancies, "projects": {p['_id']: (p['amount'], p['investors']) for p in projects}}
+
+
+async def reconcile(source, chunk_size: int, parallelism: int, max_chunks_per_second: float, recheck_delay: float) -> dict:
+    started = datetime.now(timezone.utc).isoformat()
+    semaphore = asyncio.Semaphore(parallelism)
+    pacer = Pacer(max_chunks_per_second)
+    project_rollup = {}
+    user_discrepancies = []
+    stats = {"users": 0, "chunks": 0}
+    tasks = set()
+
+    async def run_chunk(users):
+        try:
+            result = await check_users(source, users)
+            user_discrepancies.extend(result["discrepancies"])
+            # Chunks partition users, so per-chunk distinct investor counts add up exactly
+            for pid, (amount, investors) in result["projects"].items():
+                agg = project_rollup.setdefault(pid, [0.0, 0])
+                agg[0] += amount
+                agg[1] += investors
+        finally:
+            semaphore.release()
+
+    async for users in user_chunks(source, chunk_size):
+        await semaphore.acquire()
+        await pacer.wait()
+        stats["users"] += len(users)
+        stats["chunks"] += 1
+        task = asyncio.create_task(run_chunk(users))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+
+    # Writes racing with the scan show up as transient mismatches; keep only persistent ones
+    if user_discrepancies and recheck_delay:
+        await asyncio.sleep(recheck_delay)
+        flagged = {d['user_id'] for d in user_discrepancies}
+        users = await source.users.find({"user_id": {"$in": list(flagged)}}, {"_id": 0, "user_id": 1, "balance": 1, "ledger_seq": 1}).to_list(None)
+        user_discrepancies = (await check_users(source, users))["discrepancies"]
+
+    project_discrepancies = []
+    async for p in source.projects.find({}, {"_id": 0, "project_id": 1, "name": 1, "funded_amount": 1, "opening_funded_amount": 1,
+                                              "investors_count": 1, "investor_sketch": 1}):
+        issue = project_discrepancy(p, *project_rollup.get(p['project_id'], (0.0, 0)))
+        if issue:
+            project_discrepancies.append(issue)
+
+    return {
+        "started_at": started, "finished_at": datetime.now(timezone.utc).isoformat(),
+        "users_checked": stats["users"], "chunks": stats["chunks"],
+        "user_discrepancies": user_discrepancies, "project_discrepancies": project_discrepancies
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bakiye, portfoy ve proje fonlama mutabakati")
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--parallelism", type=int, default=4)
+    parser.add_argument("--max-chunks-per-second", type=float, default=5, help="0 = sinirsiz")
+    parser.add_argument("--recheck-delay", type=float, default=5, help="Tutarsiz kullanicilari bu kadar saniye sonra tekrar kontrol et (0 = kapali)")
+    parser.add_argument("--primary", action="store_true", help="Secondary yerine primary'den oku")
+    parser.add_argument("--output", help="Raporu bu dosyaya yaz (varsayilan: stdout)")
+    args = parser.parse_args()
+
+    from server import db, analytics_db
+    source = db if args.primary else analytics_db
+    report = asyncio.run(reconcile(source, args.chunk_size, args.parallelism, args.max_chunks_per_second, args.recheck_delay))
+    text = json.dumps(report, ensure_ascii=False, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        print(text)
+    logger.info(f"Mutabakat tamamlandi: {report['users_checked']} kullanici, "
+                f"{len(report['user_discrepancies'])} kullanici / {len(report['project_discrepancies'])} proje tutarsizligi")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+"""Calendar bucketing for pre-aggregated time series.
+
+Writers ``$inc`` one document per (key, local day); readers fetch the daily
+documents for a range and downsample them here to week or month resolution,
+so a chart never scans the raw rows.
+"""
+from datetime import date, datetime, timedelta
+
+RESOLUTIONS = ("day", "week", "month")
+
+
+def day_key(ts: datetime, tz) -> str:
+    """Local calendar day of ``ts`` as ``YYYY-MM-DD``."""
+    return ts.astimezone(tz).date().isoformat()
+
+
+def period_start(day: str, resolution: str) -> str:
+    d = date.fromisoformat(day)
+    if resolution == "week":
+        d -= timedelta(days=d.weekday())
+    elif resolution == "month":
+        d = d.replace(day=1)
+    return d.isoformat()
+
+
+def downsample(buckets: list, resolution: str, sum_fields: tuple, set_fields: tuple = ()) -> list:
+    """Merge day buckets (sorted by ``day``) into periods.
+
+    ``sum_fields`` are added up; ``set_fields`` hold lists of ids and are
+    merged as sets, so distinct counts stay exact across days.
+    """
+    periods = []
+    current = None
+    for b in buckets:
+        start = period_start(b["day"], resolution)
+        if current is None or current["period"] != start:
+            current = {"period": start, **{f: 0 for f in sum_fields}, **{f: set() for f in set_fields}}
+            periods.append(current)
+        for f in sum_fields:
+            current[f] += b.get(f, 0)
+        for f in set_fields:
+            current[f].update(b.get(f, ()))
+    for p in periods:
+        for f in set_fields:
+            p[f] = len(p[f])
+    return periods
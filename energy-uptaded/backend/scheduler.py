@@ -0,0 +1,236 @@
+"""Periodic background jobs that run on exactly one worker per scheduled slot.
+
+Every job has a document in ``scheduled_jobs`` holding its next due time and
+a lock. Each worker sleeps until the job is due (plus a random jitter), then
+tries to claim it with one conditional ``find_one_and_update``: only a claim
+that finds the job due and unlocked succeeds, and it moves ``next_run_at``
+forward in the same write, so the slot runs once across the fleet and a run
+never overlaps the previous one. A worker that dies mid-run leaves a lock
+that expires after the job's timeout; long jobs without a timeout call
+``renew`` to keep theirs.
+
+Schedules are either a fixed interval in seconds or a five-field cron
+expression (minute hour day-of-month month day-of-week) in a given timezone.
+"""
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timezone, timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+JOB_RUNS = Counter("scheduler_job_runs_total", "Scheduled job runs by job and outcome (success, error, timeout)", ("job", "outcome"))
+JOB_DURATION = Histogram("scheduler_job_duration_seconds", "Scheduled job run duration", ("job",),
+                         buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900))
+JOB_LAG = Histogram("scheduler_job_lag_seconds", "Delay between a job's due time and its start", ("job",),
+                    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300))
+
+DEFAULT_LOCK_SECONDS = 120
+
+
+class Cron:
+    FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression: str):
+        parts = expression.split()
+        if len(parts) != 5:
+            raise ValueError(f"cron needs 5 fields: {expression!r}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, dows = (
+            _parse_field(part, low, high) for part, (low, high) in zip(parts, self.FIELDS))
+        # 0 and 7 are both Sunday
+        self.weekdays = {d % 7 for d in dows}
+        self.any_day, self.any_weekday = parts[2] == "*", parts[4] == "*"
+
+    def _day_matches(self, day) -> bool:
+        dom = day.day in self.days
+        dow = (day.weekday() + 1) % 7 in self.weekdays
+        if self.any_day or self.any_weekday:
+            return dom and dow
+        # Both restricted: classic cron runs when either matches
+        return dom or dow
+
+    def next_after(self, after: datetime, tz) -> datetime:
+        """First matching minute strictly after ``after``, as a UTC datetime."""
+        start = after.astimezone(tz).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        day = start.date()
+        for _ in range(366 * 5):
+            if day.month in self.months and self._day_matches(day):
+                for hour in sorted(self.hours):
+                    for minute in sorted(self.minutes):
+                        candidate = datetime(day.year, day.month, day.day, hour, minute, tzinfo=tz)
+                        if candidate >= start:
+                            return candidate.astimezone(timezone.utc)
+            day += timedelta(days=1)
+        raise ValueError(f"cron never matches: {self.expression!r}")
+
+
+def _parse_field(part: str, low: int, high: int) -> set:
+    values = set()
+    for item in part.split(","):
+        spec, _, step = item.partition("/")
+        step = int(step) if step else 1
+        if spec == "*":
+            start, end = low, high
+        elif "-" in spec:
+            start, end = (int(v) for v in spec.split("-", 1))
+        else:
+            start = end = int(spec)
+            if step > 1:
+                end = high
+        if not (low <= start <= end <= high) or step < 1:
+            raise ValueError(f"cron field out of range: {part!r}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class Job:
+    def __init__(self, name: str, fn, interval: float = None, cron: str = None, tz=timezone.utc,
+                 timeout: float = None, jitter: float = 0, run_at_start: bool = True):
+        if (interval is None) == (cron is None):
+            raise ValueError("a job needs exactly one of interval or cron")
+        self.name = name
+        self.fn = fn
+        self.interval = interval
+        self.cron = Cron(cron) if cron else None
+        self.tz = tz
+        self.timeout = timeout
+        self.jitter = jitter
+        # Interval jobs seen for the first time run right away; cron jobs wait for their slot
+        self.run_at_start = run_at_start and interval is not None
+        self.lock_seconds = timeout + 30 if timeout else DEFAULT_LOCK_SECONDS
+
+    def next_after(self, now: datetime) -> datetime:
+        if self.interval is not None:
+            return now + timedelta(seconds=self.interval)
+        return self.cron.next_after(now, self.tz)
+
+
+class Scheduler:
+    def __init__(self, collection, owner: str, max_poll_seconds: float = 30):
+        self.collection = collection
+        self.owner = owner
+        self.max_poll = max_poll_seconds
+        self.jobs = {}
+        self._tasks = []
+        self._wake = {}
+        self._triggered = set()
+
+    def every(self, name: str, seconds: float, fn, **options):
+        self.jobs[name] = Job(name, fn, interval=seconds, **options)
+
+    def cron(self, name: str, expression: str, fn, **options):
+        self.jobs[name] = Job(name, fn, cron=expression, **options)
+
+    def start(self):
+        for job in self.jobs.values():
+            self._wake[job.name] = asyncio.Event()
+            self._tasks.append(asyncio.create_task(self._loop(job)))
+
+    def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks.clear()
+
+    async def trigger(self, name: str):
+        """Make a job due now; this worker checks immediately, others on their next poll."""
+        await self.collection.update_one({"_id": name}, {"$set": {"next_run_at": datetime.now(timezone.utc)}})
+        if name in self._wake:
+            self._triggered.add(name)
+            self._wake[name].set()
+
+    async def renew(self, name: str) -> bool:
+        """Extend this worker's lock on a running job; False if it has been taken over."""
+        job = self.jobs[name]
+        result = await self.collection.update_one(
+            {"_id": name, "locked_by": self.owner},
+            {"$set": {"locked_until": datetime.now(timezone.utc) + timedelta(seconds=job.lock_seconds)}}
+        )
+        return result.matched_count == 1
+
+    async def _loop(self, job: Job):
+        await self._register(job)
+        while True:
+            try:
+                state = await self.collection.find_one({"_id": job.name}, {"next_run_at": 1})
+                wait = (_utc(state["next_run_at"]) - datetime.now(timezone.utc)).total_seconds() if state else 0
+                if wait > 0:
+                    await self._sleep(job, min(wait, self.max_poll))
+                    continue
+                if job.jitter and job.name not in self._triggered:
+                    await asyncio.sleep(random.uniform(0, job.jitter))
+                self._triggered.discard(job.name)
+                claimed = await self._claim(job)
+                if claimed:
+                    await self._run(job, claimed)
+                else:
+                    # Still running elsewhere; look again shortly
+                    await self._sleep(job, min(self.max_poll, max(job.jitter, 1)))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Zamanlanmis is kontrol edilemedi ({job.name}): {e}")
+                await asyncio.sleep(self.max_poll)
+
+    async def _register(self, job: Job):
+        now = datetime.now(timezone.utc)
+        first = now if job.run_at_start else job.next_after(now)
+        try:
+            await self.collection.update_one({"_id": job.name}, {"$setOnInsert": {"next_run_at": first, "created_at": now}}, upsert=True)
+        except DuplicateKeyError:
+            pass
+
+    async def _sleep(self, job: Job, seconds: float):
+        wake = self._wake[job.name]
+        try:
+            await asyncio.wait_for(wake.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+        wake.clear()
+
+    async def _claim(self, job: Job):
+        now = datetime.now(timezone.utc)
+        return await self.collection.find_one_and_update(
+            {"_id": job.name, "next_run_at": {"$lte": now},
+             "$or": [{"locked_until": None}, {"locked_until": {"$lt": now}}]},
+            {"$set": {"locked_by": self.owner, "locked_until": now + timedelta(seconds=job.lock_seconds),
+                      "next_run_at": job.next_after(now), "last_started_at": now}},
+            return_document=ReturnDocument.BEFORE
+        )
+
+    async def _run(self, job: Job, claimed: dict):
+        JOB_LAG.observe(max(0.0, (datetime.now(timezone.utc) - _utc(claimed["next_run_at"])).total_seconds()), job.name)
+        started = time.perf_counter()
+        outcome, error = "success", None
+        try:
+            if job.timeout:
+                await asyncio.wait_for(job.fn(), timeout=job.timeout)
+            else:
+                await job.fn()
+        except asyncio.TimeoutError:
+            outcome, error = "timeout", f"{job.timeout}s"
+            logger.warning(f"Zamanlanmis is zaman asimina ugradi: {job.name} ({job.timeout}s)")
+        except asyncio.CancelledError:
+            outcome, error = "cancelled", "shutdown"
+            raise
+        except Exception as e:
+            outcome, error = "error", str(e)
+            logger.warning(f"Zamanlanmis is basarisiz: {job.name}: {e}")
+        finally:
+            duration = time.perf_counter() - started
+            JOB_RUNS.inc(job.name, outcome)
+            JOB_DURATION.observe(duration, job.name)
+            await self.collection.update_one({"_id": job.name, "locked_by": self.owner}, {"$set": {
+                "locked_until": None, "last_finished_at": datetime.now(timezone.utc),
+                "last_status": outcome, "last_duration": round(duration, 3), "last_error": error
+            }})
+
+
+def _utc(value: datetime) -> datetime:
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
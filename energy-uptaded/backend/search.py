@@ -0,0 +1,84 @@
+"""Normalized search keys and keyset cursors for the admin user search.
+
+Names, e-mails and phone numbers are folded (lowercase, Turkish letters to
+ASCII, phone to digits) into ``search_terms`` when a user is written, so a
+lookup is an anchored, case-sensitive prefix regex that MongoDB answers from
+the index instead of scanning every user.
+"""
+import base64
+import re
+import unicodedata
+
+from bson import json_util
+
+_TURKISH = str.maketrans({"ı": "i", "İ": "i", "ş": "s", "Ş": "s", "ğ": "g", "Ğ": "g",
+                          "ç": "c", "Ç": "c", "ö": "o", "Ö": "o", "ü": "u", "Ü": "u"})
+# A query made only of these characters is treated as a phone number
+_PHONE_CHARS = re.compile(r"^[\d\s()+\-.]+$")
+MIN_PHONE_DIGITS = 3
+
+
+def fold(text: str) -> str:
+    text = unicodedata.normalize("NFKD", (text or "").translate(_TURKISH))
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(text.lower().split())
+
+
+def digits(text: str) -> str:
+    return re.sub(r"\D", "", text or "")
+
+
+def search_fields(name: str, email: str, phone: str) -> dict:
+    """Fields to ``$set`` on a user document whenever name, email or phone change."""
+    name_key = fold(name)
+    email_key = (email or "").strip().lower()
+    terms = {name_key, *name_key.split(), email_key, email_key.split("@")[0]}
+    phone_key = digits(phone)
+    if phone_key:
+        terms.add(phone_key)
+        # Also match numbers typed without the country code (e.g. 0555... or 555...)
+        if len(phone_key) > 10:
+            terms.add(phone_key[-10:])
+    terms.discard("")
+    return {"search_name": name_key, "search_terms": sorted(terms)}
+
+
+def term_prefix(query: str):
+    """Anchored regex for ``search_terms``, or None if the query has nothing searchable."""
+    query = (query or "").strip()
+    if _PHONE_CHARS.match(query) and len(digits(query)) >= MIN_PHONE_DIGITS:
+        key = digits(query)
+        if key.startswith("0"):
+            key = key[1:]
+    else:
+        key = fold(query)
+    return "^" + re.escape(key) if key else None
+
+
+def encode_cursor(value, user_id: str) -> str:
+    # Extended JSON keeps datetimes (created_at) intact through the round trip
+    return base64.urlsafe_b64encode(json_util.dumps([value, user_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str, types: tuple = ()):
+    """Returns ``(value, user_id)``; raises ValueError for anything we did not issue.
+
+    ``types`` are the sort value types the cursor may carry (None is always
+    allowed), so a crafted cursor can't smuggle a document or an operator into
+    the keyset filter.
+    """
+    try:
+        value, user_id = json_util.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("invalid cursor")
+    if not isinstance(user_id, str):
+        raise ValueError("invalid cursor")
+    if types and value is not None and (isinstance(value, bool) or not isinstance(value, types)):
+        raise ValueError("invalid cursor")
+    return value, user_id
+
+
+def after_cursor(field: str, direction: int, value, user_id: str) -> dict:
+    """Keyset condition for the page after ``(value, user_id)`` in ``(field, user_id)`` order."""
+    op = "$gt" if direction > 0 else "$lt"
+    return {"$or": [{field: {op: value}}, {field: value, "user_id": {op: user_id}}]}
@@ -1,39 +1,188 @@
+import time
+# Cold start is measured from here; see the startup report logged once the worker is ready
+PROCESS_STARTED = time.perf_counter()
+from pathlib import Path
+from dotenv import load_dotenv
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
 from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, UploadFile, File
 from fastapi.staticfiles import StaticFiles
-from dotenv import load_dotenv
-load_dotenv()
 from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import PlainTextResponse, JSONResponse
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne, ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
+from pymongo.read_preferences import Primary, Secondary, SecondaryPreferred, Nearest
 import os
 import logging
-from pathlib import Path
 from pydantic import BaseModel
 from typing import List, Optional
+from collections import Counter, defaultdict
 import uuid
 from datetime import datetime, timezone, timedelta
 import bcrypt
 import jwt
-import requests
 import shutil
 import asyncio
+import functools
+import math
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from metrics import MetricsMiddleware, MongoCommandMetrics, MongoPoolMetrics, render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from tracing import DBTraceMiddleware, TraceCommandListener
+from ratelimit import RateLimiter, MemoryBucketStore, MongoBucketStore, client_ip
+from singleflight import SingleFlight, coalesce
+from httpcache import HTTPCacheMiddleware, cache_control
+from idempotency import IdempotencyMiddleware, IdempotencyStore
+from coordination import Lease, SharedCache, WORKER_ID
+from unitofwork import UnitOfWork
+from scheduler import Scheduler
+from fxhistory import RateHistory
+from audit import AuditLog, verify_all, verify_chain
+from ledger import roll_forward, write_entries
+from orderbook import BUY, SELL, MatchingEngine, Order, ORDER_BOOK_ORDERS, ORDER_BOOK_TRADES, ORDER_BOOK_BATCH_SECONDS
+import migrations
+from migrations import as_utc
+import propagation
+from propagation import PropagationWorker
+from rollups import RESOLUTIONS, day_key, downsample
+import cashflow
+import summaries
+from hll import DistinctCounter, HyperLogLog
+from summaries import LOT_FIELDS, begin_update, combine, lot_delta, position_delta, summary_update
+from search import search_fields, term_prefix, encode_cursor, decode_cursor, after_cursor
 
-ROOT_DIR = Path(__file__).parent
-load_dotenv(ROOT_DIR / '.env')
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# DB tracing: X-DB-Trace response header, slow request log thresholds, explain() capture limit
+DB_TRACE_HEADER = os.environ.get('DB_TRACE_HEADER', '0') == '1'
+SLOW_REQUEST_ROUND_TRIPS = int(os.environ.get('SLOW_REQUEST_ROUND_TRIPS', '10'))
+SLOW_REQUEST_DB_MS = float(os.environ.get('SLOW_REQUEST_DB_MS', '250'))
+SLOW_COMMAND_MS = float(os.environ.get('SLOW_COMMAND_MS', '100'))
+
+# MongoDB client: pool sizing, wire compression, read routing for admin/reporting reads
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '0'))
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', '0'))
+MONGO_COMPRESSORS = os.environ.get('MONGO_COMPRESSORS', 'zstd,snappy')
+ANALYTICS_READ_PREFERENCE = os.environ.get('ANALYTICS_READ_PREFERENCE', 'secondaryPreferred')
+ANALYTICS_MAX_STALENESS_SECONDS = int(os.environ.get('ANALYTICS_MAX_STALENESS_SECONDS', '90'))
+
+def available_compressors(names: str) -> list:
+    # zstd and snappy need optional packages (zstandard, python-snappy); zlib is built in
+    modules = {"zstd": "zstandard", "snappy": "snappy", "zlib": "zlib"}
+    available = []
+    for name in filter(None, (n.strip() for n in names.split(','))):
+        try:
+            __import__(modules[name])
+            available.append(name)
+        except (KeyError, ImportError):
+            logger.warning(f"MongoDB sikistirma devre disi: {name} kullanilamiyor")
+    return available
+
+def mongo_client_options() -> dict:
+    # Timestamps are BSON dates; tz_aware returns them as UTC datetimes so responses keep the offset
+    options = {"minPoolSize": MONGO_MIN_POOL_SIZE, "maxPoolSize": MONGO_MAX_POOL_SIZE, "tz_aware": True}
+    if MONGO_WAIT_QUEUE_TIMEOUT_MS:
+        options["waitQueueTimeoutMS"] = MONGO_WAIT_QUEUE_TIMEOUT_MS
+    compressors = available_compressors(MONGO_COMPRESSORS)
+    if compressors:
+        options["compressors"] = ",".join(compressors)
+    return options
+
+def analytics_read_preference():
+    if ANALYTICS_READ_PREFERENCE == 'primary':
+        return Primary()
+    mode = {"secondary": Secondary, "secondaryPreferred": SecondaryPreferred, "nearest": Nearest}[ANALYTICS_READ_PREFERENCE]
+    # MongoDB rejects maxStalenessSeconds below 90
+    return mode(max_staleness=max(ANALYTICS_MAX_STALENESS_SECONDS, 90))
 
-# MongoDB
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[
+    MongoCommandMetrics(), TraceCommandListener(SLOW_COMMAND_MS), MongoPoolMetrics(MONGO_MAX_POOL_SIZE)
+], **mongo_client_options())
 db = client[os.environ['DB_NAME']]
+# Admin/reporting reads may go to secondaries; investor money paths always use `db` (primary)
+analytics_db = client.get_database(os.environ['DB_NAME'], read_preference=analytics_read_preference())
 
 JWT_SECRET = os.environ.get('JWT_SECRET', 'alarko-enerji-jwt-secret-2024-secure')
 JWT_ALGORITHM = 'HS256'
 
+# Auth rate limits (token buckets keyed by client IP and by email/user). In-memory buckets cost
+# microseconds but are per worker; 'mongo' shares them at two round trips per allowed attempt
+AUTH_RATE_LIMIT_STORE = os.environ.get('AUTH_RATE_LIMIT_STORE', 'memory')
+AUTH_RATE_LIMIT_PER_MINUTE = float(os.environ.get('AUTH_RATE_LIMIT_PER_MINUTE', '10'))
+AUTH_RATE_LIMIT_BURST = float(os.environ.get('AUTH_RATE_LIMIT_BURST', '5'))
+AUTH_IP_RATE_LIMIT_PER_MINUTE = float(os.environ.get('AUTH_IP_RATE_LIMIT_PER_MINUTE', '60'))
+AUTH_IP_RATE_LIMIT_BURST = float(os.environ.get('AUTH_IP_RATE_LIMIT_BURST', '30'))
+TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', '1'))
+
+# Shared state across uvicorn workers
+FX_REFRESH_INTERVAL_SECONDS = int(os.environ.get('FX_REFRESH_INTERVAL_SECONDS', '3600'))
+# Upper bound on points returned by /api/usd-rate/history
+FX_HISTORY_MAX_POINTS = int(os.environ.get('FX_HISTORY_MAX_POINTS', '1000'))
+SHARED_CACHE_LOCAL_TTL_SECONDS = float(os.environ.get('SHARED_CACHE_LOCAL_TTL_SECONDS', '30'))
+
+# Balance ledger: roll up a snapshot once a user has this many entries past the last one
+LEDGER_SNAPSHOT_EVERY = int(os.environ.get('LEDGER_SNAPSHOT_EVERY', '50'))
+LEDGER_SNAPSHOT_INTERVAL_SECONDS = int(os.environ.get('LEDGER_SNAPSHOT_INTERVAL_SECONDS', '300'))
+# A ledger seq still missing after this long is taken as a lost write and filled with a repair entry
+LEDGER_GAP_TIMEOUT_SECONDS = int(os.environ.get('LEDGER_GAP_TIMEOUT_SECONDS', '300'))
+
+# Background migrations run in batches with a pause in between
+MIGRATION_BATCH_SIZE = int(os.environ.get('MIGRATION_BATCH_SIZE', '500'))
+MIGRATION_PAUSE_SECONDS = float(os.environ.get('MIGRATION_PAUSE_SECONDS', '0.05'))
+# Read notifications are deleted this many days after being read (0 = keep forever)
+NOTIFICATION_RETENTION_DAYS = int(os.environ.get('NOTIFICATION_RETENTION_DAYS', '90'))
+
+# Retries of money-moving POSTs with the same Idempotency-Key replay the first response
+IDEMPOTENCY_TTL_HOURS = float(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24'))
+IDEMPOTENCY_LOCK_SECONDS = float(os.environ.get('IDEMPOTENCY_LOCK_SECONDS', '30'))
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', '10'))
+
+# JSON responses at least this large are gzip/brotli compressed when the client accepts it
+COMPRESSION_MIN_BYTES = int(os.environ.get('COMPRESSION_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.environ.get('GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.environ.get('BROTLI_QUALITY', '4'))
+
+# Read endpoints whose identical concurrent requests share one database call
+SINGLE_FLIGHT_ROUTES = {r.strip() for r in os.environ.get('SINGLE_FLIGHT_ROUTES', 'projects,project,funding-history').split(',') if r.strip()}
+
+# Secondary market: matching runs on the one worker holding the order-book lease
+ORDER_BOOK_POLL_SECONDS = float(os.environ.get('ORDER_BOOK_POLL_SECONDS', '0.25'))
+ORDER_BOOK_BATCH_SIZE = int(os.environ.get('ORDER_BOOK_BATCH_SIZE', '500'))
+ORDER_BOOK_LEASE_SECONDS = float(os.environ.get('ORDER_BOOK_LEASE_SECONDS', '15'))
+
+# Admin audit log: hash-chained (HMAC with AUDIT_CHAIN_KEY if set), written in groups every AUDIT_FLUSH_MS
+AUDIT_CHAIN_KEY = os.environ.get('AUDIT_CHAIN_KEY', '')
+AUDIT_FLUSH_MS = float(os.environ.get('AUDIT_FLUSH_MS', '50'))
+AUDIT_MAX_BATCH = int(os.environ.get('AUDIT_MAX_BATCH', '500'))
+
+# Distinct investors per project: an exact id list up to this many, a HyperLogLog sketch (4 KB) above
+INVESTOR_EXACT_LIMIT = int(os.environ.get('INVESTOR_EXACT_LIMIT', '100'))
+
+# Scheduled jobs: cron expressions use ROLLUP_TIMEZONE
+ADMIN_STATS_INTERVAL_SECONDS = int(os.environ.get('ADMIN_STATS_INTERVAL_SECONDS', '60'))
+KYC_CLEANUP_CRON = os.environ.get('KYC_CLEANUP_CRON', '30 3 * * *')
+# Uploaded files younger than this are never treated as orphans (the KYC record may not be written yet)
+KYC_ORPHAN_GRACE_SECONDS = int(os.environ.get('KYC_ORPHAN_GRACE_SECONDS', '3600'))
+STALE_PENDING_HOURS = int(os.environ.get('STALE_PENDING_HOURS', '48'))
+
+# Startup: warn when a worker takes longer than this to become ready; Mongo ping timeout for /api/health/ready
+STARTUP_TARGET_SECONDS = float(os.environ.get('STARTUP_TARGET_SECONDS', '5'))
+HEALTH_PING_TIMEOUT_SECONDS = float(os.environ.get('HEALTH_PING_TIMEOUT_SECONDS', '2'))
+
+# Renames are copied into denormalized fields in batches of this size
+PROPAGATION_BATCH_SIZE = int(os.environ.get('PROPAGATION_BATCH_SIZE', '500'))
+PROPAGATION_PAUSE_SECONDS = float(os.environ.get('PROPAGATION_PAUSE_SECONDS', '0.1'))
+PROPAGATION_POLL_SECONDS = float(os.environ.get('PROPAGATION_POLL_SECONDS', '5'))
+
+# Daily rollups are cut at local midnight
+ROLLUP_TIMEZONE = os.environ.get('ROLLUP_TIMEZONE', 'Europe/Istanbul')
+
 UPLOAD_DIR = ROOT_DIR / 'uploads' / 'kyc'
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
-
 app = FastAPI()
 api_router = APIRouter(prefix="/api")
 
@@ -69,6 +218,13 @@ class InvestRequest(BaseModel):
 class SellRequest(BaseModel):
     portfolio_id: str
 
+class OrderCreate(BaseModel):
+    project_id: str
+    side: str
+    quantity: int
+    price: float
+    portfolio_id: Optional[str] = None
+
 class BankCreate(BaseModel):
     name: str
     iban: str
@@ -99,6 +255,14 @@ class UserInfoUpdate(BaseModel):
     email: str = ""
     phone: str = ""
 
+class BulkTransactionStatusUpdate(BaseModel):
+    transaction_ids: List[str]
+    status: str
+
+class BulkKYCReview(BaseModel):
+    kyc_ids: List[str]
+    status: str
+
 # ===== AUTH HELPERS =====
 def hash_password(password: str) -> str:
     return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
@@ -136,33 +300,73 @@ async def get_admin_user(request: Request):
         raise HTTPException(status_code=403, detail="Admin yetkisi gerekli")
     return user
 
+def token_user_id(headers: dict):
+    """User id from a valid bearer token in raw ASGI headers, without a database read."""
+    auth_header = headers.get(b'authorization', b'').decode('latin-1')
+    if not auth_header.startswith('Bearer '):
+        return None
+    try:
+        return jwt.decode(auth_header[7:], JWT_SECRET, algorithms=[JWT_ALGORITHM])['user_id']
+    except (jwt.InvalidTokenError, KeyError):
+        return None
+
+# ===== RATE LIMITING =====
+def bucket_store():
+    # One store per limiter, so a flood of one kind of key can't evict the other's buckets
+    return MongoBucketStore(db.rate_limits) if AUTH_RATE_LIMIT_STORE == 'mongo' else MemoryBucketStore()
+
+auth_limiter = RateLimiter(bucket_store(), AUTH_RATE_LIMIT_PER_MINUTE, AUTH_RATE_LIMIT_BURST)
+auth_ip_limiter = RateLimiter(bucket_store(), AUTH_IP_RATE_LIMIT_PER_MINUTE, AUTH_IP_RATE_LIMIT_BURST)
+
+async def check_auth_rate_limit(request: Request, action: str, subject: str):
+    # Runs before any bcrypt work so a credential-stuffing burst can't pin the CPU
+    keys = (f"{action}:ip:{client_ip(request, TRUSTED_PROXY_HOPS)}", f"{action}:sub:{subject.strip().lower()}")
+    retry_after = max(await asyncio.gather(auth_ip_limiter.check(keys[0]), auth_limiter.check(keys[1])))
+    if retry_after:
+        raise HTTPException(status_code=429, detail="Cok fazla deneme yapildi. Lutfen biraz sonra tekrar deneyin",
+                            headers={"Retry-After": str(math.ceil(retry_after))})
+    return keys
+
+async def refund_auth_rate_limit(keys):
+    # Only failed password checks count against the limit
+    await asyncio.gather(auth_ip_limiter.refund(keys[0]), auth_limiter.refund(keys[1]))
+
 # ===== AUTH ROUTES =====
 @api_router.post("/auth/register")
-async def register(data: UserRegister):
-    existing = await db.users.find_one({"email": data.email}, {"_id": 0})
+async def register(data: UserRegister, request: Request):
+    await check_auth_rate_limit(request, "register", data.email)
+    uow = UnitOfWork("register")
+    # bcrypt runs in a thread while the e-mail lookup is in flight
+    existing, password_hash = await asyncio.gather(
+        uow.step("existing", db.users.find_one, {"email": data.email}, {"_id": 1}),
+        uow.step("hash_password", asyncio.to_thread, hash_password, data.password)
+    )
     if existing:
         raise HTTPException(status_code=400, detail="Bu e-posta adresi zaten kayitli")
     user_id = f"user_{uuid.uuid4().hex[:12]}"
     user = {
         "user_id": user_id, "email": data.email,
-        "password_hash": hash_password(data.password),
+        "password_hash": password_hash,
         "name": data.name, "phone": data.phone,
         "role": "investor", "kyc_status": "pending",
         "balance": 0.0, "picture": "",
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc),
+        **search_fields(data.name, data.email, data.phone)
     }
-    await db.users.insert_one(user)
-    token = create_token(user_id, "investor")
-    await db.notifications.insert_one({
+    uow.add("user", db.users.insert_one, user)
+    uow.add("notification", db.notifications.insert_one, {
         "notification_id": str(uuid.uuid4()), "user_id": user_id,
         "title": "Hoş Geldiniz!", "message": "Alarko Enerji platformuna hoş geldiniz. Yatırım yapmak için kimlik doğrulamanızı tamamlayın.",
         "type": "welcome", "is_read": False,
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     })
+    await uow.run()
+    token = create_token(user_id, "investor")
     return {"token": token, "user": {"user_id": user_id, "email": data.email, "name": data.name, "role": "investor", "kyc_status": "pending", "balance": 0.0, "phone": data.phone, "picture": ""}}
 
 @api_router.post("/auth/login")
-async def login(data: UserLogin):
+async def login(data: UserLogin, request: Request):
+    limit_keys = await check_auth_rate_limit(request, "login", data.email)
     user = await db.users.find_one({"email": data.email}, {"_id": 0})
     if not user:
         raise HTTPException(status_code=401, detail="E-posta veya sifre hatali")
@@ -170,6 +374,7 @@ async def login(data: UserLogin):
         raise HTTPException(status_code=401, detail="Bu hesap Google ile olusturulmus. Google ile giris yapin.")
     if not verify_password(data.password, user['password_hash']):
         raise HTTPException(status_code=401, detail="E-posta veya sifre hatali")
+    await refund_auth_rate_limit(limit_keys)
     token = create_token(user['user_id'], user['role'])
     user_data = {k: v for k, v in user.items() if k != 'password_hash'}
     return {"token": token, "user": user_data}
@@ -177,6 +382,8 @@ async def login(data: UserLogin):
 @api_router.post("/auth/google-callback")
 async def google_callback(data: GoogleAuthCallback):
     # REMINDER: DO NOT HARDCODE THE URL, OR ADD ANY FALLBACKS OR REDIRECT URLS, THIS BREAKS THE AUTH
+    # requests is only needed here and for the FX refresh, so it is not imported at startup
+    import requests
     try:
         resp = requests.get(
             "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
@@ -192,7 +399,7 @@ async def google_callback(data: GoogleAuthCallback):
     picture = auth_data.get('picture', '')
     existing = await db.users.find_one({"email": email}, {"_id": 0})
     if existing:
-        await db.users.update_one({"email": email}, {"$set": {"name": name, "picture": picture}})
+        await db.users.update_one({"email": email}, {"$set": {"name": name, "picture": picture, **search_fields(name, email, existing.get('phone', ''))}})
         user = await db.users.find_one({"email": email}, {"_id": 0})
         token = create_token(user['user_id'], user['role'])
     else:
@@ -201,7 +408,8 @@ async def google_callback(data: GoogleAuthCallback):
             "user_id": user_id, "email": email, "name": name, "picture": picture,
             "role": "investor", "kyc_status": "pending", "balance": 0.0,
             "phone": "", "password_hash": "",
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc),
+            **search_fields(name, email, "")
         }
         await db.users.insert_one(user)
         token = create_token(user_id, "investor")
@@ -209,7 +417,7 @@ async def google_callback(data: GoogleAuthCallback):
             "notification_id": str(uuid.uuid4()), "user_id": user_id,
             "title": "Hos Geldiniz!", "message": "Alarko Enerji platformuna hos geldiniz.",
             "type": "welcome", "is_read": False,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "created_at": datetime.now(timezone.utc)
         })
     user_data = {k: v for k, v in user.items() if k != 'password_hash'}
     return {"token": token, "user": user_data}
@@ -219,17 +427,26 @@ async def get_me(user=Depends(get_current_user)):
     return {k: v for k, v in user.items() if k != 'password_hash'}
 
 # ===== PROJECT ROUTES =====
+# Distinct-investor state stays internal; investors_count is the public figure
+PROJECT_FIELDS = {"_id": 0, "investor_ids": 0, "investor_sketch": 0, "investors_version": 0, "investors_backfilled": 0, "investors_pending": 0}
+
+single_flight = SingleFlight()
+
 @api_router.get("/projects")
+@cache_control("public, max-age=15")
+@coalesce(single_flight, "projects", enabled="projects" in SINGLE_FLIGHT_ROUTES)
 async def get_projects(type: str = None):
     query = {}
     if type and type.lower() != 'all':
         query['type'] = type.upper()
-    projects = await db.projects.find(query, {"_id": 0}).to_list(100)
+    projects = await db.projects.find(query, PROJECT_FIELDS).to_list(100)
     return projects
 
 @api_router.get("/projects/{project_id}")
+@cache_control("public, max-age=15")
+@coalesce(single_flight, "project", enabled="project" in SINGLE_FLIGHT_ROUTES)
 async def get_project(project_id: str):
-    project = await db.projects.find_one({"project_id": project_id}, {"_id": 0})
+    project = await db.projects.find_one({"project_id": project_id}, PROJECT_FIELDS)
     if not project:
         raise HTTPException(status_code=404, detail="Proje bulunamadi")
     return project
@@ -240,51 +457,242 @@ async def create_project(data: ProjectCreate, user=Depends(get_admin_user)):
         "project_id": str(uuid.uuid4()), "name": data.name, "type": data.type.upper(),
         "description": data.description, "location": data.location, "capacity": data.capacity,
         "return_rate": data.return_rate, "total_target": data.total_target,
-        "funded_amount": 0.0, "investors_count": 0, "image_url": data.image_url,
+        "funded_amount": 0.0, "opening_funded_amount": 0.0, "investors_count": 0, "image_url": data.image_url,
         "details": data.details, "status": "active",
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
     await db.projects.insert_one(project)
+    audit_log.record(user, "project.create", "project", project['project_id'], {"name": project['name'], "type": project['type']})
     return {k: v for k, v in project.items() if k != '_id'}
 
 @api_router.put("/admin/projects/{project_id}")
 async def update_project(project_id: str, data: ProjectCreate, user=Depends(get_admin_user)):
-    await db.projects.update_one({"project_id": project_id}, {"$set": data.model_dump()})
-    project = await db.projects.find_one({"project_id": project_id}, {"_id": 0})
+    changes = data.model_dump()
+    before = await db.projects.find_one_and_update({"project_id": project_id}, {"$set": changes}, projection=PROJECT_FIELDS)
+    if not before:
+        return None
+    project = {**before, **changes}
+    audit_log.record(user, "project.update", "project", project_id, {"changes": changed_fields(before, project, changes)})
+    if (before.get('name'), before.get('type')) != (project['name'], project['type']):
+        await enqueue_propagation("project", project_id, {"name": project['name'], "type": project['type']})
     return project
 
 # ===== USD RATE =====
 SHARE_PRICE = 25000
-_usd_cache = {"rate": 38.0, "updated_at": None}
-
-def get_usd_rate():
-    now = datetime.now(timezone.utc)
-    if _usd_cache["updated_at"] and (now - _usd_cache["updated_at"]).total_seconds() < 3600:
-        return _usd_cache["rate"]
+DEFAULT_USD_RATE = 38.0
+shared_cache = SharedCache(db.shared_cache, SHARED_CACHE_LOCAL_TTL_SECONDS)
+fx_history = RateHistory(db.fx_rates, "USD/TRY", sync_interval_seconds=SHARED_CACHE_LOCAL_TTL_SECONDS)
+
+def fetch_usd_rate():
+    import requests
+    resp = requests.get("https://open.er-api.com/v6/latest/USD", timeout=5)
+    resp.raise_for_status()
+    return round(resp.json().get("rates", {}).get("TRY", DEFAULT_USD_RATE), 4)
+
+async def get_usd_rate():
+    # Every worker reads the same shared value; only the lease holder refreshes it
+    rate = await shared_cache.get("usd_try")
+    if rate is None:
+        # Empty shared cache (new database, cache wiped): the last persisted rate beats the default
+        latest = fx_history.latest()
+        rate = latest[1] if latest else DEFAULT_USD_RATE
+    return rate
+
+async def refresh_usd_rate(force: bool = False):
+    entry = await shared_cache.get_entry("usd_try")
+    if entry and not force:
+        age = (datetime.now(timezone.utc) - datetime.fromisoformat(entry['updated_at'])).total_seconds()
+        if age < FX_REFRESH_INTERVAL_SECONDS:
+            return
     try:
-        resp = requests.get("https://open.er-api.com/v6/latest/USD", timeout=5)
-        if resp.status_code == 200:
-            data = resp.json()
-            rate = data.get("rates", {}).get("TRY", 38.0)
-            _usd_cache["rate"] = round(rate, 4)
-            _usd_cache["updated_at"] = now
-            logger.info(f"USD/TRY kuru guncellendi: {_usd_cache['rate']}")
+        rate = await asyncio.to_thread(fetch_usd_rate)
     except Exception as e:
         logger.warning(f"USD kuru alinamadi, cache kullaniliyor: {e}")
-    return _usd_cache["rate"]
+        return
+    await fx_history.record(rate, source="open.er-api.com")
+    await shared_cache.set("usd_try", rate)
+    logger.info(f"USD/TRY kuru guncellendi: {rate}")
+
+def parse_timestamp(value: str, field: str) -> datetime:
+    try:
+        ts = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Gecersiz tarih: {field}")
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
 
 @api_router.get("/usd-rate")
-async def get_usd_rate_endpoint():
-    rate = get_usd_rate()
-    return {"rate": rate, "share_price": SHARE_PRICE}
+@cache_control("public, max-age=300")
+async def get_usd_rate_endpoint(at: str = ""):
+    if not at:
+        rate = await get_usd_rate()
+        return {"rate": rate, "share_price": SHARE_PRICE}
+    # Rate in force at a past moment, e.g. when a USD-based investment was opened
+    await fx_history.sync()
+    found = fx_history.rate_at(parse_timestamp(at, "at"))
+    if not found:
+        raise HTTPException(status_code=404, detail="Bu tarih icin kur kaydi yok")
+    effective_at, rate = found
+    return {"rate": rate, "share_price": SHARE_PRICE, "at": at, "effective_at": effective_at}
+
+@api_router.get("/usd-rate/history")
+@cache_control("public, max-age=300")
+async def get_usd_rate_history(start: str = "", end: str = "", points: int = 200):
+    if not 1 <= points <= FX_HISTORY_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"points 1 ile {FX_HISTORY_MAX_POINTS} arasinda olmalidir")
+    await fx_history.sync()
+    end_ts = parse_timestamp(end, "end") if end else datetime.now(timezone.utc)
+    start_ts = parse_timestamp(start, "start") if start else end_ts - timedelta(days=30)
+    if start_ts >= end_ts:
+        raise HTTPException(status_code=400, detail="start, end'den once olmalidir")
+    return {"pair": fx_history.pair, "start": start_ts, "end": end_ts,
+            "points": fx_history.series(start_ts, end_ts, points)}
+
+# ===== BALANCE LEDGER =====
+async def apply_balance_change(user_id: str, delta: float, kind: str, ref_id: str = "", require_funds: bool = False):
+    """Move a user's balance and append the matching ledger entry.
+
+    Returns the new balance, or None if the user is missing or (with
+    ``require_funds``) the balance would go negative.
+    """
+    return await apply_balance_changes(user_id, [(delta, kind, ref_id)], require_funds)
+
+async def apply_balance_changes(user_id: str, changes: list, require_funds: bool = False):
+    """Apply several ``(delta, kind, ref_id)`` moves for one user with a single balance update."""
+    total = sum(delta for delta, _, _ in changes)
+    query = {"user_id": user_id}
+    if require_funds and total < 0:
+        query["balance"] = {"$gte": -total}
+    now = datetime.now(timezone.utc)
+    # Balance and ledger sequence move together in one atomic update
+    user = await db.users.find_one_and_update(
+        query, {"$inc": {"balance": total, "ledger_seq": len(changes)}, "$set": {"ledger_at": now}},
+        projection={"_id": 0, "balance": 1, "ledger_seq": 1}, return_document=ReturnDocument.AFTER
+    )
+    if not user:
+        return None
+    first_seq = user['ledger_seq'] - len(changes) + 1
+    balance = user['balance'] - total
+    # First ledger entry for this user: record the pre-ledger balance as the opening snapshot
+    opening = {"user_id": user_id, "balance": balance, "as_of": now} if first_seq == 1 else None
+    entries = []
+    for i, (delta, kind, ref_id) in enumerate(changes):
+        balance += delta
+        entries.append({
+            "entry_id": str(uuid.uuid4()), "user_id": user_id, "seq": first_seq + i,
+            "delta": delta, "balance_after": round(balance, 2), "kind": kind, "ref_id": ref_id, "created_at": now
+        })
+    if not await write_entries(db, entries, opening):
+        # The balance has moved; the snapshot job fills the reserved seqs once the gap times out
+        logger.error(f"Defter kayitlari yazilamadi, bosluk onarilacak: {user_id} seq {first_seq}-{user['ledger_seq']}")
+        try:
+            await db.users.update_one({"user_id": user_id}, {"$set": {"ledger_gap": True}})
+        except PyMongoError:
+            pass
+    return user['balance']
+
+async def ledger_balance(user_id: str, at: datetime = None):
+    """Balance from the latest snapshot plus the ledger tail, optionally as of a point in time."""
+    snap_query = {"user_id": user_id}
+    if at:
+        snap_query["as_of"] = {"$lte": at}
+    snapshot = await db.balance_snapshots.find_one(snap_query, {"_id": 0}, sort=[("seq", DESCENDING)])
+    if not snapshot:
+        return None
+    tail_query = {"user_id": user_id, "seq": {"$gt": snapshot['seq']}}
+    if at:
+        tail_query["created_at"] = {"$lte": at}
+    tail = await db.ledger.find(tail_query, {"_id": 0, "delta": 1}).to_list(None)
+    return {"balance": round(snapshot['balance'] + sum(e['delta'] for e in tail), 2),
+            "snapshot_seq": snapshot['seq'], "tail_entries": len(tail)}
+
+async def roll_up_snapshot(user_id: str):
+    # The user is read before the tail, so a gap at the end is sized from a balance the tail already covers
+    user = await db.users.find_one({"user_id": user_id}, {"_id": 0, "balance": 1, "ledger_seq": 1, "ledger_at": 1})
+    snapshot = await db.balance_snapshots.find_one({"user_id": user_id}, {"_id": 0}, sort=[("seq", DESCENDING)])
+    if not user or not snapshot:
+        return
+    tail = await db.ledger.find({"user_id": user_id, "seq": {"$gt": snapshot['seq']}}, {"_id": 0}).sort("seq", ASCENDING).to_list(None)
+    now = datetime.now(timezone.utc)
+    balance, seq, at, repairs = roll_forward(user_id, snapshot, tail, user, now - timedelta(seconds=LEDGER_GAP_TIMEOUT_SECONDS), now)
+    if repairs:
+        logger.warning(f"Defter boslugu onariliyor: {user_id} seq {repairs[0]['seq']}-{repairs[-1]['seq']}")
+        if not await write_entries(db, repairs):
+            return
+    if seq == snapshot['seq']:
+        return
+    await db.balance_snapshots.update_one(
+        {"user_id": user_id, "seq": seq},
+        {"$setOnInsert": {"balance": round(balance, 2), "as_of": at}}, upsert=True
+    )
+    update = {"$max": {"ledger_snapshot_seq": seq}}
+    if seq >= user.get('ledger_seq', 0):
+        update["$unset"] = {"ledger_gap": ""}
+    await db.users.update_one({"user_id": user_id}, update)
+
+async def roll_up_snapshots():
+    due = db.users.find(
+        {"$or": [
+            {"ledger_gap": True},
+            {"$expr": {"$gte": [{"$subtract": [{"$ifNull": ["$ledger_seq", 0]}, {"$ifNull": ["$ledger_snapshot_seq", 0]}]}, LEDGER_SNAPSHOT_EVERY]}},
+        ]},
+        {"_id": 0, "user_id": 1}
+    )
+    async for u in due:
+        await roll_up_snapshot(u['user_id'])
+
+@api_router.get("/admin/users/{user_id}/ledger")
+async def get_user_ledger(user_id: str, before_seq: int = None, limit: int = 100, admin=Depends(get_admin_user)):
+    query = {"user_id": user_id}
+    if before_seq is not None:
+        query["seq"] = {"$lt": before_seq}
+    return await db.ledger.find(query, {"_id": 0}).sort("seq", DESCENDING).to_list(min(limit, 500))
+
+@api_router.get("/admin/users/{user_id}/balance-history")
+async def get_user_balance_at(user_id: str, at: str = None, admin=Depends(get_admin_user)):
+    try:
+        at_time = as_utc(at)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Gecersiz tarih")
+    result = await ledger_balance(user_id, at_time)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Bu kullanici icin defter kaydi bulunamadi")
+    return {"user_id": user_id, "at": at, **result}
 
 # ===== PORTFOLIO ROUTES =====
+async def update_summary(user_id: str, update: dict):
+    for attempt in range(2):
+        try:
+            await db.portfolio_summaries.update_one({"_id": user_id}, update, upsert=True)
+            return
+        except DuplicateKeyError:
+            # Two upserts raced to create the summary; the retry updates the winner's document
+            if attempt:
+                raise
+
+async def begin_summary_changes(user_ids):
+    """Mark the users' summaries as changing before their lots are written; a rebuild waits until
+    ``apply_summary_delta`` (called for every user marked, with ``{}`` if nothing changed) ends it."""
+    await asyncio.gather(*(update_summary(user_id, begin_update()) for user_id in set(user_ids)))
+
+async def apply_summary_delta(user_id: str, delta: dict, project_names: dict = None):
+    """``$inc`` a change to the user's lots into their portfolio summary and end the change."""
+    await update_summary(user_id, summary_update(delta, project_names))
+
 @api_router.get("/portfolio")
-async def get_portfolio(user=Depends(get_current_user)):
-    investments = await db.portfolios.find({"user_id": user['user_id']}, {"_id": 0}).to_list(100)
-    total_invested = sum(i.get('amount', 0) for i in investments)
-    total_monthly_return = sum(i.get('monthly_return', 0) for i in investments)
-    return {"investments": investments, "total_invested": total_invested, "total_monthly_return": total_monthly_return, "balance": user.get('balance', 0)}
+async def get_portfolio(limit: int = 100, offset: int = 0, user=Depends(get_current_user)):
+    return await portfolio_view(user, limit, offset)
+
+async def portfolio_view(user: dict, limit: int = 100, offset: int = 0) -> dict:
+    # Totals come from the summary document; the lot list is just one page of the positions
+    summary, investments = await asyncio.gather(
+        db.portfolio_summaries.find_one({"_id": user['user_id']}),
+        db.portfolios.find({"user_id": user['user_id']}, {"_id": 0, "settled_trades": 0})
+            .sort("purchase_date", DESCENDING).skip(max(0, offset)).limit(max(1, min(limit, 500))).to_list(None)
+    )
+    if summary is None:
+        # No summary yet (older account before the backfill reaches it): count the lots directly
+        summary = summaries.summarize(await db.portfolios.find({"user_id": user['user_id']}, LOT_FIELDS).to_list(None))
+    return {"investments": investments, **summaries.present(summary), "balance": user.get('balance', 0)}
 
 @api_router.post("/portfolio/invest")
 async def invest(data: InvestRequest, user=Depends(get_current_user)):
@@ -296,11 +704,15 @@ async def invest(data: InvestRequest, user=Depends(get_current_user)):
         raise HTTPException(status_code=400, detail=f"Yatirim tutari {SHARE_PRICE:,.0f} TL'nin katlari olmalidir")
     if user.get('balance', 0) < data.amount:
         raise HTTPException(status_code=400, detail="Yetersiz bakiye")
-    project = await db.projects.find_one({"project_id": data.project_id}, {"_id": 0})
+    project = await db.projects.find_one({"project_id": data.project_id}, PROJECT_FIELDS)
     if not project:
         raise HTTPException(status_code=404, detail="Proje bulunamadi")
+    portfolio_id = str(uuid.uuid4())
+    # Conditional debit: concurrent investments can't overdraw the balance
+    if await apply_balance_change(user['user_id'], -data.amount, "investment", portfolio_id, require_funds=True) is None:
+        raise HTTPException(status_code=400, detail="Yetersiz bakiye")
     shares = int(data.amount / SHARE_PRICE)
-    usd_rate = get_usd_rate()
+    usd_rate = await get_usd_rate()
     # Tiered return rates based on share count
     if shares >= 10:
         actual_rate = 8.0
@@ -318,21 +730,33 @@ async def invest(data: InvestRequest, user=Depends(get_current_user)):
     else:
         monthly_return = data.amount * (actual_rate / 100)
     entry = {
-        "portfolio_id": str(uuid.uuid4()), "user_id": user['user_id'],
+        "portfolio_id": portfolio_id, "user_id": user['user_id'],
+        "user_name": user.get('name', ''), "user_email": user.get('email', ''),
         "project_id": data.project_id, "project_name": project['name'],
         "project_type": project['type'], "amount": data.amount,
         "shares": shares, "usd_based": usd_based,
         "usd_rate_at_purchase": usd_rate if usd_based else None,
         "monthly_return": round(monthly_return, 2), "return_rate": actual_rate,
-        "purchase_date": datetime.now(timezone.utc).isoformat(), "status": "active"
+        "purchase_date": datetime.now(timezone.utc), "status": "active",
+        "in_rollup": True, "in_summary": True, "in_cash_flow": True
     }
-    await db.portfolios.insert_one(entry)
-    await db.users.update_one({"user_id": user['user_id']}, {"$inc": {"balance": -data.amount}})
-    await db.projects.update_one({"project_id": data.project_id}, {"$inc": {"funded_amount": data.amount, "investors_count": 1}})
+    await begin_summary_changes([user['user_id']])
+    try:
+        await db.portfolios.insert_one(entry)
+    except Exception:
+        await apply_summary_delta(user['user_id'], {})
+        raise
+    await asyncio.gather(
+        db.projects.update_one({"project_id": data.project_id}, {"$inc": {"funded_amount": data.amount}}),
+        record_project_investors(data.project_id, [user['user_id']]),
+        record_cash_flow("investment", "completed", data.amount),
+        apply_summary_delta(user['user_id'], lot_delta(entry), {data.project_id: project['name']}),
+        record_project_flow(data.project_id, user['user_id'], inflow=data.amount)
+    )
     await db.notifications.insert_one({
         "notification_id": str(uuid.uuid4()), "user_id": user['user_id'],
         "title": "Yatirim Basarili", "message": f"{project['name']} projesine {shares} hisse ({data.amount:,.0f} TL) yatirim yaptiniz.",
-        "type": "investment", "is_read": False, "created_at": datetime.now(timezone.utc).isoformat()
+        "type": "investment", "is_read": False, "created_at": datetime.now(timezone.utc)
     })
     return {"message": "Yatirim basariyla gerceklestirildi", "portfolio": {k: v for k, v in entry.items() if k != '_id'}}
 
@@ -341,17 +765,571 @@ async def sell_investment(data: SellRequest, user=Depends(get_current_user)):
     inv = await db.portfolios.find_one({"portfolio_id": data.portfolio_id, "user_id": user['user_id']}, {"_id": 0})
     if not inv:
         raise HTTPException(status_code=404, detail="Yatirim bulunamadi")
-    await db.users.update_one({"user_id": user['user_id']}, {"$inc": {"balance": inv['amount']}})
-    await db.portfolios.delete_one({"portfolio_id": data.portfolio_id})
+    if inv.get('shares_on_sale'):
+        raise HTTPException(status_code=400, detail="Bu yatirimin pazarda satis emri var, once emri iptal edin")
+    # Delete first so a double-submitted sell can only refund once; shares listed meanwhile block it
+    await begin_summary_changes([user['user_id']])
+    try:
+        deleted = await db.portfolios.find_one_and_delete({"portfolio_id": data.portfolio_id, "user_id": user['user_id'], "shares_on_sale": {"$in": [0, None]}}, projection={"_id": 0})
+    except Exception:
+        await apply_summary_delta(user['user_id'], {})
+        raise
+    if not deleted:
+        await apply_summary_delta(user['user_id'], {})
+        raise HTTPException(status_code=404, detail="Yatirim bulunamadi")
+    await asyncio.gather(
+        apply_balance_change(user['user_id'], inv['amount'], "sale", data.portfolio_id),
+        db.projects.update_one({"project_id": inv['project_id']}, {"$inc": {"funded_amount": -inv['amount']}}),
+        record_project_flow(inv['project_id'], user['user_id'], outflow=inv['amount']),
+        record_cash_flow("sale", "completed", inv['amount']),
+        # A lot the backfill hasn't counted yet isn't in the summary to take out
+        apply_summary_delta(user['user_id'], lot_delta(deleted, -1) if deleted.get('in_summary') else {})
+    )
     await db.notifications.insert_one({
         "notification_id": str(uuid.uuid4()), "user_id": user['user_id'],
         "title": "Yatırım Satıldı", "message": f"{inv['amount']:,.0f} TL tutarındaki yatırımınız satıldı.",
-        "type": "sale", "is_read": False, "created_at": datetime.now(timezone.utc).isoformat()
+        "type": "sale", "is_read": False, "created_at": datetime.now(timezone.utc)
     })
     return {"message": "Yatirim basariyla satildi"}
 
+# ===== SECONDARY MARKET =====
+# Investors trade shares with each other through limit orders. Placing an order
+# reserves what it needs (cash for a buy, shares of a portfolio lot for a sell);
+# matching runs in memory on the worker holding the order-book lease, which
+# takes new orders from the database in batches and writes each batch's
+# trades and order states back with bulk writes.
+order_engine = MatchingEngine()
+order_book_lease = Lease(db.leases, "order-book", ttl_seconds=ORDER_BOOK_LEASE_SECONDS)
+order_book_wakeup = asyncio.Event()
+ORDER_FIELDS = {"_id": 0, "order_id": 1, "user_id": 1, "project_id": 1, "side": 1, "price": 1, "quantity": 1,
+                "remaining": 1, "seq": 1, "status": 1, "portfolio_id": 1}
+
+@api_router.post("/market/orders")
+async def place_order(data: OrderCreate, user=Depends(get_current_user)):
+    if data.side not in (BUY, SELL):
+        raise HTTPException(status_code=400, detail="Gecersiz emir yonu")
+    price = round(data.price, 2)
+    if data.quantity < 1 or price <= 0:
+        raise HTTPException(status_code=400, detail="Emir adedi ve fiyati sifirdan buyuk olmalidir")
+    project = await db.projects.find_one({"project_id": data.project_id}, {"_id": 0, "name": 1})
+    if not project:
+        raise HTTPException(status_code=404, detail="Proje bulunamadi")
+    order_id = str(uuid.uuid4())
+    order = {
+        "order_id": order_id, "user_id": user['user_id'], "project_id": data.project_id,
+        "project_name": project['name'], "side": data.side, "price": price,
+        "quantity": data.quantity, "remaining": data.quantity, "status": "new",
+        "created_at": datetime.now(timezone.utc)
+    }
+    if data.side == BUY:
+        # The full limit value is held until the order fills or is cancelled
+        if await apply_balance_change(user['user_id'], -round(price * data.quantity, 2), "order_hold", order_id, require_funds=True) is None:
+            raise HTTPException(status_code=400, detail="Yetersiz bakiye")
+    else:
+        if not data.portfolio_id:
+            raise HTTPException(status_code=400, detail="Satis emri icin yatirim secilmelidir")
+        listed = await db.portfolios.update_one({
+            "portfolio_id": data.portfolio_id, "user_id": user['user_id'], "project_id": data.project_id,
+            "$expr": {"$lte": [{"$add": [{"$ifNull": ["$shares_on_sale", 0]}, data.quantity]}, "$shares"]}
+        }, {"$inc": {"shares_on_sale": data.quantity}})
+        if not listed.modified_count:
+            raise HTTPException(status_code=400, detail="Satilabilir hisse yetersiz")
+        order["portfolio_id"] = data.portfolio_id
+    try:
+        await db.orders.insert_one(order)
+    except Exception:
+        # The write may have landed before the error; if not, no order will ever release the hold
+        if await db.orders.find_one({"order_id": order_id}, {"_id": 1}):
+            raise
+        if data.side == BUY:
+            await apply_balance_change(user['user_id'], round(price * data.quantity, 2), "order_release", order_id)
+        else:
+            await db.portfolios.update_one({"portfolio_id": data.portfolio_id}, {"$inc": {"shares_on_sale": -data.quantity}})
+        raise
+    order_book_wakeup.set()
+    return {"message": "Emir alindi", "order": {k: v for k, v in order.items() if k != '_id'}}
+
+@api_router.delete("/market/orders/{order_id}")
+async def cancel_order(order_id: str, user=Depends(get_current_user)):
+    # Only the matching loop changes an order's state; this asks it to cancel
+    result = await db.orders.update_one(
+        {"order_id": order_id, "user_id": user['user_id'], "status": {"$in": ["new", "open"]}},
+        {"$set": {"cancel_requested": True}}
+    )
+    if not result.matched_count:
+        raise HTTPException(status_code=404, detail="Acik emir bulunamadi")
+    order_book_wakeup.set()
+    return {"message": "Iptal talebi alindi"}
+
+@api_router.get("/market/orders")
+async def get_my_orders(status: str = "", user=Depends(get_current_user)):
+    query = {"user_id": user['user_id']}
+    if status:
+        query["status"] = status
+    return await db.orders.find(query, {"_id": 0}).sort("created_at", DESCENDING).to_list(200)
+
+@api_router.get("/market/projects/{project_id}/book")
+async def get_order_book(project_id: str, levels: int = 20):
+    levels = max(1, min(levels, 100))
+    pipeline = [
+        {"$match": {"project_id": project_id, "status": "open"}},
+        {"$group": {"_id": {"side": "$side", "price": "$price"}, "quantity": {"$sum": "$remaining"}, "orders": {"$sum": 1}}},
+    ]
+    rows = await db.orders.aggregate(pipeline).to_list(None)
+    book = {BUY: [], SELL: []}
+    for row in rows:
+        book[row['_id']['side']].append({"price": row['_id']['price'], "quantity": row['quantity'], "orders": row['orders']})
+    return {
+        "project_id": project_id,
+        "bids": sorted(book[BUY], key=lambda level: -level['price'])[:levels],
+        "asks": sorted(book[SELL], key=lambda level: level['price'])[:levels],
+    }
+
+@api_router.get("/market/projects/{project_id}/trades")
+async def get_project_trades(project_id: str, limit: int = 50):
+    return await db.trades.find(
+        {"project_id": project_id}, {"_id": 0, "trade_id": 1, "price": 1, "quantity": 1, "executed_at": 1}
+    ).sort("executed_at", DESCENDING).limit(max(1, min(limit, 200))).to_list(None)
+
+async def run_order_book():
+    """Matching loop. Every worker runs it; only the lease holder matches, the rest stand by."""
+    renewed_at = None
+    while True:
+        try:
+            if renewed_at is None or time.monotonic() - renewed_at > ORDER_BOOK_LEASE_SECONDS / 3:
+                if not await order_book_lease.acquire():
+                    renewed_at = None
+                    order_engine.reset()
+                    await asyncio.sleep(ORDER_BOOK_LEASE_SECONDS / 3)
+                    continue
+                renewed_at = time.monotonic()
+            if not order_engine.loaded:
+                await recover_order_book()
+            if not await match_pending_orders():
+                try:
+                    await asyncio.wait_for(order_book_wakeup.wait(), timeout=ORDER_BOOK_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                order_book_wakeup.clear()
+        except asyncio.CancelledError:
+            await order_book_lease.release()
+            raise
+        except Exception as e:
+            # The in-memory book may be ahead of the database now; rebuild it from there
+            order_engine.reset()
+            logger.warning(f"Emir defteri hatasi, defter yeniden yuklenecek: {e}")
+            await asyncio.sleep(1)
+
+async def recover_order_book():
+    # Trades matched before a crash but not fully settled are finished first
+    unsettled = await db.trades.find({"settled": False}, {"_id": 0}).to_list(None)
+    if unsettled:
+        await settle_trades(unsettled, recovering=True)
+    docs = await db.orders.find({"status": "open"}, ORDER_FIELDS).sort("seq", ASCENDING).to_list(None)
+    last = await db.orders.find_one({"seq": {"$exists": True}}, {"_id": 0, "seq": 1}, sort=[("seq", DESCENDING)])
+    order_engine.restore([Order.from_doc(d) for d in docs], last['seq'] if last else 0)
+    logger.info(f"Emir defteri yuklendi: {len(docs)} acik emir, {len(unsettled)} tamamlanan islem ({WORKER_ID})")
+
+async def match_pending_orders() -> int:
+    """Match one batch of new orders and cancel requests; returns how many orders it took."""
+    cancels, incoming = await asyncio.gather(
+        db.orders.find({"cancel_requested": True, "status": {"$in": ["new", "open"]}}, ORDER_FIELDS).to_list(ORDER_BOOK_BATCH_SIZE),
+        db.orders.find({"status": "new", "cancel_requested": {"$ne": True}}, ORDER_FIELDS)
+            .sort([("created_at", ASCENDING), ("order_id", ASCENDING)]).to_list(ORDER_BOOK_BATCH_SIZE)
+    )
+    if not cancels and not incoming:
+        return 0
+    started = time.perf_counter()
+    touched, fills, cancelled = {}, [], []
+    for doc in cancels:
+        # Orders still "new" never reached the book
+        order = order_engine.cancel(doc['project_id'], doc['order_id']) or Order.from_doc(doc)
+        order.status = "cancelled"
+        touched[order.order_id] = order
+        cancelled.append(order)
+    for doc in incoming:
+        order = Order.from_doc(doc)
+        ORDER_BOOK_ORDERS.inc(order.side)
+        matched = order_engine.submit(order)
+        touched[order.order_id] = order
+        for fill in matched:
+            touched[fill.buy.order_id] = fill.buy
+            touched[fill.sell.order_id] = fill.sell
+        fills.extend(matched)
+        if order.status == "cancelled":
+            # Self-trade prevention dropped the rest of the order
+            cancelled.append(order)
+    await persist_matches(touched, fills, cancelled)
+    ORDER_BOOK_TRADES.inc(amount=len(fills))
+    ORDER_BOOK_BATCH_SECONDS.observe(time.perf_counter() - started)
+    return len(cancels) + len(incoming)
+
+async def persist_matches(touched: dict, fills: list, cancelled: list):
+    now = datetime.now(timezone.utc)
+    trades = [{
+        # A buy and a sell order meet at most once (one of them is used up), so the id is stable
+        # and a batch matched again after a crash doesn't record its trades twice
+        "trade_id": f"{f.buy.order_id}:{f.sell.order_id}", "project_id": f.buy.project_id,
+        "price": f.price, "quantity": f.quantity, "buy_limit": f.buy.price,
+        "buy_order_id": f.buy.order_id, "sell_order_id": f.sell.order_id,
+        "buyer_id": f.buy.user_id, "seller_id": f.sell.user_id, "sell_portfolio_id": f.sell.portfolio_id,
+        "executed_at": now, "settled": False, "in_cash_flow": True
+    } for f in fills]
+    if trades:
+        try:
+            await db.trades.insert_many(trades, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            if any(err['code'] != 11000 for err in errors):
+                raise
+            recorded = {trades[err['index']]['trade_id'] for err in errors}
+            trades = [t for t in trades if t['trade_id'] not in recorded]
+    await db.orders.bulk_write([
+        UpdateOne({"order_id": o.order_id}, {"$set": {"status": o.status, "remaining": o.remaining, "seq": o.seq, "updated_at": now}})
+        for o in touched.values()
+    ], ordered=False)
+    await asyncio.gather(settle_trades(trades), release_reservations(cancelled))
+
+async def release_reservations(orders: list):
+    """Give back what cancelled orders still held: cash for buys, listed shares for sells."""
+    for order in orders:
+        if not order.remaining:
+            continue
+        if order.side == BUY:
+            await apply_balance_change(order.user_id, round(order.price * order.remaining, 2), "order_release", order.order_id)
+        else:
+            await db.portfolios.update_one({"portfolio_id": order.portfolio_id}, {"$inc": {"shares_on_sale": -order.remaining}})
+
+async def settle_trades(trades: list, recovering: bool = False):
+    """Move shares from the seller's lot to a new lot for the buyer, pay the seller and
+    refund the buyer the difference between the limit held and the trade price.
+
+    Every step is safe to repeat (deterministic lot ids, per-trade guards, ledger
+    lookups when ``recovering``), so trades left half-settled by a crash are
+    finished on the next recovery.
+    """
+    if not trades:
+        return
+    lot_ids = list({t['sell_portfolio_id'] for t in trades})
+    buyer_ids = list({t['buyer_id'] for t in trades})
+    lots, buyers = await asyncio.gather(
+        db.portfolios.find({"portfolio_id": {"$in": lot_ids}}, {"_id": 0, "settled_trades": 0}).to_list(None),
+        db.users.find({"user_id": {"$in": buyer_ids}}, {"_id": 0, "user_id": 1, "name": 1, "email": 1}).to_list(None)
+    )
+    lots = {lot['portfolio_id']: lot for lot in lots}
+    buyers = {b['user_id']: b for b in buyers}
+    now = datetime.now(timezone.utc)
+    lot_writes, moves, notifications, settled, new_lots = [], defaultdict(list), [], [], []
+    for t in trades:
+        lot = lots.get(t['sell_portfolio_id'])
+        if not lot:
+            logger.error(f"Islem {t['trade_id']} icin satici yatirimi bulunamadi, uzlastirma bekletiliyor")
+            continue
+        quantity, trade_id = t['quantity'], t['trade_id']
+        # A lot already emptied by this trade has nothing left to compute from; its writes are no-ops then
+        per_share_return = lot.get('monthly_return', 0) / lot['shares'] if lot.get('shares') else 0
+        buyer = buyers.get(t['buyer_id'], {})
+        new_lots.append((t, lot, per_share_return))
+        lot_writes.append(UpdateOne({"portfolio_id": f"trade:{trade_id}"}, {"$setOnInsert": {
+            "portfolio_id": f"trade:{trade_id}", "user_id": t['buyer_id'],
+            "user_name": buyer.get('name', ''), "user_email": buyer.get('email', ''),
+            "project_id": lot['project_id'], "project_name": lot.get('project_name', ''), "project_type": lot.get('project_type', ''),
+            "amount": quantity * SHARE_PRICE, "shares": quantity, "usd_based": lot.get('usd_based', False),
+            "usd_rate_at_purchase": lot.get('usd_rate_at_purchase'), "monthly_return": round(per_share_return * quantity, 2),
+            "return_rate": lot.get('return_rate'), "purchase_date": now, "purchase_price": t['price'],
+            "trade_id": trade_id, "status": "active", "in_rollup": True, "in_summary": True, "in_cash_flow": True
+        }}, upsert=True))
+        lot_writes.append(UpdateOne({"portfolio_id": lot['portfolio_id'], "settled_trades": {"$ne": trade_id}}, {
+            "$inc": {"shares": -quantity, "shares_on_sale": -quantity, "amount": -quantity * SHARE_PRICE,
+                     "monthly_return": -round(per_share_return * quantity, 2)},
+            "$push": {"settled_trades": trade_id}
+        }))
+        moves[t['seller_id']].append((round(t['price'] * quantity, 2), "trade_sale", trade_id))
+        improvement = round((t['buy_limit'] - t['price']) * quantity, 2)
+        if improvement > 0:
+            moves[t['buyer_id']].append((improvement, "order_refund", trade_id))
+        notifications += [{
+            "notification_id": str(uuid.uuid4()), "user_id": user_id, "title": title,
+            "message": f"{lot.get('project_name', '')}: {quantity} hisse, hisse basi {t['price']:,.2f} TL",
+            "type": "trade", "is_read": False, "created_at": now
+        } for user_id, title in ((t['buyer_id'], "Alis Emri Gerceklesti"), (t['seller_id'], "Satis Emri Gerceklesti"))]
+        settled.append(trade_id)
+    if recovering and moves:
+        # Skip ledger moves a crashed run already made
+        done = {(e['user_id'], e['kind'], e['ref_id']) async for e in db.ledger.find(
+            {"user_id": {"$in": list(moves)}, "ref_id": {"$in": settled}}, {"_id": 0, "user_id": 1, "kind": 1, "ref_id": 1})}
+        moves = {uid: [m for m in ms if (uid, m[1], m[2]) not in done] for uid, ms in moves.items()}
+    created = set()
+    # Every user marked here gets apply_summary_delta below, even with nothing to add
+    summary_users = {uid for t, _, _ in new_lots for uid in (t['buyer_id'], t['seller_id'])}
+    await begin_summary_changes(summary_users)
+    if lot_writes:
+        try:
+            upserted = (await db.portfolios.bulk_write(lot_writes, ordered=True)).upserted_ids
+        except Exception:
+            await asyncio.gather(*(apply_summary_delta(user_id, {}) for user_id in summary_users))
+            raise
+        if upserted:
+            created = {p['portfolio_id'] async for p in db.portfolios.find({"_id": {"$in": list(upserted.values())}}, {"_id": 0, "portfolio_id": 1})}
+    # Summaries move only for trades whose buyer lot this run created, so a repeat doesn't count twice
+    summary_deltas, project_names, remaining, new_investors = defaultdict(list), defaultdict(dict), {}, defaultdict(set)
+    traded = [t for t, _, _ in new_lots if f"trade:{t['trade_id']}" in created]
+    for t, lot, per_share_return in new_lots:
+        if f"trade:{t['trade_id']}" not in created:
+            continue
+        quantity, project_id = t['quantity'], lot['project_id']
+        amount, monthly_return = quantity * SHARE_PRICE, round(per_share_return * quantity, 2)
+        usd = (lot.get('usd_based', False), lot.get('usd_rate_at_purchase'))
+        summary_deltas[t['buyer_id']].append(position_delta(project_id, amount, quantity, monthly_return, 1, *usd))
+        new_investors[project_id].add(t['buyer_id'])
+        project_names[t['buyer_id']][project_id] = lot.get('project_name', '')
+        if lot.get('in_summary'):
+            left = remaining[lot['portfolio_id']] = remaining.get(lot['portfolio_id'], lot.get('shares', 0)) - quantity
+            summary_deltas[t['seller_id']].append(position_delta(project_id, -amount, -quantity, -monthly_return, -1 if left <= 0 else 0, *usd))
+    await asyncio.gather(
+        *(apply_balance_changes(user_id, changes) for user_id, changes in moves.items() if changes),
+        *(apply_summary_delta(user_id, combine(summary_deltas.get(user_id, [])), project_names.get(user_id)) for user_id in summary_users),
+        *(record_project_investors(project_id, user_ids) for project_id, user_ids in new_investors.items()),
+        record_cash_flow("trade", "completed", round(sum(t['price'] * t['quantity'] for t in traded), 2), count=len(traded)) if traded else asyncio.sleep(0),
+        db.notifications.insert_many(notifications) if notifications and not recovering else asyncio.sleep(0),
+    )
+    if settled:
+        # Trades from before the cash-flow rollups were counted above; the flag keeps the backfill off them
+        await db.trades.update_many({"trade_id": {"$in": settled}}, {"$set": {"settled": True, "in_cash_flow": True}})
+    # Sold-out lots go only after their trades are marked settled; recovery still needs them until then
+    await db.portfolios.delete_many({"portfolio_id": {"$in": lot_ids}, "shares": {"$lte": 0}})
+
+# ===== PROJECT FUNDING ROLLUPS =====
+def rollup_timezone():
+    try:
+        return ZoneInfo(ROLLUP_TIMEZONE)
+    except ZoneInfoNotFoundError:
+        # Slim images may ship without tzdata; Turkey has been fixed at UTC+3 since 2016
+        logger.warning(f"Saat dilimi bulunamadi ({ROLLUP_TIMEZONE}), UTC+3 kullaniliyor")
+        return timezone(timedelta(hours=3))
+
+ROLLUP_TZ = rollup_timezone()
+PROJECT_FLOW_FIELDS = ("inflow", "outflow", "net", "investments", "sales")
+
+async def record_project_flow(project_id: str, user_id: str, inflow: float = 0, outflow: float = 0, at: datetime = None):
+    """Add one investment or sale to the project's bucket for the local day."""
+    day = day_key(at or datetime.now(timezone.utc), ROLLUP_TZ)
+    update = {
+        "$inc": {"inflow": inflow, "outflow": outflow, "net": inflow - outflow,
+                 "investments": 1 if inflow else 0, "sales": 1 if outflow else 0},
+        "$setOnInsert": {"project_id": project_id, "day": day}
+    }
+    if inflow:
+        update["$addToSet"] = {"investors": user_id}
+    for attempt in range(2):
+        try:
+            await db.project_daily.update_one({"_id": f"{project_id}:{day}"}, update, upsert=True)
+            return
+        except DuplicateKeyError:
+            # Two upserts raced to create the bucket; the retry updates the winner's document
+            if attempt:
+                raise
+
+@api_router.get("/projects/{project_id}/funding-history")
+@cache_control("public, max-age=60")
+@coalesce(single_flight, "funding-history", enabled="funding-history" in SINGLE_FLIGHT_ROUTES)
+async def get_project_funding_history(project_id: str, resolution: str = "day", start: str = "", end: str = ""):
+    if resolution not in RESOLUTIONS:
+        raise HTTPException(status_code=400, detail="Gecersiz cozunurluk")
+    window = {"project_id": project_id}
+    if start or end:
+        window["day"] = {**({"$gte": start} if start else {}), **({"$lte": end} if end else {})}
+    before = [{"$match": {"project_id": project_id, "day": {"$lt": start}}}, {"$group": {"_id": None, "net": {"$sum": "$net"}}}]
+    buckets, opening = await asyncio.gather(
+        db.project_daily.find(window, {"_id": 0, "project_id": 0}).sort("day", 1).to_list(None),
+        db.project_daily.aggregate(before).to_list(1) if start else asyncio.sleep(0, result=[])
+    )
+    points = downsample(buckets, resolution, PROJECT_FLOW_FIELDS, ("investors",))
+    # Running total of net funding, including everything before the window
+    cumulative = opening[0]['net'] if opening else 0
+    for p in points:
+        cumulative += p['net']
+        p['cumulative_net'] = round(cumulative, 2)
+    return {"project_id": project_id, "resolution": resolution, "points": points}
+
+async def backfill_portfolio_summaries(batch_size: int = 1000):
+    """Add lots written before portfolio summaries existed to their owners' summaries."""
+    async with Lease(db.leases, "portfolio-summary-backfill", ttl_seconds=600) as acquired:
+        if not acquired:
+            return
+        total = 0
+        while True:
+            batch = await db.portfolios.find({"in_summary": {"$ne": True}}, {"_id": 0, "portfolio_id": 1, "user_id": 1}).limit(batch_size).to_list(batch_size)
+            if not batch:
+                break
+            for p in batch:
+                await begin_summary_changes([p['user_id']])
+                # Flag and read in one step: a sale or trade after this point sees the flag and updates the summary itself
+                lot = await db.portfolios.find_one_and_update(
+                    {"portfolio_id": p['portfolio_id'], "in_summary": {"$ne": True}}, {"$set": {"in_summary": True}},
+                    projection={**LOT_FIELDS, "user_id": 1})
+                if lot:
+                    await apply_summary_delta(lot['user_id'], lot_delta(lot), {lot['project_id']: lot.get('project_name', '')})
+                else:
+                    await apply_summary_delta(p['user_id'], {})
+            total += len(batch)
+        if total:
+            logger.info(f"Portfoy ozetleri dolduruldu: {total} yatirim")
+
+async def backfill_project_daily(batch_size: int = 1000):
+    """Seed rollups from portfolios written before rollups existed (sold ones are gone and can't be recovered)."""
+    async with Lease(db.leases, "project-daily-backfill", ttl_seconds=600) as acquired:
+        if not acquired:
+            return
+        total = 0
+        while True:
+            batch = await db.portfolios.find({"in_rollup": {"$ne": True}}, {"_id": 0, "portfolio_id": 1, "project_id": 1, "user_id": 1, "amount": 1, "purchase_date": 1}).limit(batch_size).to_list(batch_size)
+            if not batch:
+                break
+            for p in batch:
+                await record_project_flow(p['project_id'], p['user_id'], inflow=p.get('amount', 0), at=as_utc(p.get('purchase_date')))
+                # Flag each row right after counting it, so a crash re-counts at most one row
+                await db.portfolios.update_one({"portfolio_id": p['portfolio_id']}, {"$set": {"in_rollup": True}})
+            total += len(batch)
+        if total:
+            logger.info(f"Proje gunluk fonlama verisi dolduruldu: {total} yatirim")
+
+# ===== DISTINCT INVESTORS =====
+# Each project keeps the ids of everyone who has invested in it (investor_ids)
+# until there are more than INVESTOR_EXACT_LIMIT, then a HyperLogLog sketch
+# (investor_sketch) instead. Adds to an exact list are applied in place, as
+# they commute; sketch updates are compare-and-swap on investors_version. Ids
+# whose merge keeps losing that race wait in investors_pending for the
+# investor-retry job. An investor already counted (or one that doesn't raise
+# any sketch register) costs a read and no write. Sales don't remove anyone:
+# the count is of everyone who has ever invested.
+INVESTOR_FIELDS = {"_id": 0, "project_id": 1, "type": 1, "investor_ids": 1, "investor_sketch": 1, "investors_version": 1}
+
+def investor_counter(project: dict) -> DistinctCounter:
+    if project.get('investor_sketch'):
+        return DistinctCounter(sketch=HyperLogLog.from_bytes(project['investor_sketch']), limit=INVESTOR_EXACT_LIMIT)
+    return DistinctCounter(project.get('investor_ids') or (), limit=INVESTOR_EXACT_LIMIT)
+
+async def merge_project_investors(project_id: str, counter: DistinctCounter, extra: dict = None, attempts: int = 20) -> bool:
+    """Merge ``counter`` into the project's investors; False if the project doesn't exist
+    or concurrent sketch updates won every attempt (nothing was written then)."""
+    for _ in range(attempts):
+        project = await db.projects.find_one({"project_id": project_id}, INVESTOR_FIELDS)
+        if not project:
+            return False
+        merged = investor_counter(project)
+        if not merged.merge(counter) and not extra:
+            return True
+        if merged.exact and counter.exact:
+            added = sorted(counter.members - set(project.get('investor_ids') or ()))
+            # Only while the list stays exact with these added; otherwise reread and go the sketch way
+            result = await db.projects.update_one(
+                {"project_id": project_id, "investor_sketch": {"$exists": False},
+                 f"investor_ids.{INVESTOR_EXACT_LIMIT - len(added)}": {"$exists": False}},
+                [{"$set": {"investor_ids": {"$setUnion": [{"$ifNull": ["$investor_ids", []]}, added]}, **(extra or {})}},
+                 {"$set": {"investors_count": {"$size": "$investor_ids"},
+                           "investors_version": {"$add": [{"$ifNull": ["$investors_version", 0]}, 1]}}}])
+            if result.matched_count:
+                return True
+            continue
+        if merged.exact:
+            state = {"$set": {"investor_ids": sorted(merged.members)}, "$unset": {"investor_sketch": ""}}
+        else:
+            state = {"$set": {"investor_sketch": merged.sketch.to_bytes()}, "$unset": {"investor_ids": ""}}
+        state["$set"].update(investors_count=merged.count(), **(extra or {}))
+        result = await db.projects.update_one({"project_id": project_id, "investors_version": project.get('investors_version')},
+                                              {**state, "$inc": {"investors_version": 1}})
+        if result.matched_count:
+            return True
+    logger.warning(f"Proje yatirimci sayisi guncellenemedi, cok fazla eszamanli yazma: {project_id}")
+    return False
+
+async def record_project_investors(project_id: str, user_ids):
+    user_ids = list(user_ids)
+    if not await merge_project_investors(project_id, DistinctCounter(user_ids, limit=INVESTOR_EXACT_LIMIT)):
+        # Left for retry_pending_investors; a no-op if the project doesn't exist
+        await db.projects.update_one({"project_id": project_id}, {"$addToSet": {"investors_pending": {"$each": user_ids}}})
+
+async def retry_pending_investors():
+    """Merge investors whose first merge lost to concurrent sketch updates."""
+    async for p in db.projects.find({"investors_pending.0": {"$exists": True}}, {"_id": 0, "project_id": 1, "investors_pending": 1}):
+        user_ids = p['investors_pending']
+        if await merge_project_investors(p['project_id'], DistinctCounter(user_ids, limit=INVESTOR_EXACT_LIMIT)):
+            await db.projects.update_one({"project_id": p['project_id']}, {"$pull": {"investors_pending": {"$in": user_ids}}})
+
+async def backfill_project_investors():
+    """Count the investors of existing projects from their lots and daily rollups.
+
+    Merging is idempotent, so investments recorded meanwhile are neither lost
+    nor counted twice.
+    """
+    async with Lease(db.leases, "project-investors-backfill", ttl_seconds=600) as acquired:
+        if not acquired:
+            return
+        projects = await db.projects.find({"investors_backfilled": {"$ne": True}}, {"_id": 0, "project_id": 1}).to_list(None)
+        for p in projects:
+            counter = DistinctCounter(limit=INVESTOR_EXACT_LIMIT)
+            async for row in db.portfolios.aggregate([{"$match": {"project_id": p['project_id']}}, {"$group": {"_id": "$user_id"}}]):
+                counter.add(row['_id'])
+            # Daily rollups still name investors whose lots have been sold since
+            async for bucket in db.project_daily.find({"project_id": p['project_id']}, {"_id": 0, "investors": 1}):
+                for user_id in bucket.get('investors', ()):
+                    counter.add(user_id)
+            # Left unflagged on failure, so the next start counts the project again
+            await merge_project_investors(p['project_id'], counter, extra={"investors_backfilled": True})
+        if projects:
+            logger.info(f"Proje yatirimci sayilari dolduruldu: {len(projects)} proje")
+
+@api_router.get("/admin/investor-stats")
+async def get_investor_stats(start: str = "", end: str = "", admin=Depends(get_admin_user)):
+    """Unique investors across the platform and per project type.
+
+    Without a range the per-project counters are merged (every investor ever);
+    with ``start``/``end`` (local days, ``YYYY-MM-DD``) the daily funding
+    buckets in the range are, which counts who invested in that period.
+    """
+    totals = DistinctCounter(limit=INVESTOR_EXACT_LIMIT)
+    by_type = defaultdict(lambda: DistinctCounter(limit=INVESTOR_EXACT_LIMIT))
+    if start or end:
+        types = {p['project_id']: p.get('type', '') async for p in analytics_db.projects.find({}, {"_id": 0, "project_id": 1, "type": 1})}
+        window = {"day": {**({"$gte": start} if start else {}), **({"$lte": end} if end else {})}}
+        async for bucket in analytics_db.project_daily.find(window, {"_id": 0, "project_id": 1, "investors": 1}):
+            investors = DistinctCounter(bucket.get('investors', ()), limit=INVESTOR_EXACT_LIMIT)
+            by_type[types.get(bucket['project_id'], '')].merge(investors)
+            totals.merge(investors)
+    else:
+        async for project in analytics_db.projects.find({}, INVESTOR_FIELDS):
+            investors = investor_counter(project)
+            by_type[project.get('type', '')].merge(investors)
+            totals.merge(investors)
+    def figures(counter):
+        return {"unique_investors": counter.count(), "exact": counter.exact}
+    return {"start": start, "end": end, **figures(totals), "by_type": {t: figures(c) for t, c in sorted(by_type.items())}}
+
+# ===== CASH FLOW ROLLUPS =====
+async def record_cash_flow(type: str, status: str, amount: float, count: int = 1):
+    await cashflow.record(db, ROLLUP_TZ, type, status, amount, count=count)
+
+@api_router.get("/admin/analytics/cash-flow")
+async def get_cash_flow(resolution: str = "day", start: str = "", end: str = "", admin=Depends(get_admin_user)):
+    if resolution not in RESOLUTIONS:
+        raise HTTPException(status_code=400, detail="Gecersiz cozunurluk")
+    # One bucket per local day, keyed by the day itself
+    window = {"_id": {**({"$gte": start} if start else {}), **({"$lte": end} if end else {})}} if start or end else {}
+    buckets = await analytics_db.cash_flow_daily.find(window).sort("_id", ASCENDING).to_list(None)
+    points = downsample(buckets, resolution, cashflow.FIELDS)
+    totals = {f: sum(p[f] for p in points) for f in cashflow.FIELDS}
+    return {"resolution": resolution, "start": start, "end": end,
+            "points": [cashflow.shape(p) for p in points], "totals": cashflow.shape({"period": "total", **totals})}
+
+async def backfill_cash_flow():
+    async with Lease(db.leases, "cash-flow-backfill", ttl_seconds=600) as acquired:
+        if acquired:
+            await cashflow.backfill(db, ROLLUP_TZ)
+
 # ===== BANK ROUTES =====
 @api_router.get("/banks")
+@cache_control("public, max-age=300")
 async def get_banks():
     return await db.banks.find({"is_active": True}, {"_id": 0}).to_list(100)
 
@@ -359,18 +1337,24 @@ async def get_banks():
 async def create_bank(data: BankCreate, user=Depends(get_admin_user)):
     bank = {"bank_id": str(uuid.uuid4()), "name": data.name, "iban": data.iban,
             "account_holder": data.account_holder, "logo_url": data.logo_url,
-            "is_active": True, "created_at": datetime.now(timezone.utc).isoformat()}
+            "is_active": True, "created_at": datetime.now(timezone.utc)}
     await db.banks.insert_one(bank)
+    audit_log.record(user, "bank.create", "bank", bank['bank_id'], {"name": bank['name'], "iban": bank['iban']})
     return {k: v for k, v in bank.items() if k != '_id'}
 
 @api_router.put("/admin/banks/{bank_id}")
 async def update_bank(bank_id: str, data: BankCreate, user=Depends(get_admin_user)):
-    await db.banks.update_one({"bank_id": bank_id}, {"$set": data.model_dump()})
+    changes = data.model_dump()
+    before = await db.banks.find_one_and_update({"bank_id": bank_id}, {"$set": changes}, projection={"_id": 0})
+    if before:
+        audit_log.record(user, "bank.update", "bank", bank_id, {"changes": changed_fields(before, {**before, **changes}, changes)})
     return await db.banks.find_one({"bank_id": bank_id}, {"_id": 0})
 
 @api_router.delete("/admin/banks/{bank_id}")
 async def delete_bank(bank_id: str, user=Depends(get_admin_user)):
-    await db.banks.update_one({"bank_id": bank_id}, {"$set": {"is_active": False}})
+    result = await db.banks.update_one({"bank_id": bank_id}, {"$set": {"is_active": False}})
+    if result.matched_count:
+        audit_log.record(user, "bank.delete", "bank", bank_id)
     return {"message": "Banka silindi"}
 
 # ===== TRANSACTION ROUTES =====
@@ -382,15 +1366,36 @@ async def create_transaction(data: TransactionRequest, user=Depends(get_current_
         "transaction_id": str(uuid.uuid4()), "user_id": user['user_id'],
         "user_name": user.get('name', ''), "type": data.type,
         "amount": data.amount, "bank_id": data.bank_id,
-        "status": "pending", "created_at": datetime.now(timezone.utc).isoformat()
+        "status": "pending", "created_at": datetime.now(timezone.utc), "in_cash_flow": True
     }
     await db.transactions.insert_one(txn)
+    await record_cash_flow(data.type, "requested", data.amount)
     return {k: v for k, v in txn.items() if k != '_id'}
 
 @api_router.get("/transactions")
 async def get_transactions(user=Depends(get_current_user)):
     return await db.transactions.find({"user_id": user['user_id']}, {"_id": 0}).sort("created_at", -1).to_list(100)
 
+# ===== DASHBOARD =====
+DASHBOARD_RECENT_TRANSACTIONS = 5
+
+@api_router.get("/dashboard")
+async def get_dashboard(user=Depends(get_current_user)):
+    # One authenticated request instead of /portfolio + /transactions + /notifications; the reads are independent
+    portfolio, transactions, unread_count, usd_rate = await asyncio.gather(
+        portfolio_view(user),
+        db.transactions.find({"user_id": user['user_id']}, {"_id": 0}).sort("created_at", -1).to_list(DASHBOARD_RECENT_TRANSACTIONS),
+        db.notifications.count_documents({"user_id": user['user_id'], "is_read": False}),
+        get_usd_rate(),
+    )
+    return {
+        "user": {k: user.get(k) for k in ("user_id", "name", "email", "role", "kyc_status", "balance")},
+        "portfolio": portfolio,
+        "recent_transactions": transactions,
+        "unread_count": unread_count,
+        "usd_rate": usd_rate
+    }
+
 # ===== KYC ROUTES =====
 @api_router.post("/kyc/upload")
 async def upload_kyc(front: UploadFile = File(...), back: UploadFile = File(...), user=Depends(get_current_user)):
@@ -405,7 +1410,7 @@ async def upload_kyc(front: UploadFile = File(...), back: UploadFile = File(...)
         "kyc_id": str(uuid.uuid4()), "user_id": uid,
         "user_name": user.get('name', ''), "user_email": user.get('email', ''),
         "front_image": f"/api/uploads/kyc/{front_fn}", "back_image": f"/api/uploads/kyc/{back_fn}",
-        "status": "pending", "submitted_at": datetime.now(timezone.utc).isoformat(), "reviewed_at": None
+        "status": "pending", "submitted_at": datetime.now(timezone.utc), "reviewed_at": None
     }
     await db.kyc_documents.delete_many({"user_id": uid})
     await db.kyc_documents.insert_one(kyc_doc)
@@ -421,36 +1426,81 @@ async def get_kyc_status(user=Depends(get_current_user)):
 async def get_all_kyc(user=Depends(get_admin_user)):
     return await db.kyc_documents.find({}, {"_id": 0}).sort("submitted_at", -1).to_list(100)
 
-@api_router.post("/admin/kyc/{kyc_id}/approve")
-async def approve_kyc(kyc_id: str, user=Depends(get_admin_user)):
-    kyc = await db.kyc_documents.find_one({"kyc_id": kyc_id}, {"_id": 0})
+def kyc_notification(user_id: str, status: str) -> dict:
+    if status == 'approved':
+        title, message = "Kimlik Doğrulaması Onaylandı", "Kimliğiniz başarıyla doğrulandı. Artık yatırım yapabilirsiniz!"
+    else:
+        title, message = "Kimlik Doğrulaması Reddedildi", "Kimlik doğrulamanız reddedildi. Lütfen geçerli bir kimlik belgesi yükleyin."
+    return {
+        "notification_id": str(uuid.uuid4()), "user_id": user_id, "title": title, "message": message,
+        "type": f"kyc_{status}", "is_read": False, "created_at": datetime.now(timezone.utc)
+    }
+
+async def review_kyc(kyc_id: str, status: str, admin: dict):
+    uow = UnitOfWork(f"kyc_{status}")
+    # Update and fetch in one round trip; the user fan-out needs its user_id
+    kyc = await uow.step("kyc_document", db.kyc_documents.find_one_and_update,
+                         {"kyc_id": kyc_id}, {"$set": {"status": status, "reviewed_at": datetime.now(timezone.utc)}},
+                         projection={"_id": 0, "user_id": 1})
     if not kyc:
         raise HTTPException(status_code=404, detail="KYC bulunamadi")
-    await db.kyc_documents.update_one({"kyc_id": kyc_id}, {"$set": {"status": "approved", "reviewed_at": datetime.now(timezone.utc).isoformat()}})
-    await db.users.update_one({"user_id": kyc['user_id']}, {"$set": {"kyc_status": "approved"}})
-    await db.notifications.insert_one({
-        "notification_id": str(uuid.uuid4()), "user_id": kyc['user_id'],
-        "title": "Kimlik Doğrulaması Onaylandı",
-        "message": "Kimliğiniz başarıyla doğrulandı. Artık yatırım yapabilirsiniz!",
-        "type": "kyc_approved", "is_read": False, "created_at": datetime.now(timezone.utc).isoformat()
-    })
+    uow.add("user", db.users.update_one, {"user_id": kyc['user_id']}, {"$set": {"kyc_status": status}})
+    uow.add("notification", db.notifications.insert_one, kyc_notification(kyc['user_id'], status))
+    await uow.run()
+    audit_log.record(admin, f"kyc.{status}", "kyc", kyc_id, {"user_id": kyc['user_id']})
+
+@api_router.post("/admin/kyc/{kyc_id}/approve")
+async def approve_kyc(kyc_id: str, user=Depends(get_admin_user)):
+    await review_kyc(kyc_id, "approved", user)
     return {"message": "KYC onaylandi"}
 
 @api_router.post("/admin/kyc/{kyc_id}/reject")
 async def reject_kyc(kyc_id: str, user=Depends(get_admin_user)):
-    kyc = await db.kyc_documents.find_one({"kyc_id": kyc_id}, {"_id": 0})
-    if not kyc:
-        raise HTTPException(status_code=404, detail="KYC bulunamadi")
-    await db.kyc_documents.update_one({"kyc_id": kyc_id}, {"$set": {"status": "rejected", "reviewed_at": datetime.now(timezone.utc).isoformat()}})
-    await db.users.update_one({"user_id": kyc['user_id']}, {"$set": {"kyc_status": "rejected"}})
-    await db.notifications.insert_one({
-        "notification_id": str(uuid.uuid4()), "user_id": kyc['user_id'],
-        "title": "Kimlik Doğrulaması Reddedildi",
-        "message": "Kimlik doğrulamanız reddedildi. Lütfen geçerli bir kimlik belgesi yükleyin.",
-        "type": "kyc_rejected", "is_read": False, "created_at": datetime.now(timezone.utc).isoformat()
-    })
+    await review_kyc(kyc_id, "rejected", user)
     return {"message": "KYC reddedildi"}
 
+BULK_MAX_ITEMS = 500
+
+def validate_bulk_request(ids: list, status: str) -> list:
+    if status not in ('approved', 'rejected'):
+        raise HTTPException(status_code=400, detail="Gecersiz durum")
+    ids = list(dict.fromkeys(ids))
+    if not ids or len(ids) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=400, detail=f"Tek seferde 1-{BULK_MAX_ITEMS} kayit islenebilir")
+    return ids
+
+def bulk_response(batch_id: str, id_field: str, results: dict) -> dict:
+    return {"batch_id": batch_id, "results": [{id_field: i, "result": r} for i, r in results.items()],
+            "summary": dict(Counter(results.values()))}
+
+@api_router.post("/admin/kyc/bulk")
+async def bulk_review_kyc(data: BulkKYCReview, admin=Depends(get_admin_user)):
+    ids = validate_bulk_request(data.kyc_ids, data.status)
+    batch_id = str(uuid.uuid4())
+    now = datetime.now(timezone.utc)
+    # Conditional claim: only pending documents move; batch_id tells us which ones we won
+    await db.kyc_documents.bulk_write([
+        UpdateOne({"kyc_id": i, "status": "pending"},
+                  {"$set": {"status": data.status, "reviewed_at": now, "reviewed_by": admin['user_id'], "batch_id": batch_id}})
+        for i in ids
+    ], ordered=False)
+    docs = await db.kyc_documents.find({"kyc_id": {"$in": ids}}, {"_id": 0, "kyc_id": 1, "user_id": 1, "batch_id": 1}).to_list(None)
+    results = {i: "not_found" for i in ids}
+    claimed_users = []
+    for d in docs:
+        if d.get('batch_id') == batch_id:
+            results[d['kyc_id']] = data.status
+            claimed_users.append(d['user_id'])
+            audit_log.record(admin, f"kyc.{data.status}", "kyc", d['kyc_id'], {"user_id": d['user_id'], "batch_id": batch_id})
+        else:
+            results[d['kyc_id']] = "already_processed"
+    if claimed_users:
+        await asyncio.gather(
+            db.users.update_many({"user_id": {"$in": claimed_users}}, {"$set": {"kyc_status": data.status}}),
+            db.notifications.insert_many([kyc_notification(uid, data.status) for uid in claimed_users])
+        )
+    return bulk_response(batch_id, "kyc_id", results)
+
 # ===== NOTIFICATION ROUTES =====
 @api_router.get("/notifications")
 async def get_notifications(user=Depends(get_current_user)):
@@ -460,135 +1510,265 @@ async def get_notifications(user=Depends(get_current_user)):
 
 @api_router.post("/notifications/{notification_id}/read")
 async def mark_read(notification_id: str, user=Depends(get_current_user)):
-    await db.notifications.update_one({"notification_id": notification_id, "user_id": user['user_id']}, {"$set": {"is_read": True}})
+    # read_at starts the retention clock (TTL index)
+    await db.notifications.update_one({"notification_id": notification_id, "user_id": user['user_id'], "is_read": False},
+                                      {"$set": {"is_read": True, "read_at": datetime.now(timezone.utc)}})
     return {"message": "Bildirim okundu"}
 
 @api_router.post("/notifications/read-all")
 async def mark_all_read(user=Depends(get_current_user)):
-    await db.notifications.update_many({"user_id": user['user_id']}, {"$set": {"is_read": True}})
+    await db.notifications.update_many({"user_id": user['user_id'], "is_read": False},
+                                       {"$set": {"is_read": True, "read_at": datetime.now(timezone.utc)}})
     return {"message": "Tum bildirimler okundu"}
 
 # ===== ADMIN ROUTES =====
 @api_router.get("/admin/stats")
 async def get_admin_stats(user=Depends(get_admin_user)):
-    total_users = await db.users.count_documents({"role": "investor"})
-    pending_kyc = await db.kyc_documents.count_documents({"status": "pending"})
-    total_projects = await db.projects.count_documents({})
-    users_list = await db.users.find({"role": "investor"}, {"_id": 0, "balance": 1}).to_list(10000)
-    total_balance = sum(u.get('balance', 0) for u in users_list)
-    portfolios = await db.portfolios.find({}, {"_id": 0, "amount": 1}).to_list(10000)
-    total_invested = sum(p.get('amount', 0) for p in portfolios)
-    pending_txns = await db.transactions.count_documents({"status": "pending"})
+    total_users, pending_kyc, total_projects, pending_txns, totals = await asyncio.gather(
+        analytics_db.users.count_documents({"role": "investor"}),
+        analytics_db.kyc_documents.count_documents({"status": "pending"}),
+        analytics_db.projects.count_documents({}),
+        analytics_db.transactions.count_documents({"status": "pending"}),
+        shared_cache.get("admin_totals")
+    )
+    # Sums are refreshed by the admin-stats job; compute them here only before its first run
+    totals = totals or await compute_admin_totals()
     return {"total_users": total_users, "pending_kyc": pending_kyc, "total_projects": total_projects,
-            "total_balance": total_balance, "total_invested": total_invested, "pending_transactions": pending_txns}
+            "total_balance": totals['total_balance'], "total_invested": totals['total_invested'],
+            "pending_transactions": pending_txns, "totals_computed_at": totals['computed_at']}
 
 @api_router.get("/admin/users")
 async def get_admin_users(user=Depends(get_admin_user)):
-    return await db.users.find({}, {"_id": 0, "password_hash": 0}).sort("created_at", -1).to_list(1000)
+    return await analytics_db.users.find({}, {"_id": 0, "password_hash": 0}).sort("created_at", -1).to_list(1000)
+
+USER_SEARCH_SORTS = {"created_at": "created_at", "name": "search_name", "balance": "balance"}
+# Sort value types a page cursor may carry; created_at can still be an ISO string mid-migration
+USER_SEARCH_CURSOR_TYPES = {"created_at": (datetime, str), "search_name": (str,), "balance": (int, float)}
+USER_SEARCH_PROJECTION = {"_id": 0, "user_id": 1, "name": 1, "email": 1, "phone": 1, "role": 1,
+                          "kyc_status": 1, "balance": 1, "created_at": 1, "search_name": 1}
+USER_SEARCH_MAX_LIMIT = 100
+
+@api_router.get("/admin/users/search")
+async def search_admin_users(q: str = "", role: str = "", kyc_status: str = "", sort: str = "created_at",
+                             order: str = "desc", limit: int = 50, cursor: str = "", user=Depends(get_admin_user)):
+    field = USER_SEARCH_SORTS.get(sort)
+    if not field or order not in ('asc', 'desc'):
+        raise HTTPException(status_code=400, detail="Gecersiz siralama")
+    direction = 1 if order == 'asc' else -1
+    limit = max(1, min(limit, USER_SEARCH_MAX_LIMIT))
+    conditions = []
+    prefix = term_prefix(q)
+    if prefix:
+        conditions.append({"search_terms": {"$regex": prefix}})
+    if role:
+        conditions.append({"role": role})
+    if kyc_status:
+        conditions.append({"kyc_status": kyc_status})
+    if cursor:
+        try:
+            value, last_user_id = decode_cursor(cursor, USER_SEARCH_CURSOR_TYPES[field])
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Gecersiz sayfa imleci")
+        conditions.append(after_cursor(field, direction, value, last_user_id))
+    query = {"$and": conditions} if conditions else {}
+    # One extra row tells us whether there is a next page without counting
+    users = await analytics_db.users.find(query, USER_SEARCH_PROJECTION).sort([(field, direction), ("user_id", direction)]).limit(limit + 1).to_list(limit + 1)
+    next_cursor = None
+    if len(users) > limit:
+        users = users[:limit]
+        next_cursor = encode_cursor(users[-1].get(field), users[-1]['user_id'])
+    for u in users:
+        u.pop('search_name', None)
+    return {"users": users, "next_cursor": next_cursor}
 
 @api_router.put("/admin/users/{user_id}/balance")
 async def update_user_balance(user_id: str, data: BalanceUpdate, admin=Depends(get_admin_user)):
-    target = await db.users.find_one({"user_id": user_id}, {"_id": 0})
+    uow = UnitOfWork(f"admin_balance_{data.type}")
+    target = await uow.step("user", db.users.find_one, {"user_id": user_id}, {"_id": 0, "password_hash": 0, "ledger_seq": 0, "ledger_at": 0})
     if not target:
         raise HTTPException(status_code=404, detail="Kullanici bulunamadi")
+    transaction_id = str(uuid.uuid4())
+    now = datetime.now(timezone.utc)
     if data.type == 'add':
-        await db.users.update_one({"user_id": user_id}, {"$inc": {"balance": data.amount}})
-        await db.transactions.insert_one({
-            "transaction_id": str(uuid.uuid4()), "user_id": user_id,
-            "user_name": target.get('name', ''), "type": "deposit",
-            "amount": data.amount, "bank_id": "", "status": "approved",
-            "created_at": datetime.now(timezone.utc).isoformat(), "approved_by": admin['user_id']
-        })
-        await db.notifications.insert_one({
-            "notification_id": str(uuid.uuid4()), "user_id": user_id,
-            "title": "Para Yatırma Onaylandı", "message": f"Hesabınıza {data.amount:,.0f} TL yatırıldı.",
-            "type": "deposit_approved", "is_read": False, "created_at": datetime.now(timezone.utc).isoformat()
-        })
+        # The credit comes first so a failed one leaves no approved transaction or notification behind
+        new_balance = await uow.step("balance", apply_balance_change, user_id, data.amount, "admin_deposit", transaction_id)
+        if new_balance is None:
+            raise HTTPException(status_code=404, detail="Kullanici bulunamadi")
+        txn_type, title, message, notif_type = "deposit", "Para Yatırma Onaylandı", f"Hesabınıza {data.amount:,.0f} TL yatırıldı.", "deposit_approved"
     elif data.type == 'subtract':
-        if target.get('balance', 0) < data.amount:
+        # The conditional debit decides whether anything else is written
+        new_balance = await uow.step("balance", apply_balance_change, user_id, -data.amount, "admin_withdrawal", transaction_id, require_funds=True)
+        if new_balance is None:
             raise HTTPException(status_code=400, detail="Yetersiz bakiye")
-        await db.users.update_one({"user_id": user_id}, {"$inc": {"balance": -data.amount}})
-        await db.transactions.insert_one({
-            "transaction_id": str(uuid.uuid4()), "user_id": user_id,
-            "user_name": target.get('name', ''), "type": "withdrawal",
-            "amount": data.amount, "bank_id": "", "status": "approved",
-            "created_at": datetime.now(timezone.utc).isoformat(), "approved_by": admin['user_id']
-        })
-        await db.notifications.insert_one({
-            "notification_id": str(uuid.uuid4()), "user_id": user_id,
-            "title": "Para Çekme Gerçekleşti", "message": f"Hesabınızdan {data.amount:,.0f} TL çekildi.",
-            "type": "withdrawal", "is_read": False, "created_at": datetime.now(timezone.utc).isoformat()
-        })
-    updated = await db.users.find_one({"user_id": user_id}, {"_id": 0, "password_hash": 0})
-    return updated
+        txn_type, title, message, notif_type = "withdrawal", "Para Çekme Gerçekleşti", f"Hesabınızdan {data.amount:,.0f} TL çekildi.", "withdrawal"
+    else:
+        return target
+    uow.add("transaction", db.transactions.insert_one, {
+        "transaction_id": transaction_id, "user_id": user_id,
+        "user_name": target.get('name', ''), "type": txn_type,
+        "amount": data.amount, "bank_id": "", "status": "approved",
+        "created_at": now, "approved_by": admin['user_id'], "in_cash_flow": True
+    })
+    uow.add("notification", db.notifications.insert_one, {
+        "notification_id": str(uuid.uuid4()), "user_id": user_id,
+        "title": title, "message": message,
+        "type": notif_type, "is_read": False, "created_at": now
+    })
+    await uow.run()
+    # The balance step returns the new balance, so no re-read is needed
+    target['balance'] = new_balance
+    await record_cash_flow(txn_type, "approved", data.amount)
+    audit_log.record(admin, f"user.balance_{data.type}", "user", user_id,
+                     {"amount": data.amount, "balance_after": target['balance'], "transaction_id": transaction_id})
+    return target
 
 @api_router.put("/admin/users/{user_id}/role")
 async def update_user_role(user_id: str, data: RoleUpdate, admin=Depends(get_admin_user)):
-    await db.users.update_one({"user_id": user_id}, {"$set": {"role": data.role}})
+    before = await db.users.find_one_and_update({"user_id": user_id}, {"$set": {"role": data.role}}, projection={"_id": 0, "role": 1})
+    if not before:
+        raise HTTPException(status_code=404, detail="Kullanici bulunamadi")
+    audit_log.record(admin, "user.role", "user", user_id, {"from": before.get('role'), "to": data.role})
     return {"message": "Rol guncellendi"}
 
 @api_router.get("/admin/transactions")
 async def get_admin_transactions(user=Depends(get_admin_user)):
-    return await db.transactions.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
+    return await analytics_db.transactions.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
+
+TRANSACTION_NOTIFICATIONS = {
+    ("approved", "deposit"): ("Para Yatirma Onaylandi", "{amount} TL tutarindaki yatirma talebiniz onaylandi."),
+    ("approved", "withdrawal"): ("Para Cekme Onaylandi", "{amount} TL tutarindaki cekme talebiniz onaylandi ve hesabinizdan dusuldu."),
+    ("rejected", "withdrawal"): ("Para Cekme Reddedildi", "{amount} TL tutarindaki cekme talebiniz reddedildi."),
+    ("rejected", "deposit"): ("Para Yatirma Reddedildi", "{amount} TL tutarindaki yatirma talebiniz reddedildi."),
+}
+
+def transaction_notification(txn: dict, status: str):
+    template = TRANSACTION_NOTIFICATIONS.get((status, txn['type']))
+    if not template:
+        return None
+    return {
+        "notification_id": str(uuid.uuid4()), "user_id": txn['user_id'],
+        "title": template[0], "message": template[1].format(amount=f"{txn['amount']:,.0f}"),
+        "type": f"{txn['type']}_{status}", "is_read": False, "created_at": datetime.now(timezone.utc)
+    }
 
 @api_router.put("/admin/transactions/{transaction_id}")
 async def update_transaction_status(transaction_id: str, data: TransactionStatusUpdate, admin=Depends(get_admin_user)):
-    txn = await db.transactions.find_one({"transaction_id": transaction_id}, {"_id": 0})
+    uow = UnitOfWork("transaction_status")
+    # Conditional claim: checks pending and moves the status in one round trip
+    txn = await uow.step("claim", db.transactions.find_one_and_update,
+                         {"transaction_id": transaction_id, "status": "pending"},
+                         {"$set": {"status": data.status, "reviewed_at": datetime.now(timezone.utc), "approved_by": admin['user_id']}},
+                         projection={"_id": 0})
     if not txn:
+        if await db.transactions.count_documents({"transaction_id": transaction_id}, limit=1):
+            raise HTTPException(status_code=400, detail="Bu islem zaten islendi")
         raise HTTPException(status_code=404, detail="Islem bulunamadi")
-    if txn.get('status') != 'pending':
-        raise HTTPException(status_code=400, detail="Bu islem zaten islendi")
-    await db.transactions.update_one({"transaction_id": transaction_id}, {"$set": {"status": data.status}})
-    if data.status == 'approved' and txn['type'] == 'deposit':
-        await db.users.update_one({"user_id": txn['user_id']}, {"$inc": {"balance": txn['amount']}})
-        await db.notifications.insert_one({
-            "notification_id": str(uuid.uuid4()), "user_id": txn['user_id'],
-            "title": "Para Yatirma Onaylandi", "message": f"{txn['amount']:,.0f} TL tutarindaki yatirma talebiniz onaylandi.",
-            "type": "deposit_approved", "is_read": False, "created_at": datetime.now(timezone.utc).isoformat()
-        })
-    elif data.status == 'approved' and txn['type'] == 'withdrawal':
-        target_user = await db.users.find_one({"user_id": txn['user_id']}, {"_id": 0})
-        if not target_user or target_user.get('balance', 0) < txn['amount']:
+    if data.status == 'approved' and txn['type'] == 'withdrawal':
+        # The debit can fail, and the notification must not go out if it does
+        if await uow.step("balance", apply_balance_change, txn['user_id'], -txn['amount'], "withdrawal", transaction_id, require_funds=True) is None:
             await db.transactions.update_one({"transaction_id": transaction_id}, {"$set": {"status": "rejected"}})
+            if txn.get('in_cash_flow'):
+                await record_cash_flow(txn['type'], "rejected", txn['amount'])
+            audit_log.record(admin, "transaction.rejected", "transaction", transaction_id,
+                             {"user_id": txn['user_id'], "type": txn['type'], "amount": txn['amount'], "reason": "insufficient_balance"})
             raise HTTPException(status_code=400, detail="Kullanicinin bakiyesi yetersiz")
-        await db.users.update_one({"user_id": txn['user_id']}, {"$inc": {"balance": -txn['amount']}})
-        await db.notifications.insert_one({
-            "notification_id": str(uuid.uuid4()), "user_id": txn['user_id'],
-            "title": "Para Cekme Onaylandi", "message": f"{txn['amount']:,.0f} TL tutarindaki cekme talebiniz onaylandi ve hesabinizdan dusuldu.",
-            "type": "withdrawal_approved", "is_read": False, "created_at": datetime.now(timezone.utc).isoformat()
-        })
-    elif data.status == 'rejected' and txn['type'] == 'withdrawal':
-        await db.notifications.insert_one({
-            "notification_id": str(uuid.uuid4()), "user_id": txn['user_id'],
-            "title": "Para Cekme Reddedildi", "message": f"{txn['amount']:,.0f} TL tutarindaki cekme talebiniz reddedildi.",
-            "type": "withdrawal_rejected", "is_read": False, "created_at": datetime.now(timezone.utc).isoformat()
-        })
-    elif data.status == 'rejected' and txn['type'] == 'deposit':
-        await db.notifications.insert_one({
-            "notification_id": str(uuid.uuid4()), "user_id": txn['user_id'],
-            "title": "Para Yatirma Reddedildi", "message": f"{txn['amount']:,.0f} TL tutarindaki yatirma talebiniz reddedildi.",
-            "type": "deposit_rejected", "is_read": False, "created_at": datetime.now(timezone.utc).isoformat()
-        })
+    elif data.status == 'approved' and txn['type'] == 'deposit':
+        uow.add("balance", apply_balance_change, txn['user_id'], txn['amount'], "deposit", transaction_id)
+    notification = transaction_notification(txn, data.status)
+    if notification:
+        uow.add("notification", db.notifications.insert_one, notification)
+    await uow.run()
+    # Transactions the cash-flow backfill hasn't reached are counted, with their status, when it does
+    if txn.get('in_cash_flow'):
+        await record_cash_flow(txn['type'], data.status, txn['amount'])
+    audit_log.record(admin, f"transaction.{data.status}", "transaction", transaction_id,
+                     {"user_id": txn['user_id'], "type": txn['type'], "amount": txn['amount']})
     return {"message": "Islem guncellendi"}
 
+@api_router.post("/admin/transactions/bulk")
+async def bulk_update_transaction_status(data: BulkTransactionStatusUpdate, admin=Depends(get_admin_user)):
+    ids = validate_bulk_request(data.transaction_ids, data.status)
+    batch_id = str(uuid.uuid4())
+    now = datetime.now(timezone.utc)
+    # Conditional claim: only pending -> approved/rejected; batch_id tells us which ones we won
+    await db.transactions.bulk_write([
+        UpdateOne({"transaction_id": i, "status": "pending"},
+                  {"$set": {"status": data.status, "reviewed_at": now, "approved_by": admin['user_id'], "batch_id": batch_id}})
+        for i in ids
+    ], ordered=False)
+    docs = await db.transactions.find({"transaction_id": {"$in": ids}}, {"_id": 0}).to_list(None)
+    results = {i: "not_found" for i in ids}
+    claimed = []
+    for d in docs:
+        if d.get('batch_id') == batch_id:
+            results[d['transaction_id']] = data.status
+            claimed.append(d)
+        else:
+            results[d['transaction_id']] = "already_processed"
+
+    if data.status == 'approved':
+        deposits, withdrawals = {}, {}
+        for t in claimed:
+            (deposits if t['type'] == 'deposit' else withdrawals).setdefault(t['user_id'], []).append(t)
+
+        async def debit(user_txns):
+            # One user's withdrawals run in order so the funds check is deterministic
+            return [t for t in user_txns
+                    if await apply_balance_change(t['user_id'], -t['amount'], "withdrawal", t['transaction_id'], require_funds=True) is None]
+
+        # Credits land first so a withdrawal in the same batch can use them
+        await asyncio.gather(*(apply_balance_changes(uid, [(t['amount'], "deposit", t['transaction_id']) for t in txns])
+                               for uid, txns in deposits.items()))
+        failed = [t for rejected in await asyncio.gather(*(debit(txns) for txns in withdrawals.values())) for t in rejected]
+        if failed:
+            await db.transactions.bulk_write([
+                UpdateOne({"transaction_id": t['transaction_id'], "batch_id": batch_id}, {"$set": {"status": "rejected"}})
+                for t in failed
+            ], ordered=False)
+            for t in failed:
+                results[t['transaction_id']] = "insufficient_balance"
+
+    for t in claimed:
+        result = results[t['transaction_id']]
+        audit_log.record(admin, f"transaction.{data.status if result == data.status else 'rejected'}", "transaction", t['transaction_id'],
+                         {"user_id": t['user_id'], "type": t['type'], "amount": t['amount'], "batch_id": batch_id,
+                          **({"reason": result} if result != data.status else {})})
+    flows = defaultdict(lambda: [0.0, 0])
+    for t in claimed:
+        if t.get('in_cash_flow'):
+            flow = flows[(t['type'], data.status if results[t['transaction_id']] == data.status else "rejected")]
+            flow[0] += t['amount']
+            flow[1] += 1
+    await asyncio.gather(*(record_cash_flow(type, status, amount, count=count) for (type, status), (amount, count) in flows.items()))
+    notifications = [n for n in (transaction_notification(t, data.status) for t in claimed if results[t['transaction_id']] == data.status) if n]
+    if notifications:
+        await db.notifications.insert_many(notifications)
+    return bulk_response(batch_id, "transaction_id", results)
+
 @api_router.get("/admin/portfolios")
 async def get_admin_portfolios(user_id: str = None, user=Depends(get_admin_user)):
     query = {"user_id": user_id} if user_id else {}
-    portfolios = await db.portfolios.find(query, {"_id": 0}).to_list(1000)
-    for p in portfolios:
-        u = await db.users.find_one({"user_id": p['user_id']}, {"_id": 0, "name": 1, "email": 1})
-        if u:
-            p['user_name'] = u.get('name', '')
-            p['user_email'] = u.get('email', '')
+    portfolios = await analytics_db.portfolios.find(query, {"_id": 0, "settled_trades": 0}).to_list(1000)
+    # Newer rows carry the user's name and e-mail; look up the rest in one query
+    missing = list({p['user_id'] for p in portfolios if 'user_name' not in p})
+    if missing:
+        users = {u['user_id']: u async for u in analytics_db.users.find({"user_id": {"$in": missing}}, {"_id": 0, "user_id": 1, "name": 1, "email": 1})}
+        for p in portfolios:
+            u = users.get(p['user_id'])
+            if u and 'user_name' not in p:
+                p['user_name'] = u.get('name', '')
+                p['user_email'] = u.get('email', '')
     return portfolios
 
 # ===== PASSWORD CHANGE =====
 @api_router.post("/auth/change-password")
-async def change_password(data: PasswordChange, user=Depends(get_current_user)):
+async def change_password(data: PasswordChange, request: Request, user=Depends(get_current_user)):
+    limit_keys = await check_auth_rate_limit(request, "change-password", user['user_id'])
     if not user.get('password_hash'):
         raise HTTPException(status_code=400, detail="Bu hesap Google ile olusturulmus. Sifre degistirilemez.")
     if not verify_password(data.current_password, user['password_hash']):
         raise HTTPException(status_code=400, detail="Mevcut sifre hatali")
+    await refund_auth_rate_limit(limit_keys)
     if len(data.new_password) < 6:
         raise HTTPException(status_code=400, detail="Yeni sifre en az 6 karakter olmali")
     await db.users.update_one({"user_id": user['user_id']}, {"$set": {"password_hash": hash_password(data.new_password)}})
@@ -612,21 +1792,131 @@ async def update_user_info(user_id: str, data: UserInfoUpdate, admin=Depends(get
         update_data['phone'] = data.phone
     if not update_data:
         raise HTTPException(status_code=400, detail="Guncellenecek bilgi bulunamadi")
+    merged = {**target, **update_data}
+    update_data.update(search_fields(merged.get('name', ''), merged.get('email', ''), merged.get('phone', '')))
     await db.users.update_one({"user_id": user_id}, {"$set": update_data})
+    audit_log.record(admin, "user.info", "user", user_id, {"changes": changed_fields(target, merged, ("name", "email", "phone"))})
+    if (target.get('name'), target.get('email')) != (merged.get('name'), merged.get('email')):
+        await enqueue_propagation("user", user_id, {"name": merged.get('name', ''), "email": merged.get('email', '')})
     updated = await db.users.find_one({"user_id": user_id}, {"_id": 0, "password_hash": 0})
     return updated
 
+# ===== DENORMALIZED FIELD PROPAGATION =====
+async def enqueue_propagation(source: str, key: str, values: dict):
+    await propagation.enqueue(db.propagation_jobs, source, key, values)
+    await scheduler.trigger("propagation")
+
+@api_router.get("/admin/propagation-jobs")
+async def get_propagation_jobs(status: str = None, admin=Depends(get_admin_user)):
+    query = {"status": status} if status else {}
+    # progress holds ObjectId checkpoints; updated has the per-collection counts
+    return await db.propagation_jobs.find(query, {"_id": 0, "progress": 0}).sort("enqueued_at", DESCENDING).to_list(100)
+
+# ===== AUDIT LOG =====
+audit_log = AuditLog(db.audit_log, db.audit_chains, WORKER_ID, key=AUDIT_CHAIN_KEY.encode(),
+                     max_delay=AUDIT_FLUSH_MS / 1000, max_batch=AUDIT_MAX_BATCH)
+
+def changed_fields(before: dict, after: dict, fields) -> dict:
+    """``{field: [old, new]}`` for the fields whose value changed."""
+    return {f: [before.get(f), after.get(f)] for f in fields if before.get(f) != after.get(f)}
+
+@api_router.get("/admin/audit-log")
+async def get_audit_log(action: str = "", target_id: str = "", actor_id: str = "", limit: int = 100, admin=Depends(get_admin_user)):
+    query = {}
+    if action:
+        query["action"] = action
+    if target_id:
+        query["target_id"] = target_id
+    if actor_id:
+        query["actor_id"] = actor_id
+    return await analytics_db.audit_log.find(query, {"_id": 0}).sort("at", DESCENDING).limit(max(1, min(limit, 1000))).to_list(None)
+
+@api_router.get("/admin/audit-log/verify")
+async def verify_audit_log(chain: str = "", admin=Depends(get_admin_user)):
+    # Reads the primary: a lagging secondary would look like a truncated chain
+    key = AUDIT_CHAIN_KEY.encode()
+    if chain:
+        head = await db.audit_chains.find_one({"_id": chain})
+        if not head:
+            raise HTTPException(status_code=404, detail="Denetim zinciri bulunamadi")
+        chains = [await verify_chain(db.audit_log, chain, key, head)]
+    else:
+        chains = await verify_all(db.audit_log, db.audit_chains, key)
+    return {"ok": all(c['ok'] for c in chains), "entries": sum(c['entries'] for c in chains), "chains": chains}
+
+# ===== INDEXES =====
+async def ensure_indexes():
+    await idempotency_store.ensure_indexes()
+    await audit_log.ensure_indexes()
+    await fx_history.ensure_collection()
+    if isinstance(auth_limiter.store, MongoBucketStore):
+        await auth_limiter.store.ensure_indexes()
+    await db.users.create_index("user_id", unique=True)
+    await db.portfolios.create_index([("user_id", ASCENDING), ("project_id", ASCENDING)])
+    await db.transactions.create_index([("user_id", ASCENDING), ("created_at", DESCENDING)])
+    await db.transactions.create_index("transaction_id", unique=True)
+    await db.transactions.create_index([("status", ASCENDING), ("created_at", ASCENDING)])
+    await db.notifications.create_index([("user_id", ASCENDING), ("is_read", ASCENDING)])
+    await db.project_daily.create_index([("project_id", ASCENDING), ("day", ASCENDING)])
+    # Rename propagation looks up copies by user_id / project_id
+    await db.kyc_documents.create_index("user_id")
+    await db.portfolios.create_index("project_id")
+    # Orphaned upload cleanup looks files up by path
+    await db.kyc_documents.create_index("front_image")
+    await db.kyc_documents.create_index("back_image")
+    await db.propagation_jobs.create_index([("status", ASCENDING), ("enqueued_at", ASCENDING)])
+    # Secondary market: intake by status, depth by project (also the rename propagation lookup), trades by order pair
+    await db.orders.create_index("order_id", unique=True)
+    await db.orders.create_index([("status", ASCENDING), ("created_at", ASCENDING)])
+    await db.orders.create_index([("project_id", ASCENDING), ("status", ASCENDING), ("side", ASCENDING), ("price", ASCENDING)])
+    await db.orders.create_index([("user_id", ASCENDING), ("created_at", DESCENDING)])
+    await db.orders.create_index("cancel_requested", sparse=True)
+    await db.trades.create_index("trade_id", unique=True)
+    await db.trades.create_index([("project_id", ASCENDING), ("executed_at", DESCENDING)])
+    await db.trades.create_index("settled")
+    await db.portfolios.create_index("portfolio_id")
+    await db.kyc_documents.create_index("kyc_id", unique=True)
+    # Admin user search: prefix lookups on search_terms, keyset pages on (sort field, user_id)
+    await db.users.create_index("search_terms")
+    await db.users.create_index([("created_at", DESCENDING), ("user_id", DESCENDING)])
+    await db.users.create_index([("search_name", ASCENDING), ("user_id", ASCENDING)])
+    await db.users.create_index([("balance", DESCENDING), ("user_id", DESCENDING)])
+    await db.users.create_index([("kyc_status", ASCENDING), ("created_at", DESCENDING), ("user_id", DESCENDING)])
+    await db.users.create_index([("role", ASCENDING), ("created_at", DESCENDING), ("user_id", DESCENDING)])
+    await db.ledger.create_index([("user_id", ASCENDING), ("seq", ASCENDING)], unique=True)
+    await db.ledger.create_index([("user_id", ASCENDING), ("created_at", ASCENDING)])
+    await db.balance_snapshots.create_index([("user_id", ASCENDING), ("seq", ASCENDING)], unique=True)
+    if NOTIFICATION_RETENTION_DAYS:
+        await ensure_ttl_index(db.notifications, "read_at", NOTIFICATION_RETENTION_DAYS * 86400)
+
+async def ensure_ttl_index(collection, field: str, expire_after_seconds: int):
+    try:
+        await collection.create_index(field, expireAfterSeconds=expire_after_seconds)
+    except OperationFailure as e:
+        if e.code != 85:  # IndexOptionsConflict: the retention period was changed
+            raise
+        await collection.database.command({"collMod": collection.name, "index": {"keyPattern": {field: 1}, "expireAfterSeconds": expire_after_seconds}})
+
 # ===== SEED DATA =====
-@app.on_event("startup")
+async def seed_on_startup():
+    # With several workers only the one holding the lease seeds; the rest skip
+    async with Lease(db.leases, "seed", ttl_seconds=120) as acquired:
+        if acquired:
+            await seed_data()
+        else:
+            logger.info(f"Seed baska bir worker tarafindan yapiliyor, atlaniyor ({WORKER_ID})")
+
 async def seed_data():
     admin = await db.users.find_one({"email": "admin@alarkoenerji.com"})
     if not admin:
-        await db.users.insert_one({
+        # Upsert keeps the admin unique even if a lease expired mid-seed
+        await db.users.update_one({"email": "admin@alarkoenerji.com"}, {"$setOnInsert": {
             "user_id": f"admin_{uuid.uuid4().hex[:12]}", "email": "admin@alarkoenerji.com",
-            "password_hash": hash_password("admin123"), "name": "Admin",
+            "password_hash": await asyncio.to_thread(hash_password, "admin123"), "name": "Admin",
             "phone": "+90 555 000 0000", "role": "admin", "kyc_status": "approved",
-            "balance": 0.0, "picture": "", "created_at": datetime.now(timezone.utc).isoformat()
-        })
+            **search_fields("Admin", "admin@alarkoenerji.com", "+90 555 000 0000"),
+            "balance": 0.0, "picture": "", "created_at": datetime.now(timezone.utc)
+        }}, upsert=True)
         logger.info("Admin kullanicisi olusturuldu")
 
     if await db.projects.count_documents({}) == 0:
@@ -634,51 +1924,258 @@ async def seed_data():
             {"project_id": str(uuid.uuid4()), "name": "İzmir Güneş Enerjisi Santrali", "type": "GES",
              "description": "İzmir'in Torbalı ilçesinde 175 dönüm arazi üzerinde kurulu güneş enerjisi santrali. Yılda 22.000 MWh enerji üretimi hedeflenmektedir.",
              "location": "İzmir, Torbalı", "capacity": "15 MW", "return_rate": 7.0,
-             "total_target": 5000000, "funded_amount": 3250000, "investors_count": 342,
+             "total_target": 5000000, "funded_amount": 3250000, "opening_funded_amount": 3250000, "investors_count": 342,
              "image_url": "https://images.unsplash.com/photo-1670519808965-16b9b2f724af?crop=entropy&cs=srgb&fm=jpg&ixlib=rb-4.1.0&q=85&w=800",
              "details": "Bu proje, İzmir'in güneş potansiyelinden maksimum faydalanmak amacıyla tasarlanmıştır. Tier-1 güneş panelleri kullanılarak yüksek verimlilik hedeflenmektedir. Proje, 20 yıllık YEKDEM garantisi altındadır.",
-             "status": "active", "created_at": datetime.now(timezone.utc).isoformat()},
+             "status": "active", "created_at": datetime.now(timezone.utc)},
             {"project_id": str(uuid.uuid4()), "name": "Antalya Güneş Enerjisi Santrali", "type": "GES",
              "description": "Antalya Manavgat'ta 250 dönüm alanda kurulu büyük ölçekli güneş santrali. Türkiye'nin en verimli güneş bölgelerinden birinde yer almaktadır.",
              "location": "Antalya, Manavgat", "capacity": "25 MW", "return_rate": 7.5,
-             "total_target": 8000000, "funded_amount": 5600000, "investors_count": 518,
+             "total_target": 8000000, "funded_amount": 5600000, "opening_funded_amount": 5600000, "investors_count": 518,
              "image_url": "https://images.unsplash.com/photo-1770068511771-7c146210a55b?crop=entropy&cs=srgb&fm=jpg&ixlib=rb-4.1.0&q=85&w=800",
              "details": "Antalya'nın yüksek güneşlenme süresinden faydalanan bu proje, yılda 37.500 MWh enerji üretecektir.",
-             "status": "active", "created_at": datetime.now(timezone.utc).isoformat()},
+             "status": "active", "created_at": datetime.now(timezone.utc)},
             {"project_id": str(uuid.uuid4()), "name": "İstanbul Rüzgar Enerjisi Santrali", "type": "RES",
              "description": "İstanbul Çatalca bölgesinde yüksek rüzgar potansiyeline sahip tepelerde kurulu rüzgar santrali. 20 adet türbin ile enerji üretimi yapılmaktadır.",
              "location": "İstanbul, Çatalca", "capacity": "50 MW", "return_rate": 7.0,
-             "total_target": 12000000, "funded_amount": 8400000, "investors_count": 876,
+             "total_target": 12000000, "funded_amount": 8400000, "opening_funded_amount": 8400000, "investors_count": 876,
              "image_url": "https://images.unsplash.com/photo-1631096667365-00844efc3a92?crop=entropy&cs=srgb&fm=jpg&ixlib=rb-4.1.0&q=85&w=800",
              "details": "Marmara bölgesinin güçlü rüzgar koridorlarında konumlanan bu santral, son teknoloji Vestas türbinleri ile donatılmıştır.",
-             "status": "active", "created_at": datetime.now(timezone.utc).isoformat()},
+             "status": "active", "created_at": datetime.now(timezone.utc)},
             {"project_id": str(uuid.uuid4()), "name": "Çanakkale Rüzgar Enerjisi Santrali", "type": "RES",
              "description": "Çanakkale Biga'da Ege Denizi rüzgarlarından faydalanan modern rüzgar santrali.",
              "location": "Çanakkale, Biga", "capacity": "35 MW", "return_rate": 6.5,
-             "total_target": 9000000, "funded_amount": 4500000, "investors_count": 423,
+             "total_target": 9000000, "funded_amount": 4500000, "opening_funded_amount": 4500000, "investors_count": 423,
              "image_url": "https://images.unsplash.com/photo-1636618732028-7e541a1cb994?crop=entropy&cs=srgb&fm=jpg&ixlib=rb-4.1.0&q=85&w=800",
              "details": "Çanakkale'nin güçlü Ege rüzgarlarından faydalanan bu proje, 14 adet 2.5 MW kapasiteli türbin içermektedir.",
-             "status": "active", "created_at": datetime.now(timezone.utc).isoformat()}
+             "status": "active", "created_at": datetime.now(timezone.utc)}
         ])
         logger.info("Ornek projeler olusturuldu")
 
     if await db.banks.count_documents({}) == 0:
         await db.banks.insert_many([
             {"bank_id": str(uuid.uuid4()), "name": "Ziraat Bankası", "iban": "TR33 0001 0000 0000 0000 0000 01",
-             "account_holder": "Alarko Enerji Yatırım A.Ş.", "logo_url": "", "is_active": True, "created_at": datetime.now(timezone.utc).isoformat()},
+             "account_holder": "Alarko Enerji Yatırım A.Ş.", "logo_url": "", "is_active": True, "created_at": datetime.now(timezone.utc)},
             {"bank_id": str(uuid.uuid4()), "name": "İş Bankası", "iban": "TR62 0006 4000 0011 2340 0001 01",
-             "account_holder": "Alarko Enerji Yatırım A.Ş.", "logo_url": "", "is_active": True, "created_at": datetime.now(timezone.utc).isoformat()},
+             "account_holder": "Alarko Enerji Yatırım A.Ş.", "logo_url": "", "is_active": True, "created_at": datetime.now(timezone.utc)},
             {"bank_id": str(uuid.uuid4()), "name": "Garanti BBVA", "iban": "TR76 0006 2000 0000 0006 2960 01",
-             "account_holder": "Alarko Enerji Yatırım A.Ş.", "logo_url": "", "is_active": True, "created_at": datetime.now(timezone.utc).isoformat()},
+             "account_holder": "Alarko Enerji Yatırım A.Ş.", "logo_url": "", "is_active": True, "created_at": datetime.now(timezone.utc)},
             {"bank_id": str(uuid.uuid4()), "name": "Yapı Kredi", "iban": "TR86 0006 7010 0000 0012 3456 78",
-             "account_holder": "Alarko Enerji Yatırım A.Ş.", "logo_url": "", "is_active": True, "created_at": datetime.now(timezone.utc).isoformat()}
+             "account_holder": "Alarko Enerji Yatırım A.Ş.", "logo_url": "", "is_active": True, "created_at": datetime.now(timezone.utc)}
         ])
         logger.info("Ornek bankalar olusturuldu")
 
+# ===== METRICS =====
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+# ===== BACKGROUND REFRESH =====
+background_tasks = []
+
+# ===== SCHEDULED JOBS =====
+scheduler = Scheduler(db.scheduled_jobs, WORKER_ID)
+
+async def propagate_renames():
+    # The scheduler lock makes this the only runner, so anything still "running" was left by a dead worker
+    worker = PropagationWorker(db, PROPAGATION_BATCH_SIZE, PROPAGATION_PAUSE_SECONDS,
+                               before_batch=functools.partial(scheduler.renew, "propagation"))
+    await worker.requeue_stalled()
+    await worker.run_pending()
+
+async def compute_admin_totals():
+    """Platform-wide sums for the admin stats; too heavy to aggregate on every request."""
+    balance, invested = await asyncio.gather(
+        analytics_db.users.aggregate([{"$match": {"role": "investor"}}, {"$group": {"_id": None, "total": {"$sum": "$balance"}}}]).to_list(1),
+        analytics_db.portfolios.aggregate([{"$group": {"_id": None, "total": {"$sum": "$amount"}}}]).to_list(1)
+    )
+    totals = {"total_balance": balance[0]['total'] if balance else 0, "total_invested": invested[0]['total'] if invested else 0,
+              "computed_at": datetime.now(timezone.utc).isoformat()}
+    await shared_cache.set("admin_totals", totals)
+    return totals
+
+def remove_files(directory: Path, names: list) -> int:
+    removed = 0
+    for name in names:
+        try:
+            (directory / name).unlink()
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+async def clean_orphaned_kyc_files(batch_size: int = 200):
+    """Delete uploaded KYC images no KYC record points to (e.g. replaced by a re-upload)."""
+    cutoff = time.time() - KYC_ORPHAN_GRACE_SECONDS
+    names = await asyncio.to_thread(lambda: [p.name for p in UPLOAD_DIR.iterdir() if p.is_file() and p.stat().st_mtime < cutoff])
+    removed = 0
+    for i in range(0, len(names), batch_size):
+        batch = names[i:i + batch_size]
+        paths = [f"/api/uploads/kyc/{name}" for name in batch]
+        referenced = set()
+        async for doc in db.kyc_documents.find({"$or": [{"front_image": {"$in": paths}}, {"back_image": {"$in": paths}}]}, {"_id": 0, "front_image": 1, "back_image": 1}):
+            referenced.update((doc.get('front_image'), doc.get('back_image')))
+        orphans = [name for name, path in zip(batch, paths) if path not in referenced]
+        removed += await asyncio.to_thread(remove_files, UPLOAD_DIR, orphans)
+    if removed:
+        logger.info(f"Sahipsiz KYC dosyalari silindi: {removed}")
+
+async def flag_stale_pending_transactions():
+    """Mark transactions pending for longer than STALE_PENDING_HOURS and tell the admins once."""
+    now = datetime.now(timezone.utc)
+    result = await db.transactions.update_many(
+        {"status": "pending", "created_at": {"$lt": now - timedelta(hours=STALE_PENDING_HOURS)}, "stale_since": {"$exists": False}},
+        {"$set": {"stale_since": now}}
+    )
+    if not result.modified_count:
+        return
+    admins = await db.users.find({"role": "admin"}, {"_id": 0, "user_id": 1}).to_list(100)
+    if admins:
+        await db.notifications.insert_many([{
+            "notification_id": str(uuid.uuid4()), "user_id": a['user_id'], "title": "Bekleyen İşlemler",
+            "message": f"{result.modified_count} işlem {STALE_PENDING_HOURS} saatten uzun süredir onay bekliyor.",
+            "type": "stale_transactions", "is_read": False, "created_at": now
+        } for a in admins])
+    logger.warning(f"{result.modified_count} islem {STALE_PENDING_HOURS} saatten uzun suredir bekliyor")
+
+scheduler.every("fx-refresh", FX_REFRESH_INTERVAL_SECONDS, functools.partial(refresh_usd_rate, force=True), timeout=30, jitter=5)
+scheduler.every("ledger-snapshots", LEDGER_SNAPSHOT_INTERVAL_SECONDS, roll_up_snapshots, timeout=LEDGER_SNAPSHOT_INTERVAL_SECONDS, jitter=10)
+scheduler.every("propagation", PROPAGATION_POLL_SECONDS, propagate_renames)
+scheduler.every("admin-stats", ADMIN_STATS_INTERVAL_SECONDS, compute_admin_totals, timeout=ADMIN_STATS_INTERVAL_SECONDS, jitter=5)
+scheduler.every("investor-retry", 60, retry_pending_investors, timeout=60, jitter=5)
+scheduler.every("stale-pending-transactions", 3600, flag_stale_pending_transactions, timeout=300, jitter=30)
+scheduler.cron("kyc-orphan-cleanup", KYC_CLEANUP_CRON, clean_orphaned_kyc_files, tz=ROLLUP_TZ, timeout=600, jitter=30)
+
+@api_router.get("/admin/scheduled-jobs")
+async def get_scheduled_jobs(admin=Depends(get_admin_user)):
+    return await db.scheduled_jobs.find({}, {"locked_by": 0}).sort("_id", ASCENDING).to_list(100)
+
+@api_router.post("/admin/scheduled-jobs/{name}/run")
+async def run_scheduled_job(name: str, admin=Depends(get_admin_user)):
+    if name not in scheduler.jobs:
+        raise HTTPException(status_code=404, detail="Zamanlanmis is bulunamadi")
+    await scheduler.trigger(name)
+    return {"message": "Is calistirilmak uzere siraya alindi", "name": name}
+
+async def run_data_migrations():
+    lease = Lease(db.leases, "data-migrations", ttl_seconds=600)
+    if not await lease.acquire():
+        return
+    try:
+        # Renewed before every collection so a long run keeps the lease
+        await migrations.run_all(db, MIGRATION_BATCH_SIZE, MIGRATION_PAUSE_SECONDS, before_step=lease.acquire)
+    except Exception as e:
+        logger.warning(f"Veri migrasyonu yarida kaldi, bir sonraki acilista devam edecek: {e}")
+    finally:
+        await lease.release()
+
+async def backfill_user_search_fields(batch_size: int = 500):
+    """Give users created before admin search existed their normalized search fields."""
+    async with Lease(db.leases, "user-search-backfill", ttl_seconds=600) as acquired:
+        if not acquired:
+            return
+        total = 0
+        while True:
+            users = await db.users.find({"search_terms": {"$exists": False}}, {"_id": 0, "user_id": 1, "name": 1, "email": 1, "phone": 1}).limit(batch_size).to_list(batch_size)
+            if not users:
+                break
+            await db.users.bulk_write([
+                UpdateOne({"user_id": u['user_id']}, {"$set": search_fields(u.get('name', ''), u.get('email', ''), u.get('phone', ''))})
+                for u in users
+            ], ordered=False)
+            total += len(users)
+        if total:
+            logger.info(f"Kullanici arama alanlari dolduruldu: {total} kullanici")
+
+def start_background_tasks():
+    scheduler.start()
+    background_tasks.append(asyncio.create_task(run_order_book()))
+    background_tasks.append(asyncio.create_task(backfill_user_search_fields()))
+    background_tasks.append(asyncio.create_task(backfill_project_daily()))
+    background_tasks.append(asyncio.create_task(backfill_portfolio_summaries()))
+    background_tasks.append(asyncio.create_task(backfill_project_investors()))
+    background_tasks.append(asyncio.create_task(backfill_cash_flow()))
+    background_tasks.append(asyncio.create_task(run_data_migrations()))
+
+# ===== STARTUP AND HEALTH =====
+# Phase name -> seconds; "import" is the module import, the rest is warm-up after the server is listening
+startup_report = {}
+warmup_complete = asyncio.Event()
+
+# Warm-up phases not finished yet; /api/health/ready lists them while starting
+warmup_pending = set()
+
+async def timed_phase(phase: str, coro):
+    started = time.perf_counter()
+    try:
+        return await coro
+    finally:
+        startup_report[phase] = round(time.perf_counter() - started, 3)
+
+async def run_warmup_phase(phase: str, start):
+    """Run one warm-up phase until it succeeds. A failure retries only this
+    phase; the others are not re-run and keep their own result."""
+    warmup_pending.add(phase)
+    while True:
+        try:
+            await timed_phase(phase, start())
+            break
+        except Exception as e:
+            logger.error(f"Baslangic asamasi basarisiz, tekrar denenecek ({phase}): {e}")
+            await asyncio.sleep(5)
+    warmup_pending.discard(phase)
+
+async def warm_caches():
+    # FX history first: it is the fallback when the shared rate is missing
+    await fx_history.load()
+    await get_usd_rate()
+
+async def warm_up():
+    """Everything a worker needs before taking traffic. The server already answers
+    /api/health/live meanwhile; /api/health/ready turns 200 when this finishes."""
+    started = time.perf_counter()
+    await asyncio.gather(
+        run_warmup_phase("indexes", ensure_indexes),
+        run_warmup_phase("seed", seed_on_startup),
+        run_warmup_phase("caches", warm_caches),
+    )
+    startup_report["warmup"] = round(time.perf_counter() - started, 3)
+    startup_report["total"] = round(time.perf_counter() - PROCESS_STARTED, 3)
+    warmup_complete.set()
+    # Backfills and migrations start only after the worker is ready, so they don't slow warm-up down
+    start_background_tasks()
+    breakdown = ", ".join(f"{phase}={seconds * 1000:.0f}ms" for phase, seconds in startup_report.items())
+    if STARTUP_TARGET_SECONDS and startup_report["total"] > STARTUP_TARGET_SECONDS:
+        logger.warning(f"Baslangic hedefi ({STARTUP_TARGET_SECONDS}s) asildi: {breakdown}")
+    else:
+        logger.info(f"Worker hazir: {breakdown}")
+
+@app.on_event("startup")
+async def start_up():
+    background_tasks.append(asyncio.create_task(warm_up()))
+
+@api_router.get("/health/live")
+async def health_live():
+    # No I/O: only says the process and its event loop respond
+    return {"status": "ok", "worker": WORKER_ID}
+
+@api_router.get("/health/ready")
+async def health_ready():
+    if not warmup_complete.is_set():
+        return JSONResponse(status_code=503, content={"status": "starting", "pending": sorted(warmup_pending), "startup": startup_report})
+    try:
+        await asyncio.wait_for(client.admin.command("ping"), timeout=HEALTH_PING_TIMEOUT_SECONDS)
+    except Exception as e:
+        return JSONResponse(status_code=503, content={"status": "unavailable", "detail": f"Veritabanina ulasilamiyor: {e}"})
+    return {"status": "ready", "worker": WORKER_ID, "startup": startup_report}
+
 # Mount static files and include router
 app.mount("/api/uploads", StaticFiles(directory=str(ROOT_DIR / 'uploads')), name="uploads")
 app.include_router(api_router)
 
+idempotency_store = IdempotencyStore(db.idempotency_keys, ttl_seconds=IDEMPOTENCY_TTL_HOURS * 3600, lock_seconds=IDEMPOTENCY_LOCK_SECONDS)
+app.add_middleware(IdempotencyMiddleware, store=idempotency_store, scope_of=token_user_id, wait_seconds=IDEMPOTENCY_WAIT_SECONDS,
+                   paths=("/api/portfolio/invest", "/api/portfolio/sell", "/api/transactions", "/api/market/orders"))
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -686,7 +2183,17 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(HTTPCacheMiddleware, min_size=COMPRESSION_MIN_BYTES, gzip_level=GZIP_LEVEL, brotli_quality=BROTLI_QUALITY)
+app.add_middleware(DBTraceMiddleware, client=client, header=DB_TRACE_HEADER,
+                   max_round_trips=SLOW_REQUEST_ROUND_TRIPS, max_db_ms=SLOW_REQUEST_DB_MS)
+app.add_middleware(MetricsMiddleware)
+
+startup_report["import"] = round(time.perf_counter() - PROCESS_STARTED, 3)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    scheduler.stop()
+    await audit_log.close()
+    for task in background_tasks:
+        task.cancel()
     client.close()
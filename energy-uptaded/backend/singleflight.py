@@ -0,0 +1,75 @@
+"""Request coalescing (single-flight) for read-only handlers.
+
+Concurrent calls with the same key share one execution: the first caller
+starts the handler as a task, everyone arriving before it finishes awaits the
+same task and gets the same result (or exception). Nothing is cached after
+the call completes, so results are never staler than the request that
+started the flight. During a stampede the database sees one query per
+distinct (route, parameters, auth scope) instead of one per request.
+
+The shared result object is handed to every caller, so handlers must not
+mutate what they return after returning it.
+"""
+import asyncio
+import functools
+
+from metrics import Counter, Histogram
+
+SINGLE_FLIGHT_CALLS = Counter("single_flight_calls_total", "Coalesced handler calls by route; outcome executed = leader, shared = waited for a leader", ("route", "outcome"))
+SINGLE_FLIGHT_FOLLOWERS = Histogram("single_flight_followers", "Callers that shared each execution besides the leader", ("route",),
+                                    buckets=(0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000))
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights = {}
+
+    async def do(self, route: str, key, fn):
+        flight = self._flights.get(key)
+        if flight is None:
+            task = asyncio.ensure_future(fn())
+            flight = self._flights[key] = [task, 0]
+            task.add_done_callback(functools.partial(self._finished, route, key, flight))
+            SINGLE_FLIGHT_CALLS.inc(route, "executed")
+        else:
+            flight[1] += 1
+            SINGLE_FLIGHT_CALLS.inc(route, "shared")
+        # A caller that disconnects must not cancel the execution the others are waiting on
+        return await asyncio.shield(flight[0])
+
+    def _finished(self, route: str, key, flight, task):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        SINGLE_FLIGHT_FOLLOWERS.observe(flight[1], route)
+        if not task.cancelled():
+            # Mark the exception retrieved even if every caller went away
+            task.exception()
+
+
+def coalesce(group: SingleFlight, route: str, enabled: bool = True, scope=None):
+    """Decorate an async handler so identical concurrent calls share one execution.
+
+    The key is the route plus every keyword argument (FastAPI passes path and
+    query parameters as keywords). Handlers that depend on the caller pass
+    ``scope(kwargs)`` returning e.g. the user id, and that replaces the caller
+    objects in the key; without it all arguments must be hashable.
+    """
+    def decorator(fn):
+        if not enabled:
+            return fn
+
+        @functools.wraps(fn)
+        async def wrapper(**kwargs):
+            key = (route, scope(kwargs) if scope else None,
+                   tuple(sorted((k, v) for k, v in kwargs.items() if not scope or _hashable(v))))
+            return await group.do(route, key, lambda: fn(**kwargs))
+        return wrapper
+    return decorator
+
+
+def _hashable(value) -> bool:
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
@@ -0,0 +1,176 @@
+"""Per-user portfolio summaries kept up to date with ``$inc``.
+
+``portfolio_summaries`` holds one document per user (``_id`` = user_id) with
+the totals over all of the user's portfolio lots, a per-project breakdown and
+the amount in USD-based lots. Every write that creates, shrinks or removes a
+lot applies the matching signed delta in the same ``$inc``, so reading the
+summary costs one document however many lots the user has.
+
+A change marks the summary with ``begin_update`` (``pending`` + 1) before it
+touches the lots, and its delta takes the mark off again. Both bump
+``version``. A rebuild waits while a change is pending and replaces the
+document only if the version it read is still current, so a lot it counted
+can't also arrive as a delta afterwards, and vice versa. A mark left by a
+crashed writer is ignored after ``PENDING_TIMEOUT_SECONDS``.
+
+Lots carry ``in_summary: True`` once their amounts are in the summary; lots
+written before summaries existed are added by the server's startup backfill.
+Drifted summaries are repaired by recounting from ``portfolios``:
+
+    python summaries.py                 # every user
+    python summaries.py --user <user_id>
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime, timezone
+
+from pymongo.errors import DuplicateKeyError
+
+from migrations import as_utc
+
+logger = logging.getLogger("summaries")
+
+TOTAL_FIELDS = ("total_invested", "total_monthly_return", "total_shares", "positions", "usd_exposed", "usd_exposed_usd")
+PROJECT_FIELDS = ("amount", "shares", "monthly_return", "positions")
+# A change still pending after this long belongs to a writer that died
+PENDING_TIMEOUT_SECONDS = 60
+LOT_FIELDS = {"_id": 0, "portfolio_id": 1, "project_id": 1, "project_name": 1, "amount": 1, "shares": 1,
+              "monthly_return": 1, "usd_based": 1, "usd_rate_at_purchase": 1}
+
+
+def position_delta(project_id: str, amount: float, shares: int, monthly_return: float, positions: int,
+                   usd_based: bool = False, usd_rate: float = None) -> dict:
+    """Flat ``$inc`` fields for a change to one lot; pass negative values for a decrease."""
+    delta = {
+        "total_invested": amount, "total_monthly_return": monthly_return, "total_shares": shares, "positions": positions,
+        f"projects.{project_id}.amount": amount, f"projects.{project_id}.shares": shares,
+        f"projects.{project_id}.monthly_return": monthly_return, f"projects.{project_id}.positions": positions,
+    }
+    if usd_based:
+        delta["usd_exposed"] = amount
+        if usd_rate:
+            delta["usd_exposed_usd"] = amount / usd_rate
+    return delta
+
+
+def lot_delta(lot: dict, sign: int = 1) -> dict:
+    """Delta for adding (``sign=1``) or removing (``sign=-1``) a whole lot."""
+    return position_delta(lot['project_id'], sign * lot.get('amount', 0), sign * lot.get('shares', 0),
+                          sign * lot.get('monthly_return', 0), sign, lot.get('usd_based', False), lot.get('usd_rate_at_purchase'))
+
+
+def combine(deltas) -> dict:
+    total = {}
+    for delta in deltas:
+        for field, value in delta.items():
+            total[field] = total.get(field, 0) + value
+    return total
+
+
+def begin_update() -> dict:
+    """``update_one`` document marking a change to the user's lots as started."""
+    return {"$inc": {"pending": 1, "version": 1}, "$set": {"pending_at": datetime.now(timezone.utc)}}
+
+
+def summary_update(delta: dict, project_names: dict = None) -> dict:
+    """``update_one`` document applying ``delta`` (possibly empty) and ending the change
+    ``begin_update`` started; ``project_names`` labels the breakdown entries."""
+    return {
+        "$inc": {**delta, "pending": -1, "version": 1},
+        "$set": {"updated_at": datetime.now(timezone.utc),
+                 **{f"projects.{pid}.project_name": name for pid, name in (project_names or {}).items()}},
+    }
+
+
+def summarize(lots: list) -> dict:
+    """Summary fields counted from scratch over all of a user's lots."""
+    summary = {f: 0 for f in TOTAL_FIELDS}
+    summary["projects"] = {}
+    for lot in lots:
+        for field, value in lot_delta(lot).items():
+            if field.startswith("projects."):
+                _, project_id, name = field.split(".")
+                entry = summary["projects"].setdefault(project_id, {"project_name": lot.get('project_name', ''), **{f: 0 for f in PROJECT_FIELDS}})
+                entry[name] += value
+            else:
+                summary[field] += value
+    return summary
+
+
+def present(summary: dict) -> dict:
+    """API shape: rounded totals and the projects still held, largest first."""
+    summary = summary or {}
+    result = {f: round(summary.get(f, 0), 2) for f in TOTAL_FIELDS}
+    # Sold-out projects keep zeroed counters in the document
+    result["projects"] = sorted((
+        {"project_id": project_id, "project_name": p.get('project_name', ''), **{f: round(p.get(f, 0), 2) for f in PROJECT_FIELDS}}
+        for project_id, p in (summary.get("projects") or {}).items() if p.get("positions", 0) > 0
+    ), key=lambda p: -p["amount"])
+    return result
+
+
+def changing(summary: dict, now: datetime) -> bool:
+    """True while a change to the user's lots is between ``begin_update`` and its delta."""
+    if not summary or summary.get("pending", 0) <= 0:
+        return False
+    started = summary.get("pending_at")
+    return bool(started) and (now - as_utc(started)).total_seconds() < PENDING_TIMEOUT_SECONDS
+
+
+async def rebuild_user(db, user_id: str, attempts: int = 20, backoff: float = 0.05) -> dict:
+    """Recount one user's summary from ``portfolios``; retried while a change is pending or lands meanwhile."""
+    await db.portfolios.update_many({"user_id": user_id, "in_summary": {"$ne": True}}, {"$set": {"in_summary": True}})
+    for attempt in range(attempts):
+        current = await db.portfolio_summaries.find_one({"_id": user_id}, {"version": 1, "pending": 1, "pending_at": 1})
+        if changing(current, datetime.now(timezone.utc)):
+            await asyncio.sleep(min(backoff * 2 ** attempt, 1))
+            continue
+        lots = await db.portfolios.find({"user_id": user_id}, LOT_FIELDS).to_list(None)
+        version = (current or {}).get("version", 0)
+        doc = {**summarize(lots), "version": version + 1, "pending": 0,
+               "updated_at": datetime.now(timezone.utc), "rebuilt_at": datetime.now(timezone.utc)}
+        try:
+            if current:
+                result = await db.portfolio_summaries.replace_one({"_id": user_id, "version": version}, doc)
+                if result.matched_count:
+                    return doc
+            else:
+                await db.portfolio_summaries.insert_one({"_id": user_id, **doc})
+                return doc
+        except DuplicateKeyError:
+            # An investment created the summary between the read and the insert
+            pass
+    raise RuntimeError(f"Portfoy ozeti yeniden hesaplanamadi, kullanici surekli degisiyor: {user_id}")
+
+
+async def rebuild_all(db, batch_size: int = 500) -> int:
+    """Rebuild every user's summary, walking users in user_id order."""
+    last, rebuilt = None, 0
+    while True:
+        query = {"user_id": {"$gt": last}} if last else {}
+        users = await db.users.find(query, {"_id": 0, "user_id": 1}).sort("user_id", 1).limit(batch_size).to_list(batch_size)
+        if not users:
+            return rebuilt
+        for u in users:
+            await rebuild_user(db, u['user_id'])
+        rebuilt += len(users)
+        last = users[-1]['user_id']
+        logger.info(f"Portfoy ozetleri: {rebuilt} kullanici yeniden hesaplandi")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Portfoy ozetlerini portfolios koleksiyonundan yeniden hesaplar")
+    parser.add_argument("--user", help="Yalnizca bu kullanicinin ozetini yeniden hesapla")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    from server import db
+    if args.user:
+        print(present(asyncio.run(rebuild_user(db, args.user))))
+    else:
+        print(f"{asyncio.run(rebuild_all(db, args.batch_size))} kullanici")
+
+
+if __name__ == "__main__":
+    main()
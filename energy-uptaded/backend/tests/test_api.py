@@ -393,6 +393,24 @@ class TestPortfolioEndpoints:
         assert "total_invested" in data
         assert "total_monthly_return" in data
         assert "balance" in data
+    
+    def test_portfolio_summary_fields(self, user_token):
+        """Test an empty portfolio reports zeroed summary totals"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        data = requests.get(f"{BASE_URL}/api/portfolio?limit=10", headers=headers).json()
+        assert (data["total_shares"], data["positions"], data["usd_exposed"]) == (0, 0, 0)
+        assert data["projects"] == []
+    
+    def test_get_dashboard(self, user_token):
+        """Test the dashboard returns portfolio, recent transactions and unread count in one payload"""
+        headers = {"Authorization": f"Bearer {user_token}"}
+        response = requests.get(f"{BASE_URL}/api/dashboard", headers=headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["portfolio"]["total_invested"] == 0
+        assert data["recent_transactions"] == []
+        assert data["unread_count"] >= 1  # welcome notification
+        assert data["usd_rate"] > 0
 
 
 class TestNotificationEndpoints:
@@ -418,5 +436,335 @@ class TestNotificationEndpoints:
         assert len(data["notifications"]) >= 1
 
 
+class TestBalanceLedger:
+    """Balance ledger tests - every balance change is appended to the user's ledger"""
+    
+    @pytest.fixture
+    def funded_user(self):
+        admin_resp = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": ADMIN_EMAIL, "password": ADMIN_PASSWORD
+        })
+        admin_headers = {"Authorization": f"Bearer {admin_resp.json()['token']}"}
+        reg_resp = requests.post(f"{BASE_URL}/api/auth/register", json={
+            "email": f"ledger_{uuid.uuid4().hex[:8]}@test.com", "password": "testpass123", "name": "Ledger Test"
+        })
+        user_id = reg_resp.json()["user"]["user_id"]
+        requests.put(f"{BASE_URL}/api/admin/users/{user_id}/balance", json={"amount": 10000, "type": "add"}, headers=admin_headers)
+        requests.put(f"{BASE_URL}/api/admin/users/{user_id}/balance", json={"amount": 2500, "type": "subtract"}, headers=admin_headers)
+        return {"user_id": user_id, "admin_headers": admin_headers}
+    
+    def test_ledger_records_admin_adjustments(self, funded_user):
+        """Test add/subtract both appear in the ledger with increasing seq"""
+        response = requests.get(f"{BASE_URL}/api/admin/users/{funded_user['user_id']}/ledger", headers=funded_user["admin_headers"])
+        assert response.status_code == 200
+        entries = response.json()
+        assert [e["seq"] for e in entries] == [2, 1]
+        assert [e["delta"] for e in entries] == [-2500, 10000]
+        assert entries[0]["balance_after"] == 7500
+    
+    def test_balance_history_matches_current_balance(self, funded_user):
+        """Test snapshot + tail equals the stored balance"""
+        response = requests.get(f"{BASE_URL}/api/admin/users/{funded_user['user_id']}/balance-history", headers=funded_user["admin_headers"])
+        assert response.status_code == 200
+        assert response.json()["balance"] == 7500
+
+
+class TestBulkAdminActions:
+    """Bulk settlement tests - per-item results, already processed items are skipped"""
+    
+    @pytest.fixture
+    def pending_txns(self):
+        admin_resp = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": ADMIN_EMAIL, "password": ADMIN_PASSWORD
+        })
+        admin_headers = {"Authorization": f"Bearer {admin_resp.json()['token']}"}
+        reg_resp = requests.post(f"{BASE_URL}/api/auth/register", json={
+            "email": f"bulk_{uuid.uuid4().hex[:8]}@test.com", "password": "testpass123", "name": "Bulk Test"
+        })
+        user_headers = {"Authorization": f"Bearer {reg_resp.json()['token']}"}
+        ids = []
+        for amount in (1000, 2000):
+            resp = requests.post(f"{BASE_URL}/api/transactions", json={"type": "deposit", "amount": amount, "bank_id": "bank_1"}, headers=user_headers)
+            ids.append(resp.json()["transaction_id"])
+        return {"ids": ids, "admin_headers": admin_headers, "user_headers": user_headers}
+    
+    def test_bulk_approve_deposits(self, pending_txns):
+        """Test approving several deposits credits the total once per item"""
+        response = requests.post(f"{BASE_URL}/api/admin/transactions/bulk", json={
+            "transaction_ids": pending_txns["ids"] + ["missing_txn"], "status": "approved"
+        }, headers=pending_txns["admin_headers"])
+        assert response.status_code == 200
+        assert response.json()["summary"] == {"approved": 2, "not_found": 1}
+        me = requests.get(f"{BASE_URL}/api/auth/me", headers=pending_txns["user_headers"])
+        assert me.json()["balance"] == 3000
+    
+    def test_bulk_is_idempotent(self, pending_txns):
+        """Test a repeated batch does not credit again"""
+        payload = {"transaction_ids": pending_txns["ids"], "status": "approved"}
+        requests.post(f"{BASE_URL}/api/admin/transactions/bulk", json=payload, headers=pending_txns["admin_headers"])
+        response = requests.post(f"{BASE_URL}/api/admin/transactions/bulk", json=payload, headers=pending_txns["admin_headers"])
+        assert response.json()["summary"] == {"already_processed": 2}
+    
+    def test_bulk_rejects_invalid_status(self, pending_txns):
+        response = requests.post(f"{BASE_URL}/api/admin/transactions/bulk", json={
+            "transaction_ids": pending_txns["ids"], "status": "pending"
+        }, headers=pending_txns["admin_headers"])
+        assert response.status_code == 400
+
+
+class TestAdminUserSearch:
+    """Admin user search tests - indexed prefix search with keyset pagination"""
+    
+    @pytest.fixture
+    def admin_headers(self):
+        response = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": ADMIN_EMAIL, "password": ADMIN_PASSWORD
+        })
+        return {"Authorization": f"Bearer {response.json()['token']}"}
+    
+    def test_search_by_email_prefix(self, admin_headers):
+        response = requests.get(f"{BASE_URL}/api/admin/users/search", params={"q": "ADMIN@alarko"}, headers=admin_headers)
+        assert response.status_code == 200
+        emails = [u["email"] for u in response.json()["users"]]
+        assert ADMIN_EMAIL in emails
+        assert all("password_hash" not in u for u in response.json()["users"])
+    
+    def test_pages_do_not_overlap(self, admin_headers):
+        """Test following next_cursor never repeats a user"""
+        first = requests.get(f"{BASE_URL}/api/admin/users/search", params={"limit": 2}, headers=admin_headers).json()
+        if not first["next_cursor"]:
+            pytest.skip("Not enough users for a second page")
+        second = requests.get(f"{BASE_URL}/api/admin/users/search", params={"limit": 2, "cursor": first["next_cursor"]}, headers=admin_headers).json()
+        assert not {u["user_id"] for u in first["users"]} & {u["user_id"] for u in second["users"]}
+    
+    def test_invalid_sort_rejected(self, admin_headers):
+        response = requests.get(f"{BASE_URL}/api/admin/users/search", params={"sort": "password_hash"}, headers=admin_headers)
+        assert response.status_code == 400
+
+
+class TestRenamePropagation:
+    """Rename propagation tests - denormalized copies are rewritten in the background"""
+    
+    @pytest.fixture
+    def admin_headers(self):
+        response = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": ADMIN_EMAIL, "password": ADMIN_PASSWORD
+        })
+        return {"Authorization": f"Bearer {response.json()['token']}"}
+    
+    def test_list_jobs(self, admin_headers):
+        response = requests.get(f"{BASE_URL}/api/admin/propagation-jobs", headers=admin_headers)
+        assert response.status_code == 200
+        assert all("progress" not in job for job in response.json())
+    
+    def test_list_jobs_requires_admin(self):
+        response = requests.get(f"{BASE_URL}/api/admin/propagation-jobs")
+        assert response.status_code in [401, 403]
+
+
+class TestIdempotencyKey:
+    """Idempotency-Key tests - retries of money-moving POSTs replay the first response"""
+    
+    @pytest.fixture
+    def admin_headers(self):
+        response = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": ADMIN_EMAIL, "password": ADMIN_PASSWORD
+        })
+        return {"Authorization": f"Bearer {response.json()['token']}"}
+    
+    def test_retry_replays_first_response(self, admin_headers):
+        headers = {**admin_headers, "Idempotency-Key": f"test-{uuid.uuid4()}"}
+        body = {"type": "withdrawal", "amount": 1}
+        first = requests.post(f"{BASE_URL}/api/transactions", json=body, headers=headers)
+        retry = requests.post(f"{BASE_URL}/api/transactions", json=body, headers=headers)
+        assert retry.status_code == first.status_code
+        assert retry.headers.get("Idempotent-Replayed") == "true"
+        assert retry.json() == first.json()
+    
+    def test_key_reused_with_other_body(self, admin_headers):
+        headers = {**admin_headers, "Idempotency-Key": f"test-{uuid.uuid4()}"}
+        requests.post(f"{BASE_URL}/api/transactions", json={"type": "withdrawal", "amount": 1}, headers=headers)
+        response = requests.post(f"{BASE_URL}/api/transactions", json={"type": "withdrawal", "amount": 2}, headers=headers)
+        assert response.status_code == 422
+
+
+class TestHealth:
+    """Health endpoint tests - liveness without I/O, readiness after warm-up"""
+    
+    def test_live(self):
+        response = requests.get(f"{BASE_URL}/api/health/live")
+        assert response.status_code == 200
+        assert response.json()["status"] == "ok"
+    
+    def test_ready_reports_startup_phases(self):
+        response = requests.get(f"{BASE_URL}/api/health/ready")
+        assert response.status_code == 200
+        startup = response.json()["startup"]
+        assert {"import", "indexes", "seed", "caches", "total"} <= set(startup)
+
+
+class TestScheduledJobs:
+    """Scheduled job tests - job state and manual runs"""
+    
+    @pytest.fixture
+    def admin_headers(self):
+        response = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": ADMIN_EMAIL, "password": ADMIN_PASSWORD
+        })
+        return {"Authorization": f"Bearer {response.json()['token']}"}
+    
+    def test_list_jobs(self, admin_headers):
+        response = requests.get(f"{BASE_URL}/api/admin/scheduled-jobs", headers=admin_headers)
+        assert response.status_code == 200
+        names = {job["_id"] for job in response.json()}
+        assert {"fx-refresh", "admin-stats", "kyc-orphan-cleanup", "stale-pending-transactions"} <= names
+    
+    def test_run_unknown_job(self, admin_headers):
+        response = requests.post(f"{BASE_URL}/api/admin/scheduled-jobs/nope/run", headers=admin_headers)
+        assert response.status_code == 404
+
+
+class TestUsdRateHistory:
+    """FX history tests - point-in-time lookups and downsampled history"""
+    
+    def test_history(self):
+        response = requests.get(f"{BASE_URL}/api/usd-rate/history", params={"points": 10})
+        assert response.status_code == 200
+        data = response.json()
+        assert data["pair"] == "USD/TRY"
+        assert len(data["points"]) <= 10
+    
+    def test_rate_before_history(self):
+        response = requests.get(f"{BASE_URL}/api/usd-rate", params={"at": "2000-01-01T00:00:00Z"})
+        assert response.status_code == 404
+    
+    def test_invalid_parameters(self):
+        assert requests.get(f"{BASE_URL}/api/usd-rate/history", params={"points": 0}).status_code == 400
+        assert requests.get(f"{BASE_URL}/api/usd-rate", params={"at": "yesterday"}).status_code == 400
+
+
+class TestSecondaryMarket:
+    """Secondary market tests - order validation, cancels and public book"""
+    
+    @pytest.fixture
+    def admin_headers(self):
+        response = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": ADMIN_EMAIL, "password": ADMIN_PASSWORD
+        })
+        return {"Authorization": f"Bearer {response.json()['token']}"}
+    
+    @pytest.fixture
+    def project_id(self):
+        return requests.get(f"{BASE_URL}/api/projects").json()[0]["project_id"]
+    
+    def test_invalid_side(self, admin_headers, project_id):
+        response = requests.post(f"{BASE_URL}/api/market/orders", json={
+            "project_id": project_id, "side": "hold", "quantity": 1, "price": 25000
+        }, headers=admin_headers)
+        assert response.status_code == 400
+    
+    def test_sell_without_shares(self, admin_headers, project_id):
+        response = requests.post(f"{BASE_URL}/api/market/orders", json={
+            "project_id": project_id, "side": "sell", "quantity": 1, "price": 25000, "portfolio_id": "nope"
+        }, headers=admin_headers)
+        assert response.status_code == 400
+    
+    def test_cancel_unknown_order(self, admin_headers):
+        response = requests.delete(f"{BASE_URL}/api/market/orders/nope", headers=admin_headers)
+        assert response.status_code == 404
+    
+    def test_order_book(self, project_id):
+        response = requests.get(f"{BASE_URL}/api/market/projects/{project_id}/book")
+        assert response.status_code == 200
+        data = response.json()
+        bids = [level["price"] for level in data["bids"]]
+        asks = [level["price"] for level in data["asks"]]
+        assert bids == sorted(bids, reverse=True)
+        assert asks == sorted(asks)
+
+
+class TestAuditLog:
+    """Audit log tests - admin action history and chain verification"""
+    
+    @pytest.fixture
+    def admin_headers(self):
+        response = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": ADMIN_EMAIL, "password": ADMIN_PASSWORD
+        })
+        return {"Authorization": f"Bearer {response.json()['token']}"}
+    
+    def test_requires_admin(self):
+        response = requests.get(f"{BASE_URL}/api/admin/audit-log")
+        assert response.status_code in [401, 403]
+    
+    def test_list_newest_first(self, admin_headers):
+        response = requests.get(f"{BASE_URL}/api/admin/audit-log?limit=20", headers=admin_headers)
+        assert response.status_code == 200
+        times = [entry["at"] for entry in response.json()]
+        assert times == sorted(times, reverse=True)
+    
+    def test_verify(self, admin_headers):
+        response = requests.get(f"{BASE_URL}/api/admin/audit-log/verify", headers=admin_headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["ok"] is True
+        assert data["entries"] == sum(chain["entries"] for chain in data["chains"])
+    
+    def test_verify_unknown_chain(self, admin_headers):
+        response = requests.get(f"{BASE_URL}/api/admin/audit-log/verify?chain=nope", headers=admin_headers)
+        assert response.status_code == 404
+
+
+class TestInvestorStats:
+    """Distinct investor tests - platform-wide unique investor figures"""
+    
+    @pytest.fixture
+    def admin_headers(self):
+        response = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": ADMIN_EMAIL, "password": ADMIN_PASSWORD
+        })
+        return {"Authorization": f"Bearer {response.json()['token']}"}
+    
+    def test_all_time(self, admin_headers):
+        response = requests.get(f"{BASE_URL}/api/admin/investor-stats", headers=admin_headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["unique_investors"] >= max([t["unique_investors"] for t in data["by_type"].values()] or [0])
+    
+    def test_empty_range(self, admin_headers):
+        response = requests.get(f"{BASE_URL}/api/admin/investor-stats?start=2000-01-01&end=2000-01-31", headers=admin_headers)
+        assert response.json()["unique_investors"] == 0
+    
+    def test_projects_hide_investor_state(self):
+        for project in requests.get(f"{BASE_URL}/api/projects").json():
+            assert "investor_ids" not in project and "investor_sketch" not in project
+
+
+class TestCashFlowAnalytics:
+    """Cash flow analytics tests - daily/weekly/monthly volumes"""
+    
+    @pytest.fixture
+    def admin_headers(self):
+        response = requests.post(f"{BASE_URL}/api/auth/login", json={
+            "email": ADMIN_EMAIL, "password": ADMIN_PASSWORD
+        })
+        return {"Authorization": f"Bearer {response.json()['token']}"}
+    
+    def test_requires_admin(self):
+        response = requests.get(f"{BASE_URL}/api/admin/analytics/cash-flow")
+        assert response.status_code in [401, 403]
+    
+    def test_monthly_totals_match_points(self, admin_headers):
+        response = requests.get(f"{BASE_URL}/api/admin/analytics/cash-flow?resolution=month", headers=admin_headers)
+        assert response.status_code == 200
+        data = response.json()
+        approved = sum(p["deposit"]["approved"]["amount"] for p in data["points"])
+        assert abs(data["totals"]["deposit"]["approved"]["amount"] - approved) < 0.01
+    
+    def test_invalid_resolution(self, admin_headers):
+        response = requests.get(f"{BASE_URL}/api/admin/analytics/cash-flow?resolution=year", headers=admin_headers)
+        assert response.status_code == 400
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
@@ -0,0 +1,144 @@
+"""
+Alarko Enerji - Audit log tests
+Tests hash chaining, group commit and chain verification
+"""
+import asyncio
+import copy
+
+from audit import AuditLog, entry_hash, verify_chain
+
+ADMIN = {"user_id": "admin_1", "email": "admin@alarkoenerji.com"}
+
+
+class Cursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, field, direction):
+        self.docs.sort(key=lambda d: d[field], reverse=direction < 0)
+        return self
+
+    def batch_size(self, n):
+        return self
+
+    def __aiter__(self):
+        self._it = iter(self.docs)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._it)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class Entries:
+    def __init__(self):
+        self.docs = []
+        self.insert_calls = 0
+
+    async def insert_many(self, docs, ordered=True):
+        self.insert_calls += 1
+        # Stored copies, like the database: later edits to the entries don't reach them
+        self.docs.extend(copy.deepcopy(docs))
+
+    def find(self, query, projection=None):
+        return Cursor([copy.deepcopy(d) for d in self.docs if d["chain"] == query["chain"]])
+
+
+class Heads:
+    def __init__(self):
+        self.docs = {}
+
+    async def update_one(self, query, update, upsert=False):
+        doc = self.docs.setdefault(query["_id"], {"_id": query["_id"], **update.get("$setOnInsert", {})})
+        doc.update(update["$set"])
+
+
+def write(entries: int, key: bytes = b""):
+    log = AuditLog(Entries(), Heads(), "w1", key=key, max_delay=0.01)
+
+    async def run():
+        for i in range(entries):
+            log.record(ADMIN, "user.role", "user", f"user_{i}", {"from": "user", "to": "admin"})
+        await log.close()
+    asyncio.run(run())
+    return log
+
+
+class TestChain:
+    """Tests for how entries link to each other"""
+
+    def test_entries_link_to_previous_hash(self):
+        log = write(3)
+        docs = log.collection.docs
+        assert [d["seq"] for d in docs] == [1, 2, 3]
+        assert docs[0]["prev_hash"] == ""
+        assert docs[1]["prev_hash"] == docs[0]["hash"]
+        assert docs[2]["prev_hash"] == docs[1]["hash"]
+
+    def test_hash_covers_fields(self):
+        entry = write(1).collection.docs[0]
+        assert entry_hash(entry) == entry["hash"]
+        assert entry_hash({**entry, "details": {"from": "user", "to": "user"}}) != entry["hash"]
+
+    def test_key_changes_hash(self):
+        entry = write(1).collection.docs[0]
+        assert entry_hash(entry, b"secret") != entry_hash(entry)
+
+
+class TestGroupCommit:
+    """Tests for batching writes"""
+
+    def test_entries_are_written_together(self):
+        log = write(50)
+        assert len(log.collection.docs) == 50
+        assert log.collection.insert_calls == 1
+        assert log.heads.docs["w1"]["last_seq"] == 50
+
+    def test_full_batch_flushes_without_waiting(self):
+        log = AuditLog(Entries(), Heads(), "w1", max_delay=60, max_batch=2)
+
+        async def run():
+            log.record(ADMIN, "a", "user", "1")
+            log.record(ADMIN, "a", "user", "2")
+            await asyncio.sleep(0.05)
+        asyncio.run(run())
+        assert len(log.collection.docs) == 2
+
+
+class TestVerify:
+    """Tests for detecting tampering"""
+
+    def verify(self, log, key=b""):
+        return asyncio.run(verify_chain(log.collection, "w1", key, log.heads.docs["w1"]))
+
+    def test_intact_chain(self):
+        log = write(5, key=b"k")
+        result = self.verify(log, b"k")
+        assert result["ok"] and result["entries"] == 5
+
+    def test_wrong_key_fails(self):
+        assert self.verify(write(2, key=b"k"), b"other")["error"] == "hash_mismatch"
+
+    def test_edited_entry(self):
+        log = write(5)
+        log.collection.docs[2]["details"]["to"] = "user"
+        assert (self.verify(log)["error"], self.verify(log)["seq"]) == ("hash_mismatch", 3)
+
+    def test_removed_entry(self):
+        log = write(5)
+        del log.collection.docs[1]
+        assert self.verify(log)["error"] == "missing_entry"
+
+    def test_rehashed_entry_breaks_next_link(self):
+        log = write(5)
+        forged = log.collection.docs[1]
+        forged["details"]["to"] = "user"
+        forged["hash"] = entry_hash(forged)
+        assert (self.verify(log)["error"], self.verify(log)["seq"]) == ("broken_link", 3)
+
+    def test_truncated_tail(self):
+        log = write(5)
+        del log.collection.docs[3:]
+        assert self.verify(log)["error"] == "truncated"
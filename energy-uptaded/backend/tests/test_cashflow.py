@@ -0,0 +1,69 @@
+"""
+Alarko Enerji - Cash flow rollup tests
+Tests flow fields, events of older transactions and report shaping
+"""
+from datetime import datetime, timezone
+
+from cashflow import FIELDS, backfill_events, flow_delta, shape, transaction_events
+from rollups import downsample
+
+CREATED = datetime(2026, 3, 2, 9, 0, tzinfo=timezone.utc)
+REVIEWED = datetime(2026, 3, 4, 15, 30, tzinfo=timezone.utc)
+
+
+class TestFlowDelta:
+    """Tests for the $inc fields of one flow"""
+
+    def test_tracked_pair(self):
+        assert flow_delta("deposit", "approved", 5000) == {"deposit_approved_amount": 5000, "deposit_approved_count": 1}
+        assert flow_delta("trade", "completed", 78000, count=3)["trade_completed_count"] == 3
+
+    def test_untracked_pair_is_ignored(self):
+        assert flow_delta("deposit", "completed", 5000) == {}
+        assert flow_delta("refund", "approved", 5000) == {}
+
+    def test_fields_cover_every_pair(self):
+        assert "withdrawal_rejected_amount" in FIELDS and "sale_completed_count" in FIELDS
+        assert len(FIELDS) == 2 * (3 + 3 + 1 + 1 + 1)
+
+
+class TestTransactionEvents:
+    """Tests for reading flows back from older transactions"""
+
+    def test_pending(self):
+        assert transaction_events({"status": "pending", "created_at": CREATED}) == [("requested", CREATED)]
+
+    def test_reviewed(self):
+        txn = {"status": "rejected", "created_at": CREATED, "reviewed_at": REVIEWED, "approved_by": "admin"}
+        assert transaction_events(txn) == [("requested", CREATED), ("rejected", REVIEWED)]
+
+    def test_review_time_unknown(self):
+        txn = {"status": "approved", "created_at": CREATED.isoformat()}
+        assert transaction_events(txn) == [("requested", CREATED), ("approved", CREATED)]
+
+    def test_admin_adjustment(self):
+        txn = {"status": "approved", "created_at": CREATED, "approved_by": "admin"}
+        assert transaction_events(txn) == [("approved", CREATED)]
+
+    def test_backfill_events(self):
+        assert backfill_events("portfolios", {"amount": 50000, "purchase_date": CREATED}) == [("investment", "completed", 50000, CREATED)]
+        assert backfill_events("portfolios", {"amount": 25000, "trade_id": "b:s"}) == []
+        assert backfill_events("trades", {"price": 25500.5, "quantity": 2, "executed_at": CREATED}) == [("trade", "completed", 51001.0, CREATED)]
+
+
+class TestShape:
+    """Tests for the report layout"""
+
+    def test_weekly_report(self):
+        buckets = [
+            {"day": "2026-03-02", **flow_delta("deposit", "approved", 10000), **flow_delta("investment", "completed", 25000)},
+            {"day": "2026-03-04", **flow_delta("deposit", "approved", 5000), **flow_delta("withdrawal", "approved", 3000)},
+            {"day": "2026-03-09", **flow_delta("withdrawal", "requested", 1000)},
+        ]
+        points = [shape(p) for p in downsample(buckets, "week", FIELDS)]
+        assert [p["period"] for p in points] == ["2026-03-02", "2026-03-09"]
+        assert points[0]["deposit"]["approved"] == {"amount": 15000, "count": 2}
+        assert points[0]["investment"]["completed"]["amount"] == 25000
+        assert points[0]["net_deposits"] == 12000
+        assert points[1]["withdrawal"] == {"requested": {"amount": 1000, "count": 1},
+                                           "approved": {"amount": 0, "count": 0}, "rejected": {"amount": 0, "count": 0}}
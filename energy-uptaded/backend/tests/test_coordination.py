@@ -0,0 +1,128 @@
+"""
+Alarko Enerji - Multi-worker coordination tests
+Tests Mongo leases and the shared cache on mongomock_motor, and also on a real
+MongoDB when MONGO_URL is set
+"""
+import asyncio
+import os
+import uuid
+
+import pytest
+
+from coordination import Lease, SharedCache
+
+MONGO_URL = os.environ.get('MONGO_URL')
+
+
+@pytest.fixture(params=["mongomock", "mongodb"])
+def backend(request):
+    if request.param == "mongodb" and not MONGO_URL:
+        pytest.skip("MONGO_URL tanimli degil")
+    return request.param
+
+
+@pytest.fixture
+def run(backend):
+    def _run(coro_fn):
+        async def wrapper():
+            if backend == "mongomock":
+                from mongomock_motor import AsyncMongoMockClient
+                client = AsyncMongoMockClient()
+            else:
+                from motor.motor_asyncio import AsyncIOMotorClient
+                client = AsyncIOMotorClient(MONGO_URL, serverSelectionTimeoutMS=2000)
+            db = client[f"test_coordination_{uuid.uuid4().hex[:8]}"]
+            try:
+                return await coro_fn(db)
+            finally:
+                await client.drop_database(db.name)
+                client.close()
+
+        return asyncio.run(wrapper())
+    return _run
+
+
+class TestLease:
+    """Tests for the Mongo-backed lease used by seeding and refresh loops"""
+
+    def test_only_one_of_many_workers_acquires(self, run):
+        """Eight workers racing for the same lease: exactly one wins"""
+        async def go(db):
+            leases = [Lease(db.leases, "seed", ttl_seconds=60, owner=f"worker-{i}") for i in range(8)]
+            return await asyncio.gather(*(lease.acquire() for lease in leases))
+
+        assert sum(run(go)) == 1
+
+    def test_holder_renews_and_release_hands_over(self, run):
+        """The holder can renew; after release another worker can take it"""
+        async def go(db):
+            a = Lease(db.leases, "refresh", ttl_seconds=60, owner="a")
+            b = Lease(db.leases, "refresh", ttl_seconds=60, owner="b")
+            results = [await a.acquire(), await b.acquire(), await a.acquire()]
+            await a.release()
+            results.append(await b.acquire())
+            return results
+
+        assert run(go) == [True, False, True, True]
+
+    def test_expired_lease_is_taken_over(self, run):
+        """A crashed holder's lease can be taken once it expires"""
+        async def go(db):
+            crashed = Lease(db.leases, "refresh", ttl_seconds=0.2, owner="crashed")
+            other = Lease(db.leases, "refresh", ttl_seconds=60, owner="other")
+            await crashed.acquire()
+            first = await other.acquire()
+            await asyncio.sleep(0.3)
+            return first, await other.acquire()
+
+        assert run(go) == (False, True)
+
+    def test_release_by_other_worker_keeps_lease(self, run):
+        """Only the holder can release; the context manager releases on exit"""
+        async def go(db):
+            a = Lease(db.leases, "migrations", ttl_seconds=60, owner="a")
+            b = Lease(db.leases, "migrations", ttl_seconds=60, owner="b")
+            async with a as acquired:
+                await b.release()
+                during = await b.acquire()
+            return acquired, during, await b.acquire()
+
+        assert run(go) == (True, False, True)
+
+
+class TestSharedCache:
+    """Tests for the shared cache with in-process read-through"""
+
+    def test_workers_see_the_same_value(self, run):
+        """A value set by one worker is read by another after its local TTL"""
+        async def go(db):
+            writer = SharedCache(db.shared_cache, local_ttl_seconds=0)
+            reader = SharedCache(db.shared_cache, local_ttl_seconds=0)
+            before = await reader.get("usd_try", 38.0)
+            await writer.set("usd_try", 41.25)
+            return before, await reader.get("usd_try", 38.0)
+
+        assert run(go) == (38.0, 41.25)
+
+    def test_local_copy_until_ttl(self, run):
+        """Reads are served from process memory until the local TTL runs out"""
+        async def go(db):
+            reader = SharedCache(db.shared_cache, local_ttl_seconds=0.2)
+            writer = SharedCache(db.shared_cache, local_ttl_seconds=0)
+            await writer.set("usd_try", 40.0)
+            first = await reader.get("usd_try")
+            await writer.set("usd_try", 41.0)
+            cached = await reader.get("usd_try")
+            await asyncio.sleep(0.25)
+            return first, cached, await reader.get("usd_try")
+
+        assert run(go) == (40.0, 40.0, 41.0)
+
+    def test_entry_records_writer(self, run):
+        async def go(db):
+            cache = SharedCache(db.shared_cache, local_ttl_seconds=0)
+            await cache.set("usd_try", 40.0)
+            return await cache.get_entry("usd_try"), await cache.get_entry("missing")
+
+        entry, missing = run(go)
+        assert entry["value"] == 40.0 and entry["updated_by"] and missing is None
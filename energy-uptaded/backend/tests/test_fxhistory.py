@@ -0,0 +1,65 @@
+"""
+Alarko Enerji - FX rate history tests
+Tests point-in-time lookups and downsampled series over the in-memory history
+"""
+from datetime import datetime, timezone, timedelta
+
+from fxhistory import RateHistory
+
+T0 = datetime(2026, 3, 1, tzinfo=timezone.utc)
+
+
+def history(*samples):
+    h = RateHistory(collection=None)
+    for hours, rate in samples:
+        h.add(T0 + timedelta(hours=hours), rate)
+    return h
+
+
+class TestRateAt:
+    """Tests for the rate in force at a given time"""
+
+    def test_last_sample_at_or_before(self):
+        h = history((0, 38.0), (1, 38.5), (2, 39.0))
+        assert h.rate_at(T0 + timedelta(minutes=90)) == (T0 + timedelta(hours=1), 38.5)
+        assert h.rate_at(T0 + timedelta(hours=2)) == (T0 + timedelta(hours=2), 39.0)
+        assert h.rate_at(T0 + timedelta(days=5))[1] == 39.0
+
+    def test_before_first_sample(self):
+        assert history((1, 38.0)).rate_at(T0) is None
+        assert RateHistory(None).latest() is None
+
+    def test_out_of_order_and_duplicate_samples(self):
+        h = history((2, 39.0), (0, 38.0), (1, 38.5), (1, 38.6))
+        assert len(h) == 3
+        assert h.rate_at(T0 + timedelta(hours=1))[1] == 38.6
+        assert h.latest() == (T0 + timedelta(hours=2), 39.0)
+
+
+class TestSeries:
+    """Tests for server-side downsampling"""
+
+    def test_buckets_report_close_low_high(self):
+        h = history((0, 38.0), (1, 39.0), (2, 38.2), (5, 40.0))
+        points = h.series(T0, T0 + timedelta(hours=6), 2)
+        assert [(p["rate"], p["low"], p["high"], p["samples"]) for p in points] == [
+            (38.2, 38.0, 39.0, 3),
+            (40.0, 38.2, 40.0, 1),
+        ]
+        assert points[1]["at"] == T0 + timedelta(hours=3)
+
+    def test_empty_buckets_carry_the_rate_forward(self):
+        h = history((-10, 37.0), (5, 40.0))
+        points = h.series(T0, T0 + timedelta(hours=6), 6)
+        assert [p["rate"] for p in points] == [37.0, 37.0, 37.0, 37.0, 37.0, 40.0]
+        assert points[0]["samples"] == 0
+
+    def test_buckets_before_first_sample_are_skipped(self):
+        h = history((3, 38.0))
+        points = h.series(T0, T0 + timedelta(hours=6), 6)
+        assert len(points) == 3
+
+    def test_invalid_window(self):
+        h = history((0, 38.0))
+        assert h.series(T0, T0, 10) == []
+        assert h.series(T0, T0 + timedelta(hours=1), 0) == []
@@ -0,0 +1,79 @@
+"""
+Alarko Enerji - Distinct counting tests
+Tests HyperLogLog estimates, merging and the exact-to-sketch switch
+"""
+import pytest
+
+from hll import DistinctCounter, HyperLogLog
+
+
+def ids(start, stop):
+    return [f"user_{i}" for i in range(start, stop)]
+
+
+class TestHyperLogLog:
+    """Tests for the sketch itself"""
+
+    @pytest.mark.parametrize("n", [10, 1000, 50000])
+    def test_estimate_within_error(self, n):
+        sketch = HyperLogLog()
+        for member in ids(0, n):
+            sketch.add(member)
+        # Four standard errors; small counts are close to exact thanks to linear counting
+        assert abs(sketch.count() - n) <= max(1, 4 * sketch.error * n)
+
+    def test_repeats_dont_change_sketch(self):
+        sketch = HyperLogLog()
+        assert sketch.add("user_1")
+        assert not sketch.add("user_1")
+
+    def test_merge_equals_union(self):
+        a, b, union = HyperLogLog(), HyperLogLog(), HyperLogLog()
+        for member in ids(0, 3000):
+            a.add(member)
+            union.add(member)
+        for member in ids(2000, 5000):
+            b.add(member)
+            union.add(member)
+        assert a.merge(b)
+        assert a.registers == union.registers
+        assert not a.merge(b)
+
+    def test_bytes_round_trip(self):
+        sketch = HyperLogLog(10)
+        for member in ids(0, 500):
+            sketch.add(member)
+        restored = HyperLogLog.from_bytes(sketch.to_bytes())
+        assert (restored.precision, restored.count()) == (10, sketch.count())
+        assert len(HyperLogLog().to_bytes()) == 4096
+
+    def test_rejects_mixed_precision(self):
+        with pytest.raises(ValueError):
+            HyperLogLog(10).merge(HyperLogLog(12))
+
+
+class TestDistinctCounter:
+    """Tests for the exact-or-sketch counter"""
+
+    def test_exact_until_limit(self):
+        counter = DistinctCounter(ids(0, 100) + ids(0, 50), limit=100)
+        assert counter.exact and counter.count() == 100
+        assert not counter.add("user_5")
+        assert counter.add("user_100")
+        assert not counter.exact
+        assert abs(counter.count() - 101) <= 5
+
+    def test_merge_exact_counters(self):
+        a = DistinctCounter(ids(0, 30), limit=100)
+        a.merge(DistinctCounter(ids(20, 60), limit=100))
+        assert a.exact and a.count() == 60
+
+    def test_merge_exact_into_sketch_and_back(self):
+        large = DistinctCounter(ids(0, 2000), limit=100)
+        small = DistinctCounter(ids(1990, 2010), limit=100)
+        small.merge(large)
+        assert not small.exact
+        assert abs(small.count() - 2010) <= 4 * small.sketch.error * 2010
+        before = large.sketch.to_bytes()
+        assert not large.merge(DistinctCounter(ids(0, 10), limit=100))
+        assert large.sketch.to_bytes() == before
@@ -0,0 +1,91 @@
+"""
+Alarko Enerji - Compression and ETag tests
+Tests encoding negotiation, weak ETag comparison and the middleware end to end
+"""
+import asyncio
+import gzip
+import json
+
+import httpcache
+from httpcache import HTTPCacheMiddleware, cache_control, choose_encoding, etag_matches, weak_etag
+
+
+class TestNegotiation:
+    """Tests for Accept-Encoding handling"""
+
+    def test_gzip(self):
+        assert choose_encoding("gzip, deflate") == "gzip"
+
+    def test_refused_with_zero_quality(self):
+        assert choose_encoding("gzip;q=0, identity") is None
+
+    def test_brotli_only_when_installed(self):
+        expected = "br" if httpcache.brotli is not None else "gzip"
+        assert choose_encoding("br, gzip") == expected
+
+    def test_nothing_accepted(self):
+        assert choose_encoding("") is None
+
+
+class TestETag:
+    """Tests for weak validators"""
+
+    def test_same_body_same_etag(self):
+        assert weak_etag(b'{"a": 1}') == weak_etag(b'{"a": 1}')
+        assert weak_etag(b'{"a": 1}') != weak_etag(b'{"a": 2}')
+
+    def test_weak_comparison(self):
+        etag = weak_etag(b"x")
+        assert etag_matches(etag, etag)
+        assert etag_matches(etag.removeprefix("W/"), etag)
+        assert etag_matches(f'"other", {etag}', etag)
+        assert etag_matches("*", etag)
+        assert not etag_matches('"other"', etag)
+
+
+def call(request_headers, body=b'{"items": [' + b'"x", ' * 600 + b'"x"]}', method="GET"):
+    @cache_control("public, max-age=60")
+    def endpoint():
+        pass
+
+    async def app(scope, receive, send):
+        scope["endpoint"] = endpoint
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": method, "path": "/api/x", "headers": request_headers}
+    asyncio.run(HTTPCacheMiddleware(app, min_size=1024)(scope, None, send))
+    return messages[0]["status"], dict(messages[0]["headers"]), messages[1]["body"]
+
+
+class TestMiddleware:
+    """Tests for the response the middleware produces"""
+
+    def test_compressed_with_policy_and_etag(self):
+        status, headers, body = call([(b"accept-encoding", b"gzip")])
+        assert status == 200
+        assert headers[b"content-encoding"] == b"gzip"
+        assert headers[b"cache-control"] == b"public, max-age=60"
+        assert headers[b"content-length"] == str(len(body)).encode()
+        assert json.loads(gzip.decompress(body))["items"][0] == "x"
+
+    def test_small_bodies_are_not_compressed(self):
+        _, headers, body = call([(b"accept-encoding", b"gzip")], body=b'{"rate": 36.5}')
+        assert b"content-encoding" not in headers
+        assert body == b'{"rate": 36.5}'
+
+    def test_if_none_match_returns_304(self):
+        _, headers, _ = call([])
+        status, headers, body = call([(b"if-none-match", headers[b"etag"])])
+        assert status == 304
+        assert body == b""
+        assert b"content-type" not in headers
+
+    def test_post_gets_no_etag(self):
+        _, headers, _ = call([], method="POST")
+        assert b"etag" not in headers
@@ -0,0 +1,253 @@
+"""
+Alarko Enerji - Idempotency-Key tests
+Tests request fingerprints, which requests the middleware handles, replay,
+concurrent duplicates and lock takeover
+"""
+import asyncio
+
+import pytest
+
+from idempotency import IdempotencyMiddleware, IdempotencyStore, fingerprint
+
+
+class TestFingerprint:
+    """Tests for detecting a key reused with a different request"""
+
+    def test_same_request_same_fingerprint(self):
+        assert fingerprint("POST", "/api/transactions", b'{"amount": 5}') == fingerprint("POST", "/api/transactions", b'{"amount": 5}')
+
+    def test_body_and_path_change_fingerprint(self):
+        base = fingerprint("POST", "/api/transactions", b'{"amount": 5}')
+        assert fingerprint("POST", "/api/transactions", b'{"amount": 6}') != base
+        assert fingerprint("POST", "/api/portfolio/sell", b'{"amount": 5}') != base
+
+
+class TestPassThrough:
+    """Tests for requests the middleware must leave alone (no store access)"""
+
+    def run(self, scope, scope_of=lambda headers: "user_1"):
+        calls = []
+
+        async def app(scope, receive, send):
+            calls.append(scope["path"])
+
+        middleware = IdempotencyMiddleware(app, store=None, paths=("/api/transactions",), scope_of=scope_of)
+        asyncio.run(middleware(scope, None, None))
+        return calls
+
+    def test_other_paths(self):
+        assert self.run({"type": "http", "method": "POST", "path": "/api/auth/login", "headers": [(b"idempotency-key", b"k")]})
+
+    def test_get_requests(self):
+        assert self.run({"type": "http", "method": "GET", "path": "/api/transactions", "headers": [(b"idempotency-key", b"k")]})
+
+    def test_without_header(self):
+        assert self.run({"type": "http", "method": "POST", "path": "/api/transactions", "headers": []})
+
+    def test_unauthenticated(self):
+        scope = {"type": "http", "method": "POST", "path": "/api/transactions", "headers": [(b"idempotency-key", b"k")]}
+        assert self.run(scope, scope_of=lambda headers: None)
+
+
+def make_store(lock_seconds=30):
+    from mongomock_motor import AsyncMongoMockClient
+    return IdempotencyStore(AsyncMongoMockClient()["test"].idempotency_keys, lock_seconds=lock_seconds)
+
+
+class App:
+    """Stub handler that counts executions and can be held mid-request."""
+
+    def __init__(self, status=201, body=b'{"transaction_id": "t1"}'):
+        self.status = status
+        self.body = body
+        self.calls = 0
+        self.gate = None
+
+    async def __call__(self, scope, receive, send):
+        self.calls += 1
+        await receive()
+        if self.gate:
+            await self.gate.wait()
+        await send({"type": "http.response.start", "status": self.status,
+                    "headers": [(b"content-type", b"application/json"), (b"x-request-id", b"r1")]})
+        await send({"type": "http.response.body", "body": self.body})
+
+
+async def post(middleware, body=b'{"amount": 5000}', key=b"key-1"):
+    """One POST through the middleware; returns ``(status, headers, body)``."""
+    scope = {"type": "http", "method": "POST", "path": "/api/transactions", "headers": [(b"idempotency-key", key)]}
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    await middleware(scope, receive, send)
+    start = messages[0]
+    return start["status"], dict(start["headers"]), b"".join(m.get("body", b"") for m in messages[1:])
+
+
+def middleware(app, store, wait_seconds=10):
+    return IdempotencyMiddleware(app, store=store, paths=("/api/transactions",), scope_of=lambda headers: "user_1", wait_seconds=wait_seconds)
+
+
+class TestReplay:
+    """Tests for running a keyed request once and replaying its response"""
+
+    def test_retry_replays_stored_response(self):
+        app = App()
+        mw = middleware(app, make_store())
+
+        async def run():
+            return await post(mw), await post(mw)
+
+        first, retry = asyncio.run(run())
+        assert app.calls == 1
+        assert retry[0] == first[0] == 201 and retry[2] == first[2]
+        assert retry[1][b"idempotent-replayed"] == b"true"
+        assert retry[1][b"content-type"] == b"application/json"
+        # Only the listed headers are stored
+        assert b"x-request-id" not in retry[1] and b"idempotent-replayed" not in first[1]
+
+    def test_key_reused_with_other_body(self):
+        app = App()
+        mw = middleware(app, make_store())
+
+        async def run():
+            await post(mw)
+            return await post(mw, body=b'{"amount": 9000}')
+
+        assert asyncio.run(run())[0] == 422
+        assert app.calls == 1
+
+    def test_distinct_keys_run_separately(self):
+        app = App()
+        mw = middleware(app, make_store())
+
+        async def run():
+            await post(mw, key=b"a")
+            await post(mw, key=b"b")
+
+        asyncio.run(run())
+        assert app.calls == 2
+
+    @pytest.mark.parametrize("status", [500, 503, 401, 403, 408, 429])
+    def test_failures_are_not_stored(self, status):
+        app = App(status=status)
+        mw = middleware(app, make_store())
+
+        async def run():
+            return await post(mw), await post(mw)
+
+        first, retry = asyncio.run(run())
+        assert app.calls == 2
+        assert first[0] == retry[0] == status and b"idempotent-replayed" not in retry[1]
+
+    def test_client_errors_are_stored(self):
+        app = App(status=400, body=b'{"detail": "Yetersiz bakiye"}')
+        mw = middleware(app, make_store())
+
+        async def run():
+            return await post(mw), await post(mw)
+
+        _, retry = asyncio.run(run())
+        assert app.calls == 1 and retry[0] == 400
+
+    def test_handler_exception_releases_key(self):
+        app = App()
+        mw = middleware(app, make_store())
+
+        async def broken(scope, receive, send):
+            raise RuntimeError("db down")
+
+        async def run():
+            mw.app = broken
+            with pytest.raises(RuntimeError):
+                await post(mw)
+            mw.app = app
+            return await post(mw)
+
+        assert asyncio.run(run())[0] == 201
+        assert app.calls == 1
+
+
+class TestConcurrent:
+    """Tests for duplicates arriving while the first request still runs"""
+
+    def test_other_worker_gets_409_while_in_flight(self):
+        app = App()
+        store = make_store()
+        first_worker, other_worker = middleware(app, store), middleware(app, store, wait_seconds=0.1)
+
+        async def run():
+            app.gate = asyncio.Event()
+            first = asyncio.create_task(post(first_worker))
+            await asyncio.sleep(0.01)
+            duplicate = await post(other_worker)
+            app.gate.set()
+            return duplicate, await first
+
+        duplicate, first = asyncio.run(run())
+        assert duplicate[0] == 409 and duplicate[1][b"retry-after"] == b"1"
+        assert first[0] == 201 and app.calls == 1
+
+    def test_same_worker_duplicate_waits_for_result(self):
+        app = App()
+        mw = middleware(app, make_store())
+
+        async def run():
+            app.gate = asyncio.Event()
+            first = asyncio.create_task(post(mw))
+            await asyncio.sleep(0.01)
+            duplicate = asyncio.create_task(post(mw))
+            await asyncio.sleep(0.01)
+            app.gate.set()
+            return await first, await duplicate
+
+        first, duplicate = asyncio.run(run())
+        assert app.calls == 1
+        assert duplicate[0] == 201 and duplicate[1][b"idempotent-replayed"] == b"true"
+
+
+class TestStore:
+    """Tests for the key records themselves"""
+
+    def test_lock_is_taken_over_after_expiry(self):
+        store = make_store(lock_seconds=0.05)
+
+        async def run():
+            states = [(await store.begin("k", "h1"))[0], (await store.begin("k", "h1"))[0]]
+            await asyncio.sleep(0.1)
+            states.append((await store.begin("k", "h1"))[0])
+            # The new holder's lock is fresh again
+            states.append((await store.begin("k", "h1"))[0])
+            return states
+
+        assert asyncio.run(run()) == ["acquired", "in_flight", "acquired", "in_flight"]
+
+    def test_complete_release_and_wait(self):
+        store = make_store()
+
+        async def run():
+            await store.begin("done", "h")
+            await store.complete("done", 201, [("content-type", "application/json")], b"{}")
+            await store.begin("gone", "h")
+            await store.release("gone")
+            return (await store.begin("done", "h"), await store.wait("done", 0.1),
+                    await store.begin("gone", "h"), await store.wait("missing", 0.1))
+
+        (state, record), waited, (again, _), missing = asyncio.run(run())
+        assert state == "completed" and record["response"]["status"] == 201
+        assert waited["status"] == "completed"
+        assert again == "acquired" and missing is None
+
+    def test_wait_times_out_while_in_flight(self):
+        store = make_store()
+
+        async def run():
+            await store.begin("k", "h")
+            return await store.wait("k", 0.1)
+
+        assert asyncio.run(run()) is None
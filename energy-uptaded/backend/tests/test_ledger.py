@@ -0,0 +1,100 @@
+"""
+Alarko Enerji - Balance ledger tests
+Tests idempotent entry writes and repair of seqs whose write was lost
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from pymongo.errors import AutoReconnect
+
+from ledger import REPAIR_KIND, roll_forward, write_entries
+
+NOW = datetime(2026, 3, 2, 12, 0, tzinfo=timezone.utc)
+CUTOFF = NOW - timedelta(minutes=5)
+
+
+class Collection:
+    """Upserts keyed on (user_id, seq) that fail the first ``failures`` calls."""
+
+    def __init__(self, failures=0):
+        self.docs = {}
+        self.failures = failures
+        self.calls = 0
+
+    def _fail(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise AutoReconnect("connection reset")
+
+    async def bulk_write(self, ops, ordered=True):
+        self._fail()
+        for op in ops:
+            key = (op._filter["user_id"], op._filter["seq"])
+            self.docs.setdefault(key, op._doc["$setOnInsert"])
+
+    async def update_one(self, query, update, upsert=False):
+        self.docs.setdefault((query["user_id"], query["seq"]), update["$setOnInsert"])
+
+
+def db(failures=0):
+    return SimpleNamespace(ledger=Collection(failures), balance_snapshots=Collection())
+
+
+def entry(seq, delta, balance_after, at=NOW - timedelta(hours=1)):
+    return {"entry_id": f"e{seq}", "user_id": "u1", "seq": seq, "delta": delta,
+            "balance_after": balance_after, "kind": "deposit", "ref_id": f"t{seq}", "created_at": at}
+
+
+class TestWriteEntries:
+    """Tests for writing entries on their reserved seq"""
+
+    def test_retries_failed_insert(self):
+        target = db(failures=2)
+        assert asyncio.run(write_entries(target, [entry(1, 100, 100)], backoff=0))
+        assert list(target.ledger.docs) == [("u1", 1)]
+
+    def test_gives_up_after_attempts(self):
+        target = db(failures=5)
+        assert not asyncio.run(write_entries(target, [entry(1, 100, 100)], attempts=3, backoff=0))
+        assert target.ledger.docs == {}
+
+    def test_rewrite_keeps_first_entry(self):
+        target = db()
+        asyncio.run(write_entries(target, [entry(1, 100, 100)], {"user_id": "u1", "balance": 0, "as_of": NOW}))
+        asyncio.run(write_entries(target, [{**entry(1, 100, 100), "entry_id": "retry"}]))
+        assert target.ledger.docs[("u1", 1)]["entry_id"] == "e1"
+        assert target.balance_snapshots.docs[("u1", 0)]["balance"] == 0
+
+
+class TestRollForward:
+    """Tests for walking the ledger past lost writes"""
+
+    snapshot = {"user_id": "u1", "seq": 0, "balance": 1000}
+
+    def test_contiguous(self):
+        tail = [entry(1, 500, 1500), entry(2, -200, 1300)]
+        user = {"balance": 1300, "ledger_seq": 2, "ledger_at": NOW}
+        assert roll_forward("u1", self.snapshot, tail, user, CUTOFF, NOW)[:2] == (1300, 2)
+
+    def test_failed_insert_is_filled_once_stale(self):
+        # seq 2 was reserved by the balance update but its insert never landed
+        tail = [entry(1, 500, 1500), entry(3, -200, 1550)]
+        user = {"balance": 1550, "ledger_seq": 3, "ledger_at": NOW - timedelta(hours=1)}
+        balance, seq, _, repairs = roll_forward("u1", self.snapshot, tail, user, CUTOFF, NOW)
+        assert (round(balance, 2), seq) == (1550, 3)
+        assert [(r["seq"], r["delta"], r["kind"]) for r in repairs] == [(2, 250, REPAIR_KIND)]
+
+    def test_recent_gap_may_still_be_in_flight(self):
+        tail = [entry(1, 500, 1500), entry(3, -200, 1550, at=NOW - timedelta(seconds=10))]
+        user = {"balance": 1550, "ledger_seq": 3, "ledger_at": NOW - timedelta(seconds=10)}
+        balance, seq, _, repairs = roll_forward("u1", self.snapshot, tail, user, CUTOFF, NOW)
+        assert (balance, seq, repairs) == (1500, 1, [])
+
+    def test_lost_write_at_the_end(self):
+        # A batch of two entries was reserved last and never written
+        tail = [entry(1, 500, 1500)]
+        user = {"balance": 1800, "ledger_seq": 3, "ledger_at": NOW - timedelta(hours=1)}
+        balance, seq, _, repairs = roll_forward("u1", self.snapshot, tail, user, CUTOFF, NOW)
+        assert (balance, seq) == (1800, 3)
+        assert [(r["seq"], r["delta"]) for r in repairs] == [(2, 300), (3, 0)]
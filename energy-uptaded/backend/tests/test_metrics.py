@@ -0,0 +1,76 @@
+"""
+Alarko Enerji - Metrics unit tests
+Tests sharded counters/histograms and Prometheus text rendering
+"""
+import threading
+
+from metrics import Counter, Histogram, command_collection
+
+
+class TestCounter:
+    """Tests for per-thread sharded counters"""
+
+    def test_increments_from_many_threads_are_not_lost(self):
+        """Concurrent increments from several threads sum exactly"""
+        counter = Counter("test_thread_total", "test", ("route",))
+
+        def work():
+            for _ in range(10000):
+                counter.inc("/api/projects")
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert counter.values() == {("/api/projects",): 80000}
+
+    def test_render_escapes_label_values(self):
+        """Label values with quotes are escaped in text format"""
+        counter = Counter("test_escape_total", "test", ("route",))
+        counter.inc('a"b')
+        assert 'test_escape_total{route="a\\"b"} 1' in counter.render()
+
+
+class TestHistogram:
+    """Tests for latency histograms"""
+
+    def test_buckets_are_cumulative(self):
+        """Observations land in the first bucket whose bound is >= value"""
+        hist = Histogram("test_latency_seconds", "test", ("route",), buckets=(0.1, 1.0))
+        hist.observe(0.05, "/x")
+        hist.observe(0.1, "/x")
+        hist.observe(0.5, "/x")
+        hist.observe(3.0, "/x")
+        lines = hist.render()
+        assert 'test_latency_seconds_bucket{route="/x",le="0.1"} 2' in lines
+        assert 'test_latency_seconds_bucket{route="/x",le="1.0"} 3' in lines
+        assert 'test_latency_seconds_bucket{route="/x",le="+Inf"} 4' in lines
+        assert 'test_latency_seconds_count{route="/x"} 4' in lines
+
+
+class TestCommandCollection:
+    """Tests for collection name extraction from driver commands"""
+
+    def test_find_and_get_more(self):
+        assert command_collection("find", {"find": "users", "filter": {}}) == "users"
+        assert command_collection("getMore", {"getMore": 123, "collection": "portfolios"}) == "portfolios"
+        assert command_collection("aggregate", {"aggregate": 1}) == ""
+
+
+class TestMongoPoolMetrics:
+    """Tests for connection pool saturation metrics"""
+
+    def test_checked_out_tracks_in_use_connections(self):
+        """Checked-out gauge rises on checkout and falls on checkin"""
+        from types import SimpleNamespace
+        from metrics import MongoPoolMetrics, MONGO_POOL_CHECKED_OUT, MONGO_POOL_WAIT
+
+        listener = MongoPoolMetrics(max_pool_size=10)
+        event = SimpleNamespace(address=("pool-test", 27017))
+        for _ in range(3):
+            listener.connection_check_out_started(event)
+            listener.connection_checked_out(event)
+        listener.connection_checked_in(event)
+        assert MONGO_POOL_CHECKED_OUT.values()[("pool-test:27017",)] == 2
+        assert MONGO_POOL_WAIT.values()[("pool-test:27017",)][0][-1] == 0
@@ -0,0 +1,69 @@
+"""
+Alarko Enerji - Data migration tests
+Tests timestamp parsing used by the ISO string -> BSON date migration and the opening funding backfill
+"""
+import asyncio
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+from migrations import as_utc, backfill_opening_funded_amount, ISO_DATE_FIELDS
+
+
+class TestAsUtc:
+    """Tests for normalizing stored timestamps"""
+
+    def test_isoformat_string(self):
+        assert as_utc("2026-03-01T12:30:15.123456+00:00") == datetime(2026, 3, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+
+    def test_offset_is_converted_to_utc(self):
+        assert as_utc("2026-03-01T15:30:00+03:00") == datetime(2026, 3, 1, 12, 30, tzinfo=timezone.utc)
+
+    def test_zulu_suffix(self):
+        assert as_utc("2026-03-01T12:30:00Z") == datetime(2026, 3, 1, 12, 30, tzinfo=timezone.utc)
+
+    def test_naive_values_are_utc(self):
+        assert as_utc(datetime(2026, 3, 1, 12, 30)) == datetime(2026, 3, 1, 12, 30, tzinfo=timezone.utc)
+        assert as_utc("2026-03-01") == datetime(2026, 3, 1, tzinfo=timezone.utc)
+
+    def test_datetime_passes_through(self):
+        value = datetime(2026, 3, 1, 15, 30, tzinfo=timezone(timedelta(hours=3)))
+        assert as_utc(value) == value
+
+    def test_empty_and_invalid(self):
+        assert as_utc(None) is None
+        assert as_utc("") is None
+        with pytest.raises(ValueError):
+            as_utc("dun")
+
+    def test_spec_covers_review_fields(self):
+        assert "reviewed_at" in ISO_DATE_FIELDS["transactions"]
+        assert "submitted_at" in ISO_DATE_FIELDS["kyc_documents"]
+
+
+class TestOpeningFundedAmount:
+    """Tests for recording funding that has no lots behind it"""
+
+    def test_seeded_and_sold_funding_become_opening(self):
+        from mongomock_motor import AsyncMongoMockClient
+        db = AsyncMongoMockClient()["test"]
+
+        async def run():
+            await db.projects.insert_many([
+                # Seeded 3,250,000 plus a held 50,000 lot
+                {"project_id": "seeded", "funded_amount": 3300000},
+                # 75,000 invested, a 25,000 lot sold back before sales were subtracted
+                {"project_id": "sold", "funded_amount": 75000},
+                {"project_id": "new", "funded_amount": 0.0, "opening_funded_amount": 0.0},
+            ])
+            await db.portfolios.insert_many([
+                {"project_id": "seeded", "amount": 50000},
+                {"project_id": "sold", "amount": 50000},
+            ])
+            await backfill_opening_funded_amount(db)
+            return ({p['project_id']: p['opening_funded_amount'] async for p in db.projects.find()},
+                    await db.migrations.find_one({"_id": "opening_funded_amount"}))
+
+        openings, state = asyncio.run(run())
+        assert openings == {"seeded": 3250000, "sold": 25000, "new": 0.0}
+        assert state["done"]
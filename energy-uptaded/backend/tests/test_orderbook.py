@@ -0,0 +1,118 @@
+"""
+Alarko Enerji - Order book tests
+Tests price-time priority matching, partial fills, cancels and book restore
+"""
+from orderbook import BUY, SELL, MatchingEngine, Order, OrderBook, COMPACT_AFTER
+
+
+def order(order_id, side, price, quantity, user="u1", project="p1"):
+    return Order(order_id, user, project, side, price, quantity)
+
+
+class TestMatching:
+    """Tests for crossing orders"""
+
+    def test_no_cross_rests_both_sides(self):
+        engine = MatchingEngine()
+        assert engine.submit(order("b1", BUY, 24000, 2, user="a")) == []
+        assert engine.submit(order("s1", SELL, 25000, 2, user="b")) == []
+        book = engine.book("p1")
+        assert (book.best_bid(), book.best_ask()) == (24000, 25000)
+        assert len(book) == 2
+
+    def test_trades_at_resting_price(self):
+        engine = MatchingEngine()
+        engine.submit(order("s1", SELL, 25000, 3, user="seller"))
+        fills = engine.submit(order("b1", BUY, 26000, 3, user="buyer"))
+        assert [(f.buy.order_id, f.sell.order_id, f.price, f.quantity) for f in fills] == [("b1", "s1", 25000, 3)]
+        assert fills[0].buy.status == fills[0].sell.status == "filled"
+        assert len(engine.book("p1")) == 0
+
+    def test_price_then_time_priority(self):
+        engine = MatchingEngine()
+        engine.submit(order("s1", SELL, 25100, 1, user="a"))
+        engine.submit(order("s2", SELL, 25000, 1, user="b"))
+        engine.submit(order("s3", SELL, 25000, 1, user="c"))
+        fills = engine.submit(order("b1", BUY, 25100, 3, user="d"))
+        # Cheapest first; at the same price the earlier order first
+        assert [f.sell.order_id for f in fills] == ["s2", "s3", "s1"]
+
+    def test_partial_fill_rests_remainder(self):
+        engine = MatchingEngine()
+        engine.submit(order("s1", SELL, 25000, 2, user="a"))
+        incoming = order("b1", BUY, 25000, 5, user="b")
+        fills = engine.submit(incoming)
+        assert sum(f.quantity for f in fills) == 2
+        assert (incoming.status, incoming.remaining) == ("open", 3)
+        assert engine.book("p1").best_bid() == 25000
+
+    def test_sell_into_bids(self):
+        engine = MatchingEngine()
+        engine.submit(order("b1", BUY, 25500, 1, user="a"))
+        engine.submit(order("b2", BUY, 25200, 1, user="b"))
+        fills = engine.submit(order("s1", SELL, 25100, 2, user="c"))
+        assert [(f.buy.order_id, f.price) for f in fills] == [("b1", 25500), ("b2", 25200)]
+
+    def test_books_are_per_project(self):
+        engine = MatchingEngine()
+        engine.submit(order("s1", SELL, 25000, 1, user="a", project="p1"))
+        assert engine.submit(order("b1", BUY, 26000, 1, user="b", project="p2")) == []
+
+    def test_self_trade_cancels_incoming_remainder(self):
+        engine = MatchingEngine()
+        engine.submit(order("s1", SELL, 25000, 1, user="b"))
+        engine.submit(order("s2", SELL, 25100, 1, user="a"))
+        incoming = order("b1", BUY, 25100, 2, user="a")
+        fills = engine.submit(incoming)
+        assert [f.sell.order_id for f in fills] == ["s1"]
+        assert (incoming.status, incoming.remaining) == ("cancelled", 1)
+        assert engine.book("p1").best_ask() == 25100
+
+
+class TestCancel:
+    """Tests for lazy cancellation"""
+
+    def test_cancelled_order_is_skipped(self):
+        engine = MatchingEngine()
+        engine.submit(order("s1", SELL, 25000, 1, user="a"))
+        engine.submit(order("s2", SELL, 25100, 1, user="a"))
+        assert engine.cancel("p1", "s1").status == "cancelled"
+        fills = engine.submit(order("b1", BUY, 25100, 1, user="b"))
+        assert [f.sell.order_id for f in fills] == ["s2"]
+
+    def test_cancel_unknown_or_filled(self):
+        engine = MatchingEngine()
+        assert engine.cancel("p1", "nope") is None
+        engine.submit(order("s1", SELL, 25000, 1, user="a"))
+        engine.submit(order("b1", BUY, 25000, 1, user="b"))
+        assert engine.cancel("p1", "s1") is None
+
+    def test_compaction_drops_cancelled_entries(self):
+        book = OrderBook("p1")
+        for i in range(COMPACT_AFTER + 1):
+            o = order(f"s{i}", SELL, 25000 + i, 1)
+            o.seq = i
+            book.add(o)
+        for i in range(COMPACT_AFTER):
+            book.cancel(f"s{i}")
+        assert len(book._asks) == 1
+        assert book.best_ask() == 25000 + COMPACT_AFTER
+
+
+class TestRestore:
+    """Tests for rebuilding the book from persisted orders"""
+
+    def test_restored_book_keeps_time_priority(self):
+        engine = MatchingEngine()
+        first = Order("s1", "a", "p1", SELL, 25000, 1, seq=7)
+        second = Order("s2", "b", "p1", SELL, 25000, 1, seq=9)
+        engine.restore([second, first], last_seq=12)
+        assert engine.loaded
+        fills = engine.submit(order("b1", BUY, 25000, 1, user="c"))
+        assert fills[0].sell.order_id == "s1"
+        assert fills[0].buy.seq == 13
+
+    def test_from_doc(self):
+        o = Order.from_doc({"order_id": "s1", "user_id": "a", "project_id": "p1", "side": SELL, "price": 25000.0,
+                            "quantity": 5, "remaining": 2, "seq": 3, "status": "open", "portfolio_id": "lot"})
+        assert (o.remaining, o.seq, o.portfolio_id) == (2, 3, "lot")
@@ -0,0 +1,49 @@
+"""
+Alarko Enerji - Rename propagation tests
+Tests the denormalized field spec and job enqueueing
+"""
+import asyncio
+
+from propagation import PROPAGATIONS, enqueue
+
+
+class RecordingJobs:
+    def __init__(self):
+        self.calls = []
+
+    async def update_one(self, query, update, upsert=False):
+        self.calls.append((query, update, upsert))
+
+
+class TestSpec:
+    """Tests for which copies each rename rewrites"""
+
+    def test_user_copies(self):
+        targets = PROPAGATIONS["user"]["targets"]
+        assert PROPAGATIONS["user"]["key"] == "user_id"
+        assert targets["transactions"] == {"user_name": "name"}
+        assert targets["portfolios"]["user_email"] == "email"
+
+    def test_project_copies(self):
+        assert PROPAGATIONS["project"]["targets"]["portfolios"] == {"project_name": "name", "project_type": "type"}
+        assert PROPAGATIONS["project"]["targets"]["orders"] == {"project_name": "name"}
+
+
+class TestEnqueue:
+    """Tests for scheduling a propagation job"""
+
+    def test_job_is_keyed_by_source_document(self):
+        jobs = RecordingJobs()
+        asyncio.run(enqueue(jobs, "user", "user_1", {"name": "Ayse"}))
+        query, update, upsert = jobs.calls[0]
+        assert query == {"_id": "user:user_1"} and upsert
+        assert update["$set"]["status"] == "pending"
+        assert update["$set"]["progress"] == {}
+
+    def test_second_rename_restarts_with_new_version(self):
+        jobs = RecordingJobs()
+        asyncio.run(enqueue(jobs, "user", "user_1", {"name": "Ayse"}))
+        asyncio.run(enqueue(jobs, "user", "user_1", {"name": "Ayse Nur"}))
+        first, second = (c[1]["$set"] for c in jobs.calls)
+        assert first["version"] != second["version"]
+        assert second["values"] == {"name": "Ayse Nur"}
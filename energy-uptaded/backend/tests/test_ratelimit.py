@@ -0,0 +1,100 @@
+"""
+Alarko Enerji - Rate limiter unit tests
+Tests token-bucket refill, Retry-After calculation and the local deny cache
+"""
+import asyncio
+from types import SimpleNamespace
+
+import ratelimit
+from ratelimit import MemoryBucketStore, RateLimiter, client_ip
+
+
+class CountingStore(MemoryBucketStore):
+    def __init__(self):
+        super().__init__()
+        self.calls = 0
+
+    async def take(self, key, rate, capacity, now):
+        self.calls += 1
+        return await super().take(key, rate, capacity, now)
+
+
+class TestTokenBucket:
+    """Tests for the in-memory token bucket"""
+
+    def test_burst_then_refill(self, monkeypatch):
+        """Burst tokens are spent immediately, then refill at the configured rate"""
+        clock = [1000.0]
+        monkeypatch.setattr(ratelimit.time, "time", lambda: clock[0])
+        limiter = RateLimiter(MemoryBucketStore(), per_minute=60, burst=3)
+
+        async def run():
+            results = [await limiter.check("login:sub:a@b.com") for _ in range(4)]
+            clock[0] += 1.0
+            results.append(await limiter.check("login:sub:a@b.com"))
+            return results
+
+        results = asyncio.run(run())
+        assert results[:3] == [0.0, 0.0, 0.0]
+        assert results[3] == 1.0
+        assert results[4] == 0.0
+
+    def test_denied_keys_skip_the_store(self, monkeypatch):
+        """Once a key is over its limit, repeat checks are answered locally"""
+        clock = [1000.0]
+        monkeypatch.setattr(ratelimit.time, "time", lambda: clock[0])
+        store = CountingStore()
+        limiter = RateLimiter(store, per_minute=6, burst=1)
+
+        async def run():
+            await limiter.check("k")
+            await limiter.check("k")
+            for _ in range(100):
+                assert await limiter.check("k") > 0
+
+        asyncio.run(run())
+        assert store.calls == 2
+
+    def test_keys_are_independent(self):
+        """Exhausting one email does not limit another"""
+        limiter = RateLimiter(MemoryBucketStore(), per_minute=1, burst=1)
+
+        async def run():
+            return [await limiter.check("a"), await limiter.check("a"), await limiter.check("b")]
+
+        first, second, other = asyncio.run(run())
+        assert first == 0.0 and second > 0 and other == 0.0
+
+    def test_allowed_keys_are_capped(self):
+        """A spray of distinct keys, each allowed once, never grows the store past its cap"""
+        store = MemoryBucketStore(max_keys=100)
+
+        async def run():
+            for i in range(1000):
+                assert await store.take(f"login:sub:user{i}@x.com", 1.0, 5, 1000.0) == 0.0
+        asyncio.run(run())
+        assert len(store._buckets) == 100
+        assert "login:sub:user999@x.com" in store._buckets and "login:sub:user0@x.com" not in store._buckets
+
+    def test_recently_used_bucket_survives_eviction(self):
+        """Eviction drops the least recently used key, not a drained one still being hit"""
+        store = MemoryBucketStore(max_keys=2)
+
+        async def run():
+            for _ in range(3):
+                await store.take("ip:1.2.3.4", 1 / 60, 3, 1000.0)
+            await store.take("a", 1.0, 5, 1000.0)
+            await store.take("ip:1.2.3.4", 1 / 60, 3, 1000.0)
+            await store.take("b", 1.0, 5, 1000.0)
+            return await store.take("ip:1.2.3.4", 1 / 60, 3, 1000.0)
+        assert asyncio.run(run()) > 0
+        assert list(store._buckets) == ["b", "ip:1.2.3.4"]
+
+
+class TestClientIp:
+    """Tests for client address extraction behind proxies"""
+
+    def test_uses_entry_appended_by_trusted_proxy(self):
+        request = SimpleNamespace(headers={"x-forwarded-for": "6.6.6.6, 1.2.3.4"}, client=SimpleNamespace(host="10.0.0.1"))
+        assert client_ip(request, 1) == "1.2.3.4"
+        assert client_ip(request, 0) == "10.0.0.1"
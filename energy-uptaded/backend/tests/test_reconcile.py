@@ -0,0 +1,72 @@
+"""
+Alarko Enerji - Reconciliation tests
+Tests which approved transactions the ledger must account for and project funding checks
+"""
+from datetime import datetime, timedelta, timezone
+
+from reconcile import approved_cash, project_discrepancy
+
+OPENED = datetime(2026, 3, 2, 9, 0, tzinfo=timezone.utc)
+
+
+def txn(transaction_id, type="deposit", amount=5000, created_at=None, reviewed_at=None, user_id="u1"):
+    return {"transaction_id": transaction_id, "user_id": user_id, "type": type, "amount": amount,
+            "created_at": created_at, "reviewed_at": reviewed_at}
+
+
+class TestApprovedCash:
+    """Tests for matching approved transactions to ledger cash moves"""
+
+    def test_first_ledger_move_is_deposit_approval(self):
+        # Requested before the ledger opened; its approval opened the ledger a moment after reviewed_at
+        deposit = txn("t1", created_at=OPENED - timedelta(days=2), reviewed_at=OPENED - timedelta(milliseconds=5))
+        opening = {"u1": {"user_id": "u1", "seq": 0, "balance": 0, "as_of": OPENED}}
+        assert approved_cash([deposit], opening, {"t1"}) == {("u1", "deposit"): 5000}
+
+    def test_admin_adjustment_written_before_opening(self):
+        adjustment = txn("t2", type="withdrawal", amount=1500, created_at=OPENED - timedelta(milliseconds=3))
+        opening = {"u1": {"as_of": OPENED.isoformat()}}
+        assert approved_cash([adjustment], opening, {"t2"}) == {("u1", "withdrawal"): 1500}
+
+    def test_pre_ledger_approvals_are_in_the_opening_balance(self):
+        old = txn("t3", created_at=OPENED - timedelta(days=30), reviewed_at=OPENED - timedelta(days=29))
+        assert approved_cash([old], {"u1": {"as_of": OPENED}}, set()) == {}
+
+    def test_later_approval_without_ledger_move_is_expected(self):
+        missing = txn("t4", created_at=OPENED - timedelta(days=1), reviewed_at=OPENED + timedelta(hours=1))
+        assert approved_cash([missing], {"u1": {"as_of": OPENED}}, set()) == {("u1", "deposit"): 5000}
+
+    def test_user_without_ledger_is_skipped(self):
+        assert approved_cash([txn("t5", created_at=OPENED)], {}, {"t5"}) == {}
+
+
+def project(funded_amount, opening=None, investors_count=1):
+    p = {"project_id": "p1", "name": "GES 1", "funded_amount": funded_amount, "investors_count": investors_count}
+    if opening is not None:
+        p["opening_funded_amount"] = opening
+    return p
+
+
+class TestProjectDiscrepancy:
+    """Tests for matching project funding to the lots held"""
+
+    def test_seeded_project_with_investment(self):
+        # Seeded at 3,250,000 with no lots, then one 50,000 investment
+        assert project_discrepancy(project(3300000, opening=3250000), 50000, 1) is None
+
+    def test_seeded_project_without_lots(self):
+        assert project_discrepancy(project(3250000, opening=3250000, investors_count=342), 0.0, 0) is None
+
+    def test_sale_reduces_funding_and_lots_alike(self):
+        # Two 25,000 investments, one sold back: funded_amount was decremented with the lot deleted
+        assert project_discrepancy(project(25000, opening=0.0, investors_count=2), 25000, 1) is None
+
+    def test_sale_not_subtracted_is_reported(self):
+        issue = project_discrepancy(project(50000, opening=0.0, investors_count=2), 25000, 1)
+        assert issue["funded_amount"] == 50000 and issue["portfolio_amount"] == 25000
+
+    def test_missing_opening_figure_is_reported(self):
+        assert project_discrepancy(project(3250000), 0.0, 0)["opening_funded_amount"] == 0
+
+    def test_investors_below_holders(self):
+        assert project_discrepancy(project(50000, opening=0.0, investors_count=1), 50000, 2) is not None
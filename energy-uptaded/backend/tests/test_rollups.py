@@ -0,0 +1,45 @@
+"""
+Alarko Enerji - Rollup bucketing tests
+Tests local-day keys and downsampling of daily buckets
+"""
+from datetime import datetime, timezone, timedelta
+
+from rollups import day_key, period_start, downsample
+
+ISTANBUL = timezone(timedelta(hours=3))
+
+
+class TestDayKey:
+    """Tests for local calendar day keys"""
+
+    def test_late_utc_evening_is_next_local_day(self):
+        assert day_key(datetime(2026, 3, 1, 22, 30, tzinfo=timezone.utc), ISTANBUL) == "2026-03-02"
+
+    def test_period_start(self):
+        assert period_start("2026-03-05", "week") == "2026-03-02"  # Monday
+        assert period_start("2026-03-05", "month") == "2026-03-01"
+        assert period_start("2026-03-05", "day") == "2026-03-05"
+
+
+class TestDownsample:
+    """Tests for merging day buckets into coarser periods"""
+
+    BUCKETS = [
+        {"day": "2026-03-02", "inflow": 100, "net": 100, "investors": ["a", "b"]},
+        {"day": "2026-03-04", "inflow": 50, "net": 20, "investors": ["b", "c"]},
+        {"day": "2026-03-10", "inflow": 10, "net": 10, "investors": ["a"]},
+    ]
+
+    def test_weekly_sums_and_distinct_investors(self):
+        points = downsample(self.BUCKETS, "week", ("inflow", "net"), ("investors",))
+        assert points == [
+            {"period": "2026-03-02", "inflow": 150, "net": 120, "investors": 3},
+            {"period": "2026-03-09", "inflow": 10, "net": 10, "investors": 1},
+        ]
+
+    def test_monthly_merges_everything(self):
+        points = downsample(self.BUCKETS, "month", ("inflow",), ("investors",))
+        assert points == [{"period": "2026-03-01", "inflow": 160, "investors": 3}]
+
+    def test_missing_fields_count_as_zero(self):
+        assert downsample([{"day": "2026-03-02"}], "day", ("outflow",)) == [{"period": "2026-03-02", "outflow": 0}]
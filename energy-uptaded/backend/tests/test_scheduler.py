@@ -0,0 +1,70 @@
+"""
+Alarko Enerji - Scheduler tests
+Tests cron parsing, next run computation and job definitions
+"""
+from datetime import datetime, timezone, timedelta
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from scheduler import Cron, Job
+
+ISTANBUL = ZoneInfo("Europe/Istanbul")
+
+
+class TestCron:
+    """Tests for five-field cron expressions"""
+
+    def test_daily_at_local_time(self):
+        after = datetime(2026, 3, 1, 12, 0, tzinfo=timezone.utc)
+        # 03:30 in Istanbul (UTC+3) is 00:30 UTC the next day
+        assert Cron("30 3 * * *").next_after(after, ISTANBUL) == datetime(2026, 3, 2, 0, 30, tzinfo=timezone.utc)
+
+    def test_strictly_after(self):
+        after = datetime(2026, 3, 1, 0, 30, tzinfo=timezone.utc)
+        assert Cron("30 0 * * *").next_after(after, timezone.utc) == datetime(2026, 3, 2, 0, 30, tzinfo=timezone.utc)
+
+    def test_steps_ranges_and_lists(self):
+        cron = Cron("*/15 9-17 * * 1,3")
+        assert cron.minutes == {0, 15, 30, 45}
+        assert cron.hours == set(range(9, 18))
+        assert cron.weekdays == {1, 3}
+
+    def test_weekday(self):
+        # 2026-03-01 is a Sunday; next Monday 09:00
+        after = datetime(2026, 3, 1, 12, 0, tzinfo=timezone.utc)
+        assert Cron("0 9 * * 1").next_after(after, timezone.utc) == datetime(2026, 3, 2, 9, 0, tzinfo=timezone.utc)
+
+    def test_sunday_as_seven(self):
+        assert Cron("0 0 * * 7").weekdays == {0}
+
+    def test_day_of_month_or_weekday(self):
+        # Both restricted: the 15th or any Monday, whichever comes first
+        after = datetime(2026, 3, 10, 0, 0, tzinfo=timezone.utc)
+        assert Cron("0 0 15 * 1").next_after(after, timezone.utc) == datetime(2026, 3, 15, 0, 0, tzinfo=timezone.utc)
+
+    @pytest.mark.parametrize("expression", ["* * * *", "60 * * * *", "* 24 * * *", "5-1 * * * *"])
+    def test_invalid(self, expression):
+        with pytest.raises(ValueError):
+            Cron(expression)
+
+
+class TestJob:
+    """Tests for job schedules"""
+
+    def test_interval(self):
+        now = datetime(2026, 3, 1, tzinfo=timezone.utc)
+        assert Job("x", None, interval=60).next_after(now) == now + timedelta(seconds=60)
+
+    def test_cron_jobs_wait_for_their_slot(self):
+        assert Job("x", None, interval=60).run_at_start
+        assert not Job("x", None, cron="0 3 * * *").run_at_start
+
+    def test_lock_outlives_timeout(self):
+        assert Job("x", None, interval=60, timeout=30).lock_seconds > 30
+
+    def test_needs_one_schedule(self):
+        with pytest.raises(ValueError):
+            Job("x", None)
+        with pytest.raises(ValueError):
+            Job("x", None, interval=60, cron="* * * * *")
@@ -0,0 +1,81 @@
+"""
+Alarko Enerji - Admin user search unit tests
+Tests search key normalization, query prefixes and keyset cursors
+"""
+import re
+from datetime import datetime, timezone
+
+import pytest
+
+from search import search_fields, term_prefix, encode_cursor, decode_cursor, after_cursor
+
+
+class TestSearchFields:
+    """Tests for the normalized fields stored on each user"""
+
+    def test_turkish_name_is_folded(self):
+        fields = search_fields("Şükrü Işık", "Sukru.Isik@Example.com", "")
+        assert fields["search_name"] == "sukru isik"
+        assert {"sukru isik", "sukru", "isik", "sukru.isik@example.com", "sukru.isik"} <= set(fields["search_terms"])
+
+    def test_phone_digits_with_and_without_country_code(self):
+        terms = search_fields("Ali", "a@b.com", "+90 (555) 123 45 67")["search_terms"]
+        assert "905551234567" in terms
+        assert "5551234567" in terms
+
+    def test_empty_fields_are_skipped(self):
+        assert search_fields("", "", "")["search_terms"] == []
+
+
+class TestTermPrefix:
+    """Tests for turning the search box into an indexable prefix"""
+
+    def test_text_query_matches_folded_terms(self):
+        terms = search_fields("Gülşen Öztürk", "g@x.com", "")["search_terms"]
+        pattern = term_prefix("GÜLŞEN Ö")
+        assert any(re.match(pattern, t) for t in terms)
+
+    def test_phone_query_ignores_leading_zero_and_punctuation(self):
+        terms = search_fields("Ali", "a@b.com", "+90 555 123 45 67")["search_terms"]
+        pattern = term_prefix("0555 123")
+        assert pattern == "^555123"
+        assert any(re.match(pattern, t) for t in terms)
+
+    def test_regex_characters_are_escaped(self):
+        assert term_prefix("a.b+c@x") == "^" + re.escape("a.b+c@x")
+
+    def test_blank_query(self):
+        assert term_prefix("   ") is None
+
+
+class TestCursor:
+    """Tests for keyset pagination cursors"""
+
+    def test_round_trip(self):
+        assert decode_cursor(encode_cursor(1250.5, "user_1")) == (1250.5, "user_1")
+
+    def test_datetime_round_trip(self):
+        created = datetime(2026, 3, 1, 12, 30, 15, 123000, tzinfo=timezone.utc)
+        value, _ = decode_cursor(encode_cursor(created, "user_1"))
+        assert value.replace(tzinfo=timezone.utc) == created
+
+    def test_tampered_cursor_is_rejected(self):
+        with pytest.raises(ValueError):
+            decode_cursor("not-a-cursor")
+
+    def test_operator_value_is_rejected(self):
+        with pytest.raises(ValueError):
+            decode_cursor(encode_cursor({"$ne": None}, "user_1"), (int, float))
+        with pytest.raises(ValueError):
+            decode_cursor(encode_cursor(True, "user_1"), (int, float))
+        with pytest.raises(ValueError):
+            decode_cursor(encode_cursor("Ayse", {"$gt": ""}))
+
+    def test_expected_types_are_accepted(self):
+        assert decode_cursor(encode_cursor(None, "user_1"), (str,)) == (None, "user_1")
+        assert decode_cursor(encode_cursor(1250, "user_1"), (int, float)) == (1250, "user_1")
+
+    def test_descending_condition(self):
+        assert after_cursor("created_at", -1, "2026-01-01", "user_9") == {
+            "$or": [{"created_at": {"$lt": "2026-01-01"}}, {"created_at": "2026-01-01", "user_id": {"$lt": "user_9"}}]
+        }
@@ -0,0 +1,75 @@
+"""
+Alarko Enerji - Request coalescing tests
+Tests that identical concurrent handler calls share one execution
+"""
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight, coalesce
+
+
+def counting_handler(group, **options):
+    calls = []
+
+    @coalesce(group, "test", **options)
+    async def handler(project_id: str, user=None):
+        calls.append(project_id)
+        await asyncio.sleep(0.01)
+        return {"project_id": project_id}
+    return handler, calls
+
+
+class TestCoalesce:
+    """Tests for the single-flight decorator"""
+
+    def test_identical_calls_share_one_execution(self):
+        handler, calls = counting_handler(SingleFlight())
+
+        async def burst():
+            return await asyncio.gather(*[handler(project_id="p1") for _ in range(20)])
+        results = asyncio.run(burst())
+        assert calls == ["p1"]
+        assert all(r is results[0] for r in results)
+
+    def test_different_parameters_run_separately(self):
+        handler, calls = counting_handler(SingleFlight())
+
+        async def burst():
+            await asyncio.gather(handler(project_id="p1"), handler(project_id="p2"))
+        asyncio.run(burst())
+        assert sorted(calls) == ["p1", "p2"]
+
+    def test_nothing_is_cached_after_the_call(self):
+        handler, calls = counting_handler(SingleFlight())
+        asyncio.run(handler(project_id="p1"))
+        asyncio.run(handler(project_id="p1"))
+        assert calls == ["p1", "p1"]
+
+    def test_scope_separates_callers(self):
+        handler, calls = counting_handler(SingleFlight(), scope=lambda kwargs: kwargs["user"]["user_id"])
+
+        async def burst():
+            await asyncio.gather(handler(project_id="p1", user={"user_id": "a"}), handler(project_id="p1", user={"user_id": "a"}),
+                                 handler(project_id="p1", user={"user_id": "b"}))
+        asyncio.run(burst())
+        assert calls == ["p1", "p1"]
+
+    def test_exception_is_shared(self):
+        calls = []
+
+        @coalesce(SingleFlight(), "test")
+        async def failing(project_id: str):
+            calls.append(project_id)
+            await asyncio.sleep(0.01)
+            raise LookupError(project_id)
+
+        async def burst():
+            return await asyncio.gather(*[failing(project_id="p1") for _ in range(5)], return_exceptions=True)
+        assert all(isinstance(r, LookupError) for r in asyncio.run(burst()))
+        assert calls == ["p1"]
+
+    def test_disabled_returns_handler_unchanged(self):
+        async def handler(project_id: str):
+            return project_id
+        assert coalesce(SingleFlight(), "test", enabled=False)(handler) is handler
@@ -0,0 +1,155 @@
+"""
+Alarko Enerji - Portfolio summary tests
+Tests summary deltas, recounting, rebuilds racing live changes and the API shape
+"""
+import asyncio
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+from summaries import (PENDING_TIMEOUT_SECONDS, begin_update, combine, lot_delta, position_delta, present,
+                       rebuild_user, summarize, summary_update)
+
+
+def lot(project_id="p1", amount=50000, shares=2, monthly_return=3500.0, usd_based=False, rate=None, name="GES 1"):
+    return {"project_id": project_id, "project_name": name, "amount": amount, "shares": shares,
+            "monthly_return": monthly_return, "usd_based": usd_based, "usd_rate_at_purchase": rate}
+
+
+def apply(deltas) -> dict:
+    """What ``$inc`` of the combined deltas leaves in an empty summary document."""
+    doc = {}
+    for field, value in combine(deltas).items():
+        *parents, leaf = field.split(".")
+        target = doc
+        for p in parents:
+            target = target.setdefault(p, {})
+        target[leaf] = target.get(leaf, 0) + value
+    return doc
+
+
+class TestDeltas:
+    """Tests for the $inc fields of lot changes"""
+
+    def test_add_lot(self):
+        delta = lot_delta(lot())
+        assert (delta["total_invested"], delta["total_shares"], delta["positions"]) == (50000, 2, 1)
+        assert delta["projects.p1.monthly_return"] == 3500.0
+        assert "usd_exposed" not in delta
+
+    def test_usd_based_lot(self):
+        delta = lot_delta(lot(amount=250000, shares=10, usd_based=True, rate=40.0))
+        assert (delta["usd_exposed"], delta["usd_exposed_usd"]) == (250000, 6250.0)
+
+    def test_remove_cancels_add(self):
+        l = lot(usd_based=True, rate=40.0)
+        assert all(v == 0 for v in combine([lot_delta(l), lot_delta(l, -1)]).values())
+
+    def test_partial_sale_keeps_position(self):
+        delta = position_delta("p1", -25000, -1, -1750.0, 0)
+        assert delta["positions"] == 0 and delta["projects.p1.shares"] == -1
+
+
+class TestSummarize:
+    """Tests for recounting a summary from lots"""
+
+    def test_matches_incremental_updates(self):
+        lots = [lot(), lot("p2", 250000, 10, 20000.0, True, 40.0, "RES 1"), lot(amount=25000, shares=1, monthly_return=1750.0)]
+        counted = summarize(lots)
+        incremental = apply(lot_delta(l) for l in lots)
+        for field in ("total_invested", "total_monthly_return", "total_shares", "positions", "usd_exposed", "usd_exposed_usd"):
+            assert counted[field] == incremental.get(field, 0)
+        assert counted["projects"]["p1"]["shares"] == incremental["projects"]["p1"]["shares"] == 3
+        assert counted["projects"]["p2"]["project_name"] == "RES 1"
+
+    def test_empty(self):
+        assert summarize([]) == {"total_invested": 0, "total_monthly_return": 0, "total_shares": 0, "positions": 0,
+                                 "usd_exposed": 0, "usd_exposed_usd": 0, "projects": {}}
+
+
+class TestPresent:
+    """Tests for the API shape"""
+
+    def test_hides_sold_out_projects_and_rounds(self):
+        summary = apply([lot_delta(lot()), lot_delta(lot("p2", amount=75000, shares=3)), lot_delta(lot(), -1),
+                         position_delta("p2", 0, 0, 0.1 + 0.2, 0)])
+        result = present(summary)
+        assert [p["project_id"] for p in result["projects"]] == ["p2"]
+        assert result["projects"][0]["monthly_return"] == 3500.3
+        assert result["total_invested"] == 75000
+
+    def test_missing_summary(self):
+        assert present(None)["positions"] == 0
+
+
+def make_db():
+    from mongomock_motor import AsyncMongoMockClient
+    return AsyncMongoMockClient()["test"]
+
+
+async def invest(db, user_id, entry, before_delta=None):
+    """The server's write order: mark, insert the lot, apply the delta."""
+    await db.portfolio_summaries.update_one({"_id": user_id}, begin_update(), upsert=True)
+    await db.portfolios.insert_one({"user_id": user_id, "in_summary": True, **entry})
+    if before_delta:
+        await before_delta()
+    await db.portfolio_summaries.update_one({"_id": user_id}, summary_update(lot_delta(entry)), upsert=True)
+
+
+class TestRebuild:
+    """Tests for recounting a summary while lots keep changing"""
+
+    def test_rebuild_during_investment_counts_lot_once(self):
+        db = make_db()
+
+        async def run():
+            await invest(db, "u1", lot())
+            rebuild = None
+
+            async def start_rebuild():
+                nonlocal rebuild
+                # The lot is in portfolios but its delta hasn't landed yet
+                rebuild = asyncio.create_task(rebuild_user(db, "u1", backoff=0.01))
+                await asyncio.sleep(0.03)
+                assert not rebuild.done()
+
+            await invest(db, "u1", lot("p2", amount=25000, shares=1), before_delta=start_rebuild)
+            await rebuild
+            return await db.portfolio_summaries.find_one({"_id": "u1"})
+
+        summary = asyncio.run(run())
+        assert summary["total_invested"] == 75000 and summary["positions"] == 2
+        assert summary["pending"] == 0
+
+    def test_rebuild_repairs_drift(self):
+        db = make_db()
+
+        async def run():
+            await invest(db, "u1", lot())
+            await db.portfolio_summaries.update_one({"_id": "u1"}, {"$inc": {"total_invested": 999}})
+            await rebuild_user(db, "u1")
+            return await db.portfolio_summaries.find_one({"_id": "u1"})
+
+        assert asyncio.run(run())["total_invested"] == 50000
+
+    def test_stale_mark_from_dead_writer_is_ignored(self):
+        db = make_db()
+
+        async def run():
+            await db.portfolios.insert_one({"user_id": "u1", **lot()})
+            started = datetime.now(timezone.utc) - timedelta(seconds=PENDING_TIMEOUT_SECONDS + 1)
+            await db.portfolio_summaries.insert_one({"_id": "u1", "version": 3, "pending": 1, "pending_at": started})
+            return await rebuild_user(db, "u1", attempts=1)
+
+        doc = asyncio.run(run())
+        assert doc["total_invested"] == 50000 and doc["pending"] == 0 and doc["version"] == 4
+
+    def test_gives_up_while_change_stays_pending(self):
+        db = make_db()
+
+        async def run():
+            await db.portfolio_summaries.update_one({"_id": "u1"}, begin_update(), upsert=True)
+            await rebuild_user(db, "u1", attempts=2, backoff=0.01)
+
+        with pytest.raises(RuntimeError):
+            asyncio.run(run())
@@ -0,0 +1,112 @@
+"""
+Alarko Enerji - DB tracing unit tests
+Tests request-scoped round-trip accounting in the pymongo command listener
+"""
+import asyncio
+import contextvars
+from types import SimpleNamespace
+
+import tracing
+from tracing import DBTraceMiddleware, RequestTrace, TraceCommandListener
+
+
+def _event(request_id, command_name="find", duration_micros=0, command=None):
+    return SimpleNamespace(request_id=request_id, command_name=command_name, database_name="test",
+                           command=command or {command_name: "users"}, duration_micros=duration_micros)
+
+
+def _run_in_trace(fn):
+    ctx = contextvars.copy_context()
+    trace = RequestTrace()
+    ctx.run(tracing._current_trace.set, trace)
+    ctx.run(fn)
+    return trace
+
+
+class TestTraceCommandListener:
+    """Tests for per-request round-trip counting"""
+
+    def test_counts_round_trips_and_db_time(self):
+        """Every finished command adds a round trip and its duration"""
+        listener = TraceCommandListener(slow_command_ms=0)
+
+        def work():
+            for i in range(3):
+                listener.started(_event(i))
+                listener.succeeded(_event(i, duration_micros=1500))
+            listener.started(_event(9))
+            listener.failed(_event(9, duration_micros=500))
+
+        trace = _run_in_trace(work)
+        assert trace.round_trips == 4
+        assert trace.db_ms == 5.0
+        assert trace.slow == []
+
+    def test_captures_only_slow_explainable_commands(self):
+        """Commands above the limit are kept for explain(), inserts are not"""
+        listener = TraceCommandListener(slow_command_ms=100)
+
+        def work():
+            listener.started(_event(1, command={"find": "portfolios", "filter": {"user_id": "u"}}))
+            listener.succeeded(_event(1, duration_micros=250000))
+            listener.started(_event(2, command={"find": "users"}))
+            listener.succeeded(_event(2, duration_micros=1000))
+            listener.started(_event(3, command_name="insert", command={"insert": "users"}))
+            listener.succeeded(_event(3, command_name="insert", duration_micros=300000))
+
+        trace = _run_in_trace(work)
+        assert [(s[1], s[2]["find"]) for s in trace.slow] == [("find", "portfolios")]
+        assert trace.pending == {}
+
+    def test_ignores_commands_outside_a_request(self):
+        """Background commands without a trace are not counted anywhere"""
+        listener = TraceCommandListener(slow_command_ms=100)
+        listener.started(_event(1))
+        listener.succeeded(_event(1, duration_micros=999999))
+        assert tracing.current_trace() is None
+
+
+class _Database:
+    def __init__(self, fail):
+        self.fail = fail
+        self.slow_queries = SimpleNamespace(insert_one=self._insert)
+        self.stored = []
+
+    async def command(self, command):
+        await asyncio.sleep(0)
+        if self.fail:
+            raise RuntimeError("explain not allowed")
+        return {"queryPlanner": {"winningPlan": {"stage": "COLLSCAN"}}}
+
+    async def _insert(self, doc):
+        self.stored.append(doc)
+
+
+class TestExplainTasks:
+    """Tests for the background explain() of slow requests"""
+
+    def _request(self, database):
+        async def app(scope, receive, send):
+            tracing.current_trace().slow.append(("test", "find", {"find": "portfolios", "filter": {"user_id": "u"}}, 250.0))
+
+        middleware = DBTraceMiddleware(app, {"test": database})
+
+        async def run():
+            await middleware({"type": "http", "method": "GET"}, None, None)
+            # Held until it finishes, then dropped
+            assert len(middleware._explaining) == 1
+            await asyncio.gather(*middleware._explaining)
+            await asyncio.sleep(0)
+            return middleware
+        return asyncio.run(run())
+
+    def test_task_is_kept_until_done(self):
+        database = _Database(fail=False)
+        middleware = self._request(database)
+        assert middleware._explaining == set()
+        assert database.stored[0]["plan_stages"] == ["COLLSCAN"]
+
+    def test_failed_explain_is_logged_not_stored(self):
+        database = _Database(fail=True)
+        middleware = self._request(database)
+        assert middleware._explaining == set() and database.stored == []
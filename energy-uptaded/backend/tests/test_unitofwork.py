@@ -0,0 +1,59 @@
+"""
+Alarko Enerji - Unit of work tests
+Tests concurrent stages, stage ordering, failure handling and timings
+"""
+import asyncio
+import time
+
+import pytest
+
+from unitofwork import UnitOfWork
+
+
+async def sleep_and_record(log, name, delay):
+    log.append(("start", name))
+    await asyncio.sleep(delay)
+    log.append(("end", name))
+    return name
+
+
+class TestUnitOfWork:
+    """Tests for the stage runner used by multi-write handlers"""
+
+    def test_steps_in_a_stage_run_concurrently(self):
+        log = []
+        uow = UnitOfWork("test").add("a", sleep_and_record, log, "a", 0.05).add("b", sleep_and_record, log, "b", 0.05)
+        start = time.perf_counter()
+        results = asyncio.run(uow.run())
+        assert time.perf_counter() - start < 0.09
+        assert results == {"a": "a", "b": "b"}
+        assert set(uow.timings) == {"a", "b"}
+
+    def test_next_stage_waits_for_previous(self):
+        log = []
+        uow = UnitOfWork("test").add("a", sleep_and_record, log, "a", 0.02).then().add("b", sleep_and_record, log, "b", 0)
+        asyncio.run(uow.run())
+        assert log.index(("end", "a")) < log.index(("start", "b"))
+
+    def test_failure_stops_later_stages(self):
+        log = []
+
+        async def fail():
+            raise RuntimeError("boom")
+
+        uow = UnitOfWork("test").add("bad", fail).add("ok", sleep_and_record, log, "ok", 0.01).then().add("later", sleep_and_record, log, "later", 0)
+        with pytest.raises(RuntimeError):
+            asyncio.run(uow.run())
+        # The sibling in the failing stage still finishes; the next stage never starts
+        assert ("end", "ok") in log
+        assert ("start", "later") not in log
+
+    def test_step_runs_immediately(self):
+        async def run():
+            uow = UnitOfWork("test")
+            value = await uow.step("lookup", asyncio.sleep, 0, result=42)
+            return value, uow.timings
+
+        value, timings = asyncio.run(run())
+        assert value == 42
+        assert "lookup" in timings
@@ -0,0 +1,158 @@
+"""Request-scoped MongoDB round-trip accounting and slow-query capture.
+
+The middleware puts a ``RequestTrace`` in a context variable; Motor copies the
+context into its executor threads, so the pymongo listener can attribute each
+command to the request that issued it.
+"""
+import asyncio
+import contextvars
+import logging
+import time
+from datetime import datetime, timezone
+
+from bson import json_util
+from pymongo import monitoring
+
+from metrics import command_collection, route_label
+
+logger = logging.getLogger(__name__)
+
+_current_trace = contextvars.ContextVar("db_trace", default=None)
+
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct", "update", "delete", "findAndModify"}
+# Driver/session fields that explain() rejects or that make no sense to store
+_DRIVER_FIELDS = {"lsid", "$db", "$clusterTime", "$readPreference", "txnNumber", "readConcern", "writeConcern", "autocommit", "startTransaction"}
+# Don't re-explain the same query shape more often than this
+EXPLAIN_COOLDOWN_SECONDS = 600
+
+
+class RequestTrace:
+    __slots__ = ("round_trips", "db_micros", "pending", "slow")
+
+    def __init__(self):
+        self.round_trips = 0
+        self.db_micros = 0
+        self.pending = {}
+        self.slow = []
+
+    @property
+    def db_ms(self) -> float:
+        return self.db_micros / 1000
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+class TraceCommandListener(monitoring.CommandListener):
+    def __init__(self, slow_command_ms: float = 0):
+        self.slow_command_micros = slow_command_ms * 1000
+
+    def started(self, event):
+        trace = _current_trace.get()
+        if trace is not None and self.slow_command_micros and event.command_name in EXPLAINABLE_COMMANDS:
+            trace.pending[event.request_id] = (event.database_name, event.command_name, dict(event.command))
+
+    def succeeded(self, event):
+        trace = _current_trace.get()
+        if trace is None:
+            return
+        trace.round_trips += 1
+        trace.db_micros += event.duration_micros
+        pending = trace.pending.pop(event.request_id, None)
+        if pending and event.duration_micros >= self.slow_command_micros:
+            trace.slow.append(pending + (event.duration_micros / 1000,))
+
+    def failed(self, event):
+        trace = _current_trace.get()
+        if trace is None:
+            return
+        trace.round_trips += 1
+        trace.db_micros += event.duration_micros
+        trace.pending.pop(event.request_id, None)
+
+
+def _query_shape(value):
+    if isinstance(value, dict):
+        return tuple(sorted((k, _query_shape(v)) for k, v in value.items()))
+    if isinstance(value, list):
+        return tuple(_query_shape(v) for v in value[:1])
+    return None
+
+
+def _plan_stages(plan) -> list:
+    stages = []
+    while isinstance(plan, dict):
+        if plan.get("stage"):
+            stages.append(plan["stage"])
+        plan = plan.get("inputStage") or (plan.get("inputStages") or [None])[0]
+    return stages
+
+
+class DBTraceMiddleware:
+    def __init__(self, app, client, header: bool = False, max_round_trips: int = 0, max_db_ms: float = 0):
+        self.app = app
+        self.client = client
+        self.header = header
+        self.max_round_trips = max_round_trips
+        self.max_db_ms = max_db_ms
+        self._explained = {}
+        # Running explain tasks; the loop only keeps weak references to tasks
+        self._explaining = set()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trace = RequestTrace()
+        token = _current_trace.set(trace)
+
+        async def send_wrapper(message):
+            if self.header and message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [
+                    (b"x-db-trace", f"rt={trace.round_trips};db_ms={trace.db_ms:.1f}".encode())
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current_trace.reset(token)
+            route = route_label(scope)
+            if (self.max_round_trips and trace.round_trips > self.max_round_trips) or (self.max_db_ms and trace.db_ms > self.max_db_ms):
+                logger.warning(f"Yavas istek: {scope['method']} {route} rt={trace.round_trips} db_ms={trace.db_ms:.1f}")
+            if trace.slow:
+                task = asyncio.get_running_loop().create_task(self._explain_slow(route, trace.slow))
+                self._explaining.add(task)
+                task.add_done_callback(self._explain_done)
+
+    def _explain_done(self, task):
+        self._explaining.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.warning(f"Yavas sorgu analizi basarisiz: {task.exception()}")
+
+    async def _explain_slow(self, route: str, slow: list):
+        now = time.monotonic()
+        for database, command_name, command, duration_ms in slow:
+            collection = command_collection(command_name, command)
+            shape = (collection, command_name, _query_shape(command.get("filter") or command.get("query") or command.get("pipeline") or command.get("updates")))
+            if now - self._explained.get(shape, -EXPLAIN_COOLDOWN_SECONDS) < EXPLAIN_COOLDOWN_SECONDS:
+                continue
+            self._explained[shape] = now
+            command = {k: v for k, v in command.items() if k not in _DRIVER_FIELDS}
+            try:
+                explain = await self.client[database].command({"explain": command, "verbosity": "queryPlanner"})
+                plan = explain.get("queryPlanner", {}).get("winningPlan", {})
+                stages = _plan_stages(plan.get("queryPlan", plan))
+                logger.warning(f"Yavas sorgu: {route} {collection}.{command_name} {duration_ms:.1f}ms plan={'>'.join(stages)}")
+                await self.client[database].slow_queries.insert_one({
+                    "route": route, "collection": collection, "command_name": command_name,
+                    "duration_ms": round(duration_ms, 2), "plan_stages": stages,
+                    # Stored as JSON text: query operators are not valid field names on older servers
+                    "command": json_util.dumps(command)[:4000],
+                    "explain": json_util.dumps(explain.get("queryPlanner", {}))[:16000],
+                    "created_at": datetime.now(timezone.utc)
+                })
+            except Exception as e:
+                logger.warning(f"Explain alinamadi ({collection}.{command_name}): {e}")
@@ -0,0 +1,69 @@
+"""Run a handler's writes as ordered stages of concurrent steps.
+
+Steps added between two ``then()`` calls don't depend on each other and run
+together with ``asyncio.gather``; a stage starts only after the previous one
+has finished. A step whose result decides what happens next (a lookup, a
+conditional claim) is awaited on its own with ``step()``. Every step's
+duration is recorded, next to the wall time of the whole unit and the time the
+same steps would have taken back to back.
+"""
+import asyncio
+import logging
+import time
+
+from metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+UOW_STEP_LATENCY = Histogram("unit_of_work_step_seconds", "Duration of each unit-of-work step", ("unit", "step"))
+UOW_LATENCY = Histogram("unit_of_work_seconds", "Wall time of a unit of work", ("unit",))
+UOW_SERIAL_LATENCY = Histogram("unit_of_work_serial_seconds", "Sum of step durations, i.e. the unit run one step at a time", ("unit",))
+
+
+class UnitOfWork:
+    def __init__(self, name: str):
+        self.name = name
+        self._stages = [[]]
+        self.timings = {}
+        self._start = time.perf_counter()
+
+    async def step(self, step: str, fn, *args, **kwargs):
+        """Run one step now and return its result."""
+        return await self._timed(step, fn, args, kwargs)
+
+    def add(self, step: str, fn, *args, **kwargs):
+        """Queue ``fn(*args, **kwargs)`` in the current stage; it is not called until ``run()``."""
+        self._stages[-1].append((step, fn, args, kwargs))
+        return self
+
+    def then(self):
+        """Start a new stage that runs after everything queued so far."""
+        if self._stages[-1]:
+            self._stages.append([])
+        return self
+
+    async def _timed(self, step: str, fn, args, kwargs):
+        start = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[step] = elapsed
+            UOW_STEP_LATENCY.observe(elapsed, self.name, step)
+
+    async def run(self) -> dict:
+        """Run every queued stage once; returns ``{step: result}``. The first failure stops later stages."""
+        results = {}
+        try:
+            for stage in self._stages:
+                # Let the whole stage settle before raising so no write is left running unobserved
+                outcomes = await asyncio.gather(*(self._timed(*s) for s in stage), return_exceptions=True)
+                for (step, *_), outcome in zip(stage, outcomes):
+                    if isinstance(outcome, BaseException):
+                        logger.warning(f"Islem adimi basarisiz: {self.name}.{step}: {outcome!r}")
+                        raise outcome
+                    results[step] = outcome
+            return results
+        finally:
+            UOW_LATENCY.observe(time.perf_counter() - self._start, self.name)
+            UOW_SERIAL_LATENCY.observe(sum(self.timings.values()), self.name)
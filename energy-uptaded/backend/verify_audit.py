@@ -0,0 +1,51 @@
+"""Check the integrity of the admin audit log straight from MongoDB.
+
+Streams every chain in ``audit_log`` in sequence order, recomputes each hash
+and link, and compares the end of the chain with ``audit_chains``:
+
+    python verify_audit.py            # all chains
+    python verify_audit.py --chain <worker id>
+
+Uses ``MONGO_URL``, ``DB_NAME`` and ``AUDIT_CHAIN_KEY`` from the environment
+(or ``backend/.env``). Exits with status 1 if any chain fails.
+"""
+import argparse
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from audit import verify_all, verify_chain
+
+
+async def run(chain: str) -> bool:
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True)
+    db = client[os.environ['DB_NAME']]
+    key = os.environ.get('AUDIT_CHAIN_KEY', '').encode()
+    try:
+        if chain:
+            results = [await verify_chain(db.audit_log, chain, key, await db.audit_chains.find_one({"_id": chain}))]
+        else:
+            results = await verify_all(db.audit_log, db.audit_chains, key)
+    finally:
+        client.close()
+    for r in results:
+        status = "OK" if r['ok'] else f"HATA {r['error']} (seq {r['seq']})"
+        print(f"{r['chain']:48} {r['entries']:>8} kayit  {status}")
+    print(f"{len(results)} zincir, {sum(r['entries'] for r in results)} kayit")
+    return all(r['ok'] for r in results)
+
+
+def main():
+    load_dotenv(Path(__file__).parent / '.env')
+    parser = argparse.ArgumentParser(description="Denetim kaydi zincirlerinin butunlugunu dogrular")
+    parser.add_argument("--chain", default="", help="Yalnizca bu zinciri dogrula (worker kimligi)")
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args.chain)) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,7 +10,7 @@ import axios from 'axios';
 
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
 
-export default function Navbar({ transparent = false }) {
+export default function Navbar({ transparent = false, unreadCount: providedUnreadCount }) {
   const { user, token, logout } = useAuth();
   const [scrolled, setScrolled] = useState(false);
   const [unreadCount, setUnreadCount] = useState(0);
@@ -25,12 +25,17 @@ export default function Navbar({ transparent = false }) {
   }, []);
 
   useEffect(() => {
+    // Pages that already loaded the count (e.g. the dashboard) pass it in
+    if (providedUnreadCount !== undefined) {
+      setUnreadCount(providedUnreadCount);
+      return;
+    }
     if (token) {
       axios.get(`${API}/notifications`, { headers: { Authorization: `Bearer ${token}` } })
         .then(res => setUnreadCount(res.data.unread_count))
         .catch(() => {});
     }
-  }, [token, location.pathname]);
+  }, [token, location.pathname, providedUnreadCount]);
 
   const handleLogout = () => { logout(); navigate('/'); };
 
@@ -0,0 +1,24 @@
+import axios from 'axios';
+
+const RETRY_DELAYS_MS = [300, 1000, 2500];
+
+function newKey() {
+  if (window.crypto?.randomUUID) return window.crypto.randomUUID();
+  return `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+}
+
+// Money-moving POST: one Idempotency-Key per user action, reused on every retry,
+// so a retry after a dropped response replays the first result instead of repeating it
+export async function postIdempotent(url, data, config = {}) {
+  const headers = { ...config.headers, 'Idempotency-Key': newKey() };
+  for (let attempt = 0; ; attempt++) {
+    try {
+      return await axios.post(url, data, { ...config, headers });
+    } catch (err) {
+      const status = err.response?.status;
+      const retryable = !err.response || status >= 500 || status === 409;
+      if (!retryable || attempt >= RETRY_DELAYS_MS.length) throw err;
+      await new Promise((resolve) => setTimeout(resolve, RETRY_DELAYS_MS[attempt]));
+    }
+  }
+}
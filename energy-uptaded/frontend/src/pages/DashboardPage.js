@@ -9,6 +9,7 @@ import { Wallet, TrendingUp, Briefcase, ArrowUpRight, ArrowDownRight, Plus, Minu
 import { PieChart, Pie, Cell, BarChart, Bar, XAxis, YAxis, Tooltip, ResponsiveContainer, Legend, CartesianGrid } from 'recharts';
 import { toast } from 'sonner';
 import axios from 'axios';
+import { postIdempotent } from '@/lib/idempotent';
 
 const COLORS = ['#10B981', '#3B82F6', '#F59E0B', '#8B5CF6', '#EF4444', '#EC4899'];
 
@@ -16,26 +17,28 @@ export default function DashboardPage() {
   const { user, token, refreshUser, API } = useAuth();
   const [portfolio, setPortfolio] = useState(null);
   const [transactions, setTransactions] = useState([]);
+  const [unreadCount, setUnreadCount] = useState(undefined);
   const [loading, setLoading] = useState(true);
   const headers = { Authorization: `Bearer ${token}` };
 
   useEffect(() => {
-    Promise.all([
-      axios.get(`${API}/portfolio`, { headers }),
-      axios.get(`${API}/transactions`, { headers })
-    ]).then(([pRes, tRes]) => {
-      setPortfolio(pRes.data);
-      setTransactions(tRes.data.slice(0, 5));
-    }).catch(() => toast.error('Veri yuklenemedi'))
+    axios.get(`${API}/dashboard`, { headers })
+      .then(res => {
+        setPortfolio(res.data.portfolio);
+        setTransactions(res.data.recent_transactions);
+        setUnreadCount(res.data.unread_count);
+      }).catch(() => toast.error('Veri yuklenemedi'))
       .finally(() => setLoading(false));
   }, []);
 
   const handleSell = async (portfolioId) => {
     try {
-      await axios.post(`${API}/portfolio/sell`, { portfolio_id: portfolioId }, { headers });
+      await postIdempotent(`${API}/portfolio/sell`, { portfolio_id: portfolioId }, { headers });
       toast.success('Yatirim satildi');
-      const pRes = await axios.get(`${API}/portfolio`, { headers });
-      setPortfolio(pRes.data);
+      const res = await axios.get(`${API}/dashboard`, { headers });
+      setPortfolio(res.data.portfolio);
+      setTransactions(res.data.recent_transactions);
+      setUnreadCount(res.data.unread_count);
       refreshUser();
     } catch (err) {
       toast.error(err.response?.data?.detail || 'Hata');
@@ -70,7 +73,7 @@ export default function DashboardPage() {
 
   return (
     <div className="min-h-screen bg-slate-50" data-testid="dashboard-page">
-      <Navbar />
+      <Navbar unreadCount={unreadCount} />
       <div className="max-w-7xl mx-auto px-4 md:px-8 pt-24 pb-12">
         <div className="mb-8">
           <h1 className="text-2xl md:text-3xl font-bold text-slate-900 font-[Poppins]">Hos Geldiniz, {user?.name}</h1>
@@ -94,7 +97,7 @@ export default function DashboardPage() {
         <div className="grid md:grid-cols-4 gap-5 mb-8">
           {[
             { icon: Wallet, label: 'Bakiye', value: `₺${(user?.balance || 0).toLocaleString('tr-TR')}`, color: 'bg-emerald-500/10 text-emerald-600', sub: 'Kullanilabilir' },
-            { icon: Briefcase, label: 'Toplam Yatirim', value: `₺${(portfolio?.total_invested || 0).toLocaleString('tr-TR')}`, color: 'bg-sky-500/10 text-sky-600', sub: `${portfolio?.investments?.length || 0} proje` },
+            { icon: Briefcase, label: 'Toplam Yatirim', value: `₺${(portfolio?.total_invested || 0).toLocaleString('tr-TR')}`, color: 'bg-sky-500/10 text-sky-600', sub: `${portfolio?.projects?.length ?? portfolio?.investments?.length ?? 0} proje` },
             { icon: TrendingUp, label: 'Aylik Getiri', value: `₺${(portfolio?.total_monthly_return || 0).toLocaleString('tr-TR')}`, color: 'bg-violet-500/10 text-violet-600', sub: 'Tahmini' },
             { icon: PieIcon, label: 'Yillik Getiri', value: `₺${((portfolio?.total_monthly_return || 0) * 12).toLocaleString('tr-TR')}`, color: 'bg-amber-500/10 text-amber-600', sub: '12 aylik projeksiyon' },
           ].map((s, i) => (
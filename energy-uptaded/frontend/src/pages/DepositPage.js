@@ -10,6 +10,7 @@ import { Landmark, Copy, CheckCircle2, ArrowLeft } from 'lucide-react';
 import { toast } from 'sonner';
 import { Link } from 'react-router-dom';
 import axios from 'axios';
+import { postIdempotent } from '@/lib/idempotent';
 
 export default function DepositPage() {
   const { token, API, refreshUser } = useAuth();
@@ -33,7 +34,7 @@ export default function DepositPage() {
     if (!selectedBank) { toast.error('Banka secin'); return; }
     setLoading(true);
     try {
-      await axios.post(`${API}/transactions`, { amount: parseFloat(amount), bank_id: selectedBank.bank_id, type: 'deposit' }, { headers });
+      await postIdempotent(`${API}/transactions`, { amount: parseFloat(amount), bank_id: selectedBank.bank_id, type: 'deposit' }, { headers });
       toast.success('Yatirma talebi olusturuldu. Havale yaptiktan sonra admin onayi bekleniyor.');
       setAmount('');
       setSelectedBank(null);
@@ -12,6 +12,7 @@ import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from
 import { Sun, Wind, MapPin, Users, TrendingUp, Zap, ArrowLeft, Wallet, DollarSign } from 'lucide-react';
 import { toast } from 'sonner';
 import axios from 'axios';
+import { postIdempotent } from '@/lib/idempotent';
 
 export default function ProjectDetailPage() {
   const { id } = useParams();
@@ -39,7 +40,7 @@ export default function ProjectDetailPage() {
     if (!user) { navigate('/login'); return; }
     setInvesting(true);
     try {
-      await axios.post(`${API}/portfolio/invest`, { project_id: id, amount: investAmount }, { headers: { Authorization: `Bearer ${token}` } });
+      await postIdempotent(`${API}/portfolio/invest`, { project_id: id, amount: investAmount }, { headers: { Authorization: `Bearer ${token}` } });
       toast.success('Yatirim basarili!');
       setDialogOpen(false);
       refreshUser();
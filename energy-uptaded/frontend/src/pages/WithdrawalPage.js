@@ -7,7 +7,7 @@ import { Button } from '@/components/ui/button';
 import { Input } from '@/components/ui/input';
 import { ArrowLeft, Wallet, AlertTriangle } from 'lucide-react';
 import { toast } from 'sonner';
-import axios from 'axios';
+import { postIdempotent } from '@/lib/idempotent';
 
 export default function WithdrawalPage() {
   const { user, token, API, refreshUser } = useAuth();
@@ -21,7 +21,7 @@ export default function WithdrawalPage() {
     if (val > (user?.balance || 0)) { toast.error('Yetersiz bakiye'); return; }
     setLoading(true);
     try {
-      await axios.post(`${API}/transactions`, { amount: val, type: 'withdrawal' }, { headers });
+      await postIdempotent(`${API}/transactions`, { amount: val, type: 'withdrawal' }, { headers });
       toast.success('Cekme talebi olusturuldu. Admin onayi bekleniyor.');
       setAmount('');
     } catch (err) {
@@ -4,6 +4,7 @@ import AdminLayout from '@/components/AdminLayout';
 import { Card, CardContent } from '@/components/ui/card';
 import { Badge } from '@/components/ui/badge';
 import { Button } from '@/components/ui/button';
+import { Checkbox } from '@/components/ui/checkbox';
 import { Table, TableBody, TableCell, TableHead, TableHeader, TableRow } from '@/components/ui/table';
 import { Dialog, DialogContent, DialogHeader, DialogTitle } from '@/components/ui/dialog';
 import { Shield, CheckCircle2, XCircle, Eye } from 'lucide-react';
@@ -17,9 +18,12 @@ export default function AdminKYC() {
   const [kycList, setKycList] = useState([]);
   const [selected, setSelected] = useState(null);
   const [loading, setLoading] = useState(false);
+  const [checked, setChecked] = useState([]);
   const headers = { Authorization: `Bearer ${token}` };
 
   const fetchKYC = () => axios.get(`${API}/admin/kyc`, { headers }).then(r => setKycList(r.data));
+  const pendingIds = kycList.filter(k => k.status === 'pending').map(k => k.kyc_id);
+  const toggle = (id) => setChecked(c => c.includes(id) ? c.filter(x => x !== id) : [...c, id]);
   useEffect(() => { fetchKYC(); }, []);
 
   const handleAction = async (kycId, action) => {
@@ -36,6 +40,22 @@ export default function AdminKYC() {
     }
   };
 
+  const handleBulk = async (status) => {
+    setLoading(true);
+    try {
+      const r = await axios.post(`${API}/admin/kyc/bulk`, { kyc_ids: checked, status }, { headers });
+      const done = r.data.summary[status] || 0;
+      const skipped = checked.length - done;
+      toast.success(`${done} basvuru ${status === 'approved' ? 'onaylandi' : 'reddedildi'}${skipped ? `, ${skipped} basvuru atlandi` : ''}`);
+      setChecked([]);
+      fetchKYC();
+    } catch (err) {
+      toast.error('Hata');
+    } finally {
+      setLoading(false);
+    }
+  };
+
   const statusBadge = (status) => {
     const m = { pending: 'bg-amber-100 text-amber-700', approved: 'bg-emerald-100 text-emerald-700', rejected: 'bg-red-100 text-red-700' };
     const l = { pending: 'Bekliyor', approved: 'Onaylandi', rejected: 'Reddedildi' };
@@ -48,10 +68,30 @@ export default function AdminKYC() {
         <h1 className="text-2xl font-bold text-slate-900 font-[Poppins] mb-2">Kimlik Dogrulama</h1>
         <p className="text-slate-500 mb-6 text-sm">Yatirimci kimlik belgelerini inceleyin ve onaylayin.</p>
 
+        {checked.length > 0 && (
+          <div className="flex items-center gap-3 mb-4" data-testid="kyc-bulk-bar">
+            <span className="text-sm text-slate-600">{checked.length} basvuru secildi</span>
+            <Button size="sm" className="bg-emerald-500 hover:bg-emerald-600 text-white" onClick={() => handleBulk('approved')} disabled={loading} data-testid="kyc-bulk-approve">
+              <CheckCircle2 className="w-4 h-4 mr-1" /> Secilenleri Onayla
+            </Button>
+            <Button size="sm" variant="destructive" onClick={() => handleBulk('rejected')} disabled={loading} data-testid="kyc-bulk-reject">
+              <XCircle className="w-4 h-4 mr-1" /> Secilenleri Reddet
+            </Button>
+          </div>
+        )}
+
         <Card className="border-0 shadow-sm rounded-2xl overflow-hidden">
           <Table>
             <TableHeader>
               <TableRow className="bg-slate-50">
+                <TableHead className="w-10">
+                  <Checkbox
+                    checked={pendingIds.length > 0 && pendingIds.every(id => checked.includes(id))}
+                    onCheckedChange={(v) => setChecked(v ? pendingIds : [])}
+                    disabled={pendingIds.length === 0}
+                    data-testid="kyc-select-all"
+                  />
+                </TableHead>
                 <TableHead>Kullanici</TableHead>
                 <TableHead>E-posta</TableHead>
                 <TableHead>Durum</TableHead>
@@ -62,6 +102,11 @@ export default function AdminKYC() {
             <TableBody>
               {kycList.map(k => (
                 <TableRow key={k.kyc_id} data-testid={`kyc-row-${k.kyc_id}`}>
+                  <TableCell>
+                    {k.status === 'pending' && (
+                      <Checkbox checked={checked.includes(k.kyc_id)} onCheckedChange={() => toggle(k.kyc_id)} data-testid={`kyc-select-${k.kyc_id}`} />
+                    )}
+                  </TableCell>
                   <TableCell className="font-medium">{k.user_name}</TableCell>
                   <TableCell className="text-sm text-slate-500">{k.user_email}</TableCell>
                   <TableCell>{statusBadge(k.status)}</TableCell>
@@ -74,7 +119,7 @@ export default function AdminKYC() {
                 </TableRow>
               ))}
               {kycList.length === 0 && (
-                <TableRow><TableCell colSpan={5} className="text-center py-8 text-slate-400">Bekleyen KYC basvurusu yok</TableCell></TableRow>
+                <TableRow><TableCell colSpan={6} className="text-center py-8 text-slate-400">Bekleyen KYC basvurusu yok</TableCell></TableRow>
               )}
             </TableBody>
           </Table>
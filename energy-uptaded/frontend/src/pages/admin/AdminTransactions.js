@@ -4,6 +4,7 @@ import AdminLayout from '@/components/AdminLayout';
 import { Card } from '@/components/ui/card';
 import { Badge } from '@/components/ui/badge';
 import { Button } from '@/components/ui/button';
+import { Checkbox } from '@/components/ui/checkbox';
 import { Table, TableBody, TableCell, TableHead, TableHeader, TableRow } from '@/components/ui/table';
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '@/components/ui/select';
 import { CheckCircle2, XCircle, Clock } from 'lucide-react';
@@ -14,12 +15,16 @@ export default function AdminTransactions() {
   const { token, API } = useAuth();
   const [txns, setTxns] = useState([]);
   const [filter, setFilter] = useState('all');
+  const [checked, setChecked] = useState([]);
+  const [bulkLoading, setBulkLoading] = useState(false);
   const headers = { Authorization: `Bearer ${token}` };
 
   const fetchTxns = () => axios.get(`${API}/admin/transactions`, { headers }).then(r => setTxns(r.data));
   useEffect(() => { fetchTxns(); }, []);
 
   const filtered = filter === 'all' ? txns : txns.filter(t => t.status === filter);
+  const pendingIds = filtered.filter(t => t.status === 'pending').map(t => t.transaction_id);
+  const toggle = (id) => setChecked(c => c.includes(id) ? c.filter(x => x !== id) : [...c, id]);
 
   const handleStatus = async (txnId, status) => {
     try {
@@ -31,6 +36,24 @@ export default function AdminTransactions() {
     }
   };
 
+  const handleBulk = async (status) => {
+    setBulkLoading(true);
+    try {
+      const r = await axios.post(`${API}/admin/transactions/bulk`, { transaction_ids: checked, status }, { headers });
+      const { summary } = r.data;
+      const done = summary[status] || 0;
+      const skipped = checked.length - done;
+      toast.success(`${done} islem guncellendi${skipped ? `, ${skipped} islem atlandi` : ''}`);
+      if (summary.insufficient_balance) toast.error(`${summary.insufficient_balance} cekme talebi yetersiz bakiye nedeniyle reddedildi`);
+      setChecked([]);
+      fetchTxns();
+    } catch (err) {
+      toast.error('Hata');
+    } finally {
+      setBulkLoading(false);
+    }
+  };
+
   const statusBadge = (s) => {
     const m = { pending: 'bg-amber-100 text-amber-700', approved: 'bg-emerald-100 text-emerald-700', rejected: 'bg-red-100 text-red-700' };
     const l = { pending: 'Bekliyor', approved: 'Onaylandi', rejected: 'Reddedildi' };
@@ -58,10 +81,30 @@ export default function AdminTransactions() {
           </Select>
         </div>
 
+        {checked.length > 0 && (
+          <div className="flex items-center gap-3 mb-4" data-testid="txn-bulk-bar">
+            <span className="text-sm text-slate-600">{checked.length} islem secildi</span>
+            <Button size="sm" className="bg-emerald-500 hover:bg-emerald-600 text-white" onClick={() => handleBulk('approved')} disabled={bulkLoading} data-testid="txn-bulk-approve">
+              <CheckCircle2 className="w-4 h-4 mr-1" /> Secilenleri Onayla
+            </Button>
+            <Button size="sm" variant="destructive" onClick={() => handleBulk('rejected')} disabled={bulkLoading} data-testid="txn-bulk-reject">
+              <XCircle className="w-4 h-4 mr-1" /> Secilenleri Reddet
+            </Button>
+          </div>
+        )}
+
         <Card className="border-0 shadow-sm rounded-2xl overflow-hidden">
           <Table>
             <TableHeader>
               <TableRow className="bg-slate-50">
+                <TableHead className="w-10">
+                  <Checkbox
+                    checked={pendingIds.length > 0 && pendingIds.every(id => checked.includes(id))}
+                    onCheckedChange={(v) => setChecked(v ? pendingIds : [])}
+                    disabled={pendingIds.length === 0}
+                    data-testid="txn-select-all"
+                  />
+                </TableHead>
                 <TableHead>Kullanici</TableHead>
                 <TableHead>Tip</TableHead>
                 <TableHead>Tutar</TableHead>
@@ -73,6 +116,11 @@ export default function AdminTransactions() {
             <TableBody>
               {filtered.map(t => (
                 <TableRow key={t.transaction_id} data-testid={`txn-row-${t.transaction_id}`}>
+                  <TableCell>
+                    {t.status === 'pending' && (
+                      <Checkbox checked={checked.includes(t.transaction_id)} onCheckedChange={() => toggle(t.transaction_id)} data-testid={`txn-select-${t.transaction_id}`} />
+                    )}
+                  </TableCell>
                   <TableCell className="font-medium text-sm">{t.user_name || '-'}</TableCell>
                   <TableCell>
                     <Badge className={t.type === 'deposit' ? 'bg-emerald-100 text-emerald-700' : 'bg-red-100 text-red-700'}>
@@ -97,7 +145,7 @@ export default function AdminTransactions() {
                 </TableRow>
               ))}
               {filtered.length === 0 && (
-                <TableRow><TableCell colSpan={6} className="text-center py-8 text-slate-400">Islem yok</TableCell></TableRow>
+                <TableRow><TableCell colSpan={7} className="text-center py-8 text-slate-400">Islem yok</TableCell></TableRow>
               )}
             </TableBody>
           </Table>
@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { useAuth } from '@/context/AuthContext';
 import AdminLayout from '@/components/AdminLayout';
 import { Card } from '@/components/ui/card';
@@ -17,6 +17,11 @@ export default function AdminUsers() {
   const { token, API } = useAuth();
   const [users, setUsers] = useState([]);
   const [search, setSearch] = useState('');
+  const [roleFilter, setRoleFilter] = useState('all');
+  const [kycFilter, setKycFilter] = useState('all');
+  const [sort, setSort] = useState('created_at:desc');
+  const [nextCursor, setNextCursor] = useState(null);
+  const requestId = useRef(0);
   const [balanceUser, setBalanceUser] = useState(null);
   const [balanceAmount, setBalanceAmount] = useState('');
   const [balanceType, setBalanceType] = useState('add');
@@ -25,10 +30,24 @@ export default function AdminUsers() {
   const [loading, setLoading] = useState(false);
   const headers = { Authorization: `Bearer ${token}` };
 
-  const fetchUsers = () => axios.get(`${API}/admin/users`, { headers }).then(r => setUsers(r.data));
-  useEffect(() => { fetchUsers(); }, []);
+  const fetchUsers = async (cursor = null) => {
+    const [sortField, order] = sort.split(':');
+    const params = { q: search, sort: sortField, order, limit: 50 };
+    if (roleFilter !== 'all') params.role = roleFilter;
+    if (kycFilter !== 'all') params.kyc_status = kycFilter;
+    if (cursor) params.cursor = cursor;
+    // Ignore responses to searches the admin has already typed past
+    const id = ++requestId.current;
+    const r = await axios.get(`${API}/admin/users/search`, { headers, params });
+    if (id !== requestId.current) return;
+    setUsers(prev => cursor ? [...prev, ...r.data.users] : r.data.users);
+    setNextCursor(r.data.next_cursor);
+  };
 
-  const filtered = users.filter(u => u.name?.toLowerCase().includes(search.toLowerCase()) || u.email?.toLowerCase().includes(search.toLowerCase()));
+  useEffect(() => {
+    const timer = setTimeout(() => { fetchUsers(); }, 250);
+    return () => clearTimeout(timer);
+  }, [search, roleFilter, kycFilter, sort]);
 
   const handleBalance = async () => {
     if (!balanceAmount || parseFloat(balanceAmount) <= 0) { toast.error('Gecerli tutar girin'); return; }
@@ -88,11 +107,40 @@ export default function AdminUsers() {
         <div className="flex flex-col md:flex-row justify-between items-start md:items-center gap-4 mb-6">
           <div>
             <h1 className="text-2xl font-bold text-slate-900 font-[Poppins]">Kullanicilar</h1>
-            <p className="text-slate-500 text-sm">{users.length} kayitli kullanici</p>
+            <p className="text-slate-500 text-sm">Ad, e-posta veya telefon ile arayin</p>
           </div>
-          <div className="relative w-full md:w-72">
-            <Search className="absolute left-3 top-1/2 -translate-y-1/2 w-4 h-4 text-slate-400" />
-            <Input placeholder="Kullanici ara..." value={search} onChange={e => setSearch(e.target.value)} className="pl-10" data-testid="admin-user-search" />
+          <div className="flex flex-col md:flex-row gap-2 w-full md:w-auto">
+            <div className="relative w-full md:w-72">
+              <Search className="absolute left-3 top-1/2 -translate-y-1/2 w-4 h-4 text-slate-400" />
+              <Input placeholder="Kullanici ara..." value={search} onChange={e => setSearch(e.target.value)} className="pl-10" data-testid="admin-user-search" />
+            </div>
+            <Select value={roleFilter} onValueChange={setRoleFilter}>
+              <SelectTrigger className="w-full md:w-32" data-testid="admin-user-role-filter"><SelectValue /></SelectTrigger>
+              <SelectContent>
+                <SelectItem value="all">Tum Roller</SelectItem>
+                <SelectItem value="investor">Yatirimci</SelectItem>
+                <SelectItem value="admin">Admin</SelectItem>
+              </SelectContent>
+            </Select>
+            <Select value={kycFilter} onValueChange={setKycFilter}>
+              <SelectTrigger className="w-full md:w-36" data-testid="admin-user-kyc-filter"><SelectValue /></SelectTrigger>
+              <SelectContent>
+                <SelectItem value="all">Tum KYC</SelectItem>
+                <SelectItem value="approved">Onaylandi</SelectItem>
+                <SelectItem value="submitted">Bekliyor</SelectItem>
+                <SelectItem value="rejected">Reddedildi</SelectItem>
+                <SelectItem value="pending">Belge Yok</SelectItem>
+              </SelectContent>
+            </Select>
+            <Select value={sort} onValueChange={setSort}>
+              <SelectTrigger className="w-full md:w-40" data-testid="admin-user-sort"><SelectValue /></SelectTrigger>
+              <SelectContent>
+                <SelectItem value="created_at:desc">En Yeni</SelectItem>
+                <SelectItem value="created_at:asc">En Eski</SelectItem>
+                <SelectItem value="name:asc">Ada Gore (A-Z)</SelectItem>
+                <SelectItem value="balance:desc">Bakiye (Yuksek)</SelectItem>
+              </SelectContent>
+            </Select>
           </div>
         </div>
 
@@ -109,7 +157,7 @@ export default function AdminUsers() {
               </TableRow>
             </TableHeader>
             <TableBody>
-              {filtered.map(u => (
+              {users.map(u => (
                 <TableRow key={u.user_id} data-testid={`user-row-${u.user_id}`}>
                   <TableCell>
                     <div>
@@ -192,9 +240,17 @@ export default function AdminUsers() {
                   </TableCell>
                 </TableRow>
               ))}
+              {users.length === 0 && (
+                <TableRow><TableCell colSpan={6} className="text-center py-8 text-slate-400">Kullanici bulunamadi</TableCell></TableRow>
+              )}
             </TableBody>
           </Table>
         </Card>
+        {nextCursor && (
+          <div className="flex justify-center mt-4">
+            <Button variant="outline" onClick={() => fetchUsers(nextCursor)} data-testid="admin-user-load-more">Daha Fazla Yukle</Button>
+          </div>
+        )}
       </div>
     </AdminLayout>
   );